@@ -0,0 +1,259 @@
+"""Header-only audio probes.
+
+Reading format details must not decode audio: WAV (RIFF/RF64), AIFF/AIFC and
+FLAC store sample rate, channels, bit depth and frame count in their headers.
+read_header() answers from one read of the first PROBE_BYTES of the file and
+only issues further small positioned reads for chunk headers that lie beyond
+it (e.g. a data chunk after a large embedded chunk, or trailing smpl chunks).
+It also picks up loop points (WAV `smpl`, AIFF `INST`/`MARK`) and ACID
+tempo/root note (`acid`). Other formats fall back to libsndfile's header
+info, which still does not decode.
+"""
+from __future__ import annotations
+
+import math
+import os
+import struct
+from pathlib import Path
+from typing import Dict, NamedTuple, Optional, Tuple
+
+# bytes read up front; chunk headers beyond this are reached with a seek
+PROBE_BYTES = 16384
+# stop walking pathological files with endless tiny chunks
+MAX_CHUNKS = 256
+
+NOTE_NAMES = ['C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B']
+
+# WAVE_FORMAT_* tags whose frame count follows from data size / block align
+_PCM_TAGS = {1, 3, 0xFFFE}
+
+
+class AudioHeader(NamedTuple):
+    format: str
+    sample_rate: int
+    channels: int
+    bit_depth: Optional[int] = None
+    frames: Optional[int] = None
+    # (start, end) frame of each sampler loop
+    loops: Tuple[Tuple[int, int], ...] = ()
+    # MIDI note number from ACID (root note) or smpl (unity note)
+    root_note: Optional[int] = None
+    acid_bpm: Optional[float] = None
+    acid_beats: Optional[int] = None
+    acid_one_shot: bool = False
+
+    @property
+    def duration(self) -> Optional[float]:
+        return self.frames / float(self.sample_rate) if self.sample_rate and self.frames else None
+
+    @property
+    def root_key(self) -> Optional[str]:
+        return NOTE_NAMES[self.root_note % 12] if self.root_note is not None else None
+
+
+class _Reader:
+    """Positioned reads served from the initial block when possible."""
+
+    def __init__(self, f):
+        self.f = f
+        self.fd = f.fileno()
+        self.head = self._pread(PROBE_BYTES, 0)
+        self.size = os.fstat(self.fd).st_size
+
+    def _pread(self, n: int, offset: int) -> bytes:
+        if hasattr(os, 'pread'):
+            return os.pread(self.fd, n, offset)
+        self.f.seek(offset)
+        return self.f.read(n)
+
+    def read_at(self, offset: int, n: int) -> bytes:
+        if offset + n <= len(self.head):
+            return self.head[offset:offset + n]
+        return self._pread(n, offset)
+
+
+def _chunks(r: _Reader, little: bool):
+    """Yield (id, body offset, declared size) for each top-level chunk."""
+    fmt = '<I' if little else '>I'
+    pos = 12
+    for _ in range(MAX_CHUNKS):
+        hdr = r.read_at(pos, 8)
+        if len(hdr) < 8:
+            return
+        size = struct.unpack(fmt, hdr[4:])[0]
+        yield hdr[:4], pos + 8, size
+        # chunks are word aligned
+        pos += 8 + size + (size & 1)
+        if pos >= r.size:
+            return
+
+
+def _extended_to_float(b: bytes) -> float:
+    """Decode an 80-bit IEEE 754 extended float (AIFF sample rate)."""
+    exp, mant = struct.unpack('>HQ', b)
+    sign = -1.0 if exp & 0x8000 else 1.0
+    exp &= 0x7FFF
+    if exp == 0 and mant == 0:
+        return 0.0
+    return sign * math.ldexp(mant, exp - 16383 - 63)
+
+
+def _parse_wav(r: _Reader, kind: str) -> Optional[AudioHeader]:
+    fields: Dict = {}
+    fmt = None
+    data_size = None
+    ds64_data = None
+    fact_frames = None
+    for cid, off, size in _chunks(r, little=True):
+        if cid == b'ds64':
+            body = r.read_at(off, 28)
+            if len(body) >= 24:
+                ds64_data = struct.unpack('<Q', body[8:16])[0]
+                fact_frames = struct.unpack('<Q', body[16:24])[0] or fact_frames
+        elif cid == b'fmt ':
+            body = r.read_at(off, min(size, 40))
+            if len(body) < 16:
+                return None
+            tag, channels, rate, _, block_align, bits = struct.unpack('<HHIIHH', body[:16])
+            if tag == 0xFFFE and len(body) >= 20:
+                # WAVE_FORMAT_EXTENSIBLE: valid bits per sample
+                bits = struct.unpack('<H', body[18:20])[0] or bits
+            fmt = (tag, channels, rate, block_align, bits)
+        elif cid == b'fact':
+            body = r.read_at(off, 4)
+            if len(body) == 4 and fact_frames is None:
+                fact_frames = struct.unpack('<I', body)[0]
+        elif cid == b'data':
+            data_size = size
+            if size == 0xFFFFFFFF and ds64_data is not None:
+                data_size = ds64_data
+            elif size in (0, 0xFFFFFFFF) or off + size > r.size:
+                # unfinalised header from a streaming writer: data runs to EOF
+                data_size = r.size - off
+        elif cid == b'smpl':
+            body = r.read_at(off, min(size, 36 + 24 * 16))
+            if len(body) >= 36:
+                unity = struct.unpack('<I', body[12:16])[0]
+                n = struct.unpack('<I', body[28:32])[0]
+                loops = []
+                for i in range(min(n, (len(body) - 36) // 24)):
+                    start, end = struct.unpack('<II', body[36 + 24 * i + 8:36 + 24 * i + 16])
+                    loops.append((start, end))
+                fields['loops'] = tuple(loops)
+                if 0 < unity < 128:
+                    fields.setdefault('root_note', unity)
+        elif cid == b'acid':
+            body = r.read_at(off, 24)
+            if len(body) >= 24:
+                flags, root = struct.unpack('<IH', body[:6])
+                beats = struct.unpack('<I', body[12:16])[0]
+                tempo = struct.unpack('<f', body[20:24])[0]
+                fields['acid_one_shot'] = bool(flags & 0x01)
+                if flags & 0x02:
+                    # ACID root note wins over the sampler unity note
+                    fields['root_note'] = root
+                if beats:
+                    fields['acid_beats'] = beats
+                if tempo > 0 and math.isfinite(tempo):
+                    fields['acid_bpm'] = round(float(tempo), 3)
+    if fmt is None:
+        return None
+    tag, channels, rate, block_align, bits = fmt
+    frames = None
+    if tag in _PCM_TAGS and block_align and data_size is not None:
+        frames = data_size // block_align
+    elif fact_frames:
+        frames = fact_frames
+    return AudioHeader(kind, rate, channels, bits or None, frames, **fields)
+
+
+def _parse_aiff(r: _Reader, kind: str) -> Optional[AudioHeader]:
+    comm = None
+    markers: Dict[int, int] = {}
+    sustain: Optional[Tuple[int, int]] = None
+    root_note = None
+    for cid, off, size in _chunks(r, little=False):
+        if cid == b'COMM':
+            body = r.read_at(off, 18)
+            if len(body) < 18:
+                return None
+            channels, frames, bits = struct.unpack('>hIh', body[:8])
+            comm = (channels, frames, bits, _extended_to_float(body[8:18]))
+        elif cid == b'MARK':
+            body = r.read_at(off, min(size, 65536))
+            if len(body) >= 2:
+                n = struct.unpack('>H', body[:2])[0]
+                p = 2
+                for _ in range(n):
+                    if p + 7 > len(body):
+                        break
+                    mid, position, name_len = struct.unpack('>hIB', body[p:p + 7])
+                    markers[mid] = position
+                    # pstring, padded to an even total length
+                    p += 7 + name_len + ((name_len + 1) & 1)
+        elif cid == b'INST':
+            body = r.read_at(off, 20)
+            if len(body) >= 14:
+                root_note = body[0] or None
+                play_mode, begin_id, end_id = struct.unpack('>hhh', body[8:14])
+                if play_mode:
+                    sustain = (begin_id, end_id)
+    if comm is None:
+        return None
+    channels, frames, bits, rate = comm
+    loops: Tuple[Tuple[int, int], ...] = ()
+    if sustain and sustain[0] in markers and sustain[1] in markers:
+        loops = ((markers[sustain[0]], markers[sustain[1]]),)
+    return AudioHeader(kind, int(rate), channels, bits or None, frames, loops=loops, root_note=root_note)
+
+
+def _parse_flac(r: _Reader) -> Optional[AudioHeader]:
+    # fLaC marker, then STREAMINFO is always the first metadata block
+    info = r.read_at(8, 18)
+    if len(info) < 18:
+        return None
+    packed = int.from_bytes(info[10:18], 'big')
+    rate = packed >> 44
+    channels = ((packed >> 41) & 0x7) + 1
+    bits = ((packed >> 36) & 0x1F) + 1
+    total = packed & ((1 << 36) - 1)
+    return AudioHeader('flac', rate, channels, bits, total or None)
+
+
+_SUBTYPE_BITS = {'FLOAT': 32, 'DOUBLE': 64}
+
+
+def _soundfile_header(path: Path | str) -> Optional[AudioHeader]:
+    try:
+        import soundfile as sf
+        info = sf.info(str(path))
+    except Exception:
+        return None
+    bits = _SUBTYPE_BITS.get(info.subtype)
+    if bits is None and info.subtype.startswith('PCM_'):
+        digits = ''.join(ch for ch in info.subtype if ch.isdigit())
+        bits = int(digits) if digits else None
+    return AudioHeader(info.format.lower(), info.samplerate, info.channels, bits, info.frames or None)
+
+
+def read_header(path: Path | str) -> Optional[AudioHeader]:
+    """Format details from the file header, or None if the file can't be read."""
+    try:
+        with open(path, 'rb') as f:
+            r = _Reader(f)
+            head = r.head
+            if head[:4] in (b'RIFF', b'RF64', b'BW64') and head[8:12] == b'WAVE':
+                return _parse_wav(r, 'wav' if head[:4] == b'RIFF' else 'rf64')
+            if head[:4] == b'FORM' and head[8:12] in (b'AIFF', b'AIFC'):
+                return _parse_aiff(r, head[8:12].decode('ascii').lower())
+            if head[:4] == b'fLaC':
+                return _parse_flac(r)
+    except (OSError, struct.error):
+        return None
+    return _soundfile_header(path)
+
+
+def probe_duration(path: Path | str) -> Optional[float]:
+    """Duration in seconds from the file header, or None if unknown."""
+    h = read_header(path)
+    return h.duration if h is not None else None
@@ -3,16 +3,40 @@ from pathlib import Path
 from typing import Dict, List, Tuple, Optional
 
 from .db import get_conn, init_db
+from .classifier import AUTOTAG_CLASSIFIER
 
 try:
     from .dsp import extract_audio_metadata
 except Exception:
     extract_audio_metadata = None
 
+# Confidence per keyword tag (see classifier.AUTOTAG_RULES), in emit order.
+TAG_CONFIDENCE = {
+    'loop': 0.9,
+    'vocal': 0.95,
+    'kick': 0.9,
+    'snare': 0.9,
+    'hat': 0.9,
+    'tom': 0.85,
+    'fill': 0.9,
+    'cymbal': 0.9,
+    'percussion': 0.85,
+    'bass': 0.9,
+    'melodic': 0.8,
+    'fx': 0.8,
+}
+# tags also granted when the parser's instrument hint contains the tag name
+INSTRUMENT_TAGS = ('vocal', 'kick', 'snare')
+# DSP loop probability (envelope.py) above/below which an unlabeled sample is
+# tagged loop / one_shot
+LOOP_TAG_PROBABILITY = 0.8
+ONE_SHOT_TAG_PROBABILITY = 0.2
+
 
 def generate_autotags_from_parsed(parsed: dict, metadata: Optional[dict]) -> List[Tuple[str, float]]:
     """Rule-based baseline that returns list of (tag, confidence).
-    Uses parsed filename tokens and optional DSP metadata (bpm, duration, key).
+    Uses parsed filename tokens and optional DSP metadata (bpm, duration, key,
+    loop_probability).
     Confidence is a heuristic in [0, 1].
     """
     tags: List[Tuple[str, float]] = []
@@ -27,37 +51,22 @@ def generate_autotags_from_parsed(parsed: dict, metadata: Optional[dict]) -> Lis
     def add(tag: str, conf: float):
         tags.append((tag, max(0.0, min(1.0, float(conf)))))
 
-    # basic categories
-    if 'loop' in name_l or any('loop' in (t.lower() if isinstance(t, str) else '') for t in tokens):
-        add('loop', 0.9)
-        if bpm_hint:
-            add('loop:bpm_hint', 0.7)
-    # vocals
-    if any(k in name_l for k in ('vocal', 'vox', 'voice', 'singer', 'vocalhit', 'vocal_hit')) or ('vocal' in (instrument or '').lower()):
-        add('vocal', 0.95)
-    # drum one-shots / types
-    if any(k in name_l for k in ('kick', 'bd', 'kickloop')) or ('kick' in (instrument or '').lower()):
-        add('kick', 0.9)
-    if any(k in name_l for k in ('snare', 'sn')) or ('snare' in (instrument or '').lower()):
-        add('snare', 0.9)
-    if any(k in name_l for k in ('hat', 'hihat', 'hh')):
-        add('hat', 0.9)
-    if any(k in name_l for k in ('tom',)):
-        add('tom', 0.85)
-    if any(k in name_l for k in ('fill', 'fills', 'drumfill')):
-        add('fill', 0.9)
-    if any(k in name_l for k in ('cymbal', 'crash', 'ride', 'splash', 'china')):
-        add('cymbal', 0.9)
-    if any(k in name_l for k in ('perc', 'percussion', 'shaker', 'bongo', 'conga')):
-        add('percussion', 0.85)
+    # one pass over the filename for every keyword rule
+    hits = set(AUTOTAG_CLASSIFIER.categories(name_l))
+    # parsed dicts from parse_filename carry no 'original', only tokens
+    if 'loop' not in hits and any('loop' in (t.lower() if isinstance(t, str) else '') for t in tokens):
+        hits.add('loop')
+    instrument_l = (instrument or '').lower()
+    for tag in INSTRUMENT_TAGS:
+        if tag in instrument_l:
+            hits.add(tag)
 
-    # melodic / bass / fx
-    if any(k in name_l for k in ('bass', 'sub', '808')):
-        add('bass', 0.9)
-    if any(k in name_l for k in ('pad', 'lead', 'synth', 'plucked', 'melody', 'arp')):
-        add('melodic', 0.8)
-    if any(k in name_l for k in ('fx', 'impact', 'sweep', 'whoosh')):
-        add('fx', 0.8)
+    for tag, conf in TAG_CONFIDENCE.items():
+        if tag not in hits:
+            continue
+        add(tag, conf)
+        if tag == 'loop' and bpm_hint:
+            add('loop:bpm_hint', 0.7)
 
     # use DSP metadata to boost confidence for loops when duration >= 2s
     if metadata:
@@ -77,6 +86,13 @@ def generate_autotags_from_parsed(parsed: dict, metadata: Optional[dict]) -> Lis
                 add('bpm_detected', 0.6)
             except Exception:
                 pass
+        # the envelope tells loops from one-shots when the name doesn't
+        prob = metadata.get('loop_probability')
+        if prob is not None and 'loop' not in hits:
+            if prob >= LOOP_TAG_PROBABILITY:
+                add('loop', 0.9 * prob)
+            elif prob <= ONE_SHOT_TAG_PROBABILITY:
+                add('one_shot', 0.9 * (1.0 - prob))
     # fallback tag
     if not tags:
         add('one_shot', 0.4)
@@ -100,7 +116,7 @@ def run_autotag_pass(roots: List[str], db_path: Optional[str] = None, dry_run: b
     root0 = str(Path(roots[0]).resolve()) if roots else None
     cur = conn.cursor()
     params = []
-    q = "SELECT id, full_path, filename, parsed_tokens, bpm, duration FROM samples"
+    q = "SELECT id, full_path, filename, parsed_tokens, bpm, duration, loop_probability FROM samples"
     if root0:
         q += " WHERE root_dir = ?"
         params.append(root0)
@@ -129,7 +145,7 @@ def run_autotag_pass(roots: List[str], db_path: Optional[str] = None, dry_run: b
             parsed = {'tokens': []}
         parsed.setdefault('original', fname)
         parsed.setdefault('tokens', parsed.get('tokens') or [])
-        meta = {'bpm': r['bpm'], 'duration': r['duration']}
+        meta = {'bpm': r['bpm'], 'duration': r['duration'], 'loop_probability': r['loop_probability']}
         tags = generate_autotags_from_parsed(parsed, meta)
         for tag, conf in tags:
             tag_counts[tag] = tag_counts.get(tag, 0) + 1
@@ -0,0 +1,137 @@
+"""Keyword classifier shared by the scanner, autotagger and sorting tools.
+
+A rule set is an ordered list of (label, keywords). All keywords are compiled
+into a single trie-shaped regex inside a zero-width lookahead, so one pass
+over a filename finds the longest keyword starting at every position. Every
+shorter keyword that is a substring of a found keyword is implied by it
+(precomputed once), which together gives exactly the set of keywords
+occurring in the name -- the same answer as `any(k in name for k in ...)`
+per rule, in one scan.
+"""
+from __future__ import annotations
+
+import re
+from typing import Dict, FrozenSet, Iterable, List, Optional, Sequence, Tuple
+
+Rules = Sequence[Tuple[str, Iterable[str]]]
+
+
+def _trie_pattern(keywords: Iterable[str]) -> str:
+    """Regex matching the longest of `keywords` at a position. Shared prefixes
+    are factored out so the engine walks a trie instead of trying every
+    alternative in turn."""
+    trie: dict = {}
+    for kw in keywords:
+        node = trie
+        for ch in kw:
+            node = node.setdefault(ch, {})
+        node[''] = {}  # end-of-keyword marker
+
+    def build(node: dict) -> str:
+        alts = [re.escape(ch) + build(child) for ch, child in sorted(node.items()) if ch]
+        if not alts:
+            return ''
+        body = alts[0] if len(alts) == 1 else '(?:' + '|'.join(alts) + ')'
+        # greedy optional: prefer continuing to a longer keyword
+        return '(?:' + body + ')?' if '' in node else body
+
+    return build(trie)
+
+
+class KeywordClassifier:
+    def __init__(self, rules: Rules):
+        self.labels: List[str] = []
+        kw_rules: Dict[str, set] = {}
+        for idx, (label, keywords) in enumerate(rules):
+            self.labels.append(label)
+            for kw in keywords:
+                kw = kw.lower()
+                if kw:
+                    kw_rules.setdefault(kw, set()).add(idx)
+        keywords = sorted(kw_rules)
+        self._re = re.compile('(?=(' + _trie_pattern(keywords) + '))') if keywords else None
+        # rule indices implied by each keyword, including keywords nested inside it
+        self._implied: Dict[str, FrozenSet[int]] = {}
+        for kw in keywords:
+            hit = set()
+            for other, idxs in kw_rules.items():
+                if len(other) <= len(kw) and other in kw:
+                    hit |= idxs
+            self._implied[kw] = frozenset(hit)
+
+    def rule_hits(self, text: str) -> FrozenSet[int]:
+        """Indices of all rules with at least one keyword in `text` (lower-cased)."""
+        if not text or self._re is None:
+            return frozenset()
+        implied = self._implied
+        found = {m.group(1) for m in self._re.finditer(text.lower())}
+        if len(found) == 1:
+            return implied[found.pop()]
+        out: set = set()
+        for kw in found:
+            out |= implied[kw]
+        return frozenset(out)
+
+    def categories(self, text: str) -> List[str]:
+        """Labels of every matching rule, in rule order (duplicates collapsed)."""
+        out: List[str] = []
+        for idx in sorted(self.rule_hits(text)):
+            label = self.labels[idx]
+            if label not in out:
+                out.append(label)
+        return out
+
+    def first(self, text: str) -> Optional[str]:
+        """Label of the first matching rule, or None."""
+        hits = self.rule_hits(text)
+        return self.labels[min(hits)] if hits else None
+
+
+# Scanner routing. Drum subfolders are listed in the scanner's precedence order.
+DRUM_SUBFOLDERS = ['Kicks', 'Snares', 'Hats', 'Toms', 'Fills', 'Cymbals', 'Percussion']
+
+SCANNER_RULES: List[Tuple[str, Tuple[str, ...]]] = [
+    ('vocal', ("vocal", "vox", "voice", "singer", "vocalhit", "vocal_hit", "vocoder", "vocal_loop")),
+    ('drum', ("drum", "snare", "kick", "hat", "hihat", "hh", "tom", "fill", "fills", "cymbal", "crash", "ride", "shaker", "perc", "percussion", "one_shot", "one-shot")),
+    ('loop', ("loop",)),
+    ('Kicks', ("kick", "bd", "bassdrum")),
+    ('Snares', ("snare", "sn")),
+    ('Hats', ("hat", "hihat", "hh")),
+    ('Toms', ("tom",)),
+    ('Fills', ("fill", "fills", "drumfill")),
+    ('Cymbals', ("cymbal", "crash", "ride", "splash", "china")),
+    ('Percussion', ("shaker", "perc", "percussion", "conga", "bongo")),
+]
+
+# Applied to the parser's instrument hint rather than the filename.
+INSTRUMENT_RULES: List[Tuple[str, Tuple[str, ...]]] = [
+    ('vocal', ("vocal", "vox", "voice")),
+    ('drum', ("drum", "snare", "kick", "hat", "tom", "perc", "percussion")),
+    ('Kicks', ("kick",)),
+    ('Snares', ("snare",)),
+]
+
+AUTOTAG_RULES: List[Tuple[str, Tuple[str, ...]]] = [
+    ('loop', ('loop',)),
+    ('vocal', ('vocal', 'vox', 'voice', 'singer', 'vocalhit', 'vocal_hit')),
+    ('kick', ('kick', 'bd', 'kickloop')),
+    ('snare', ('snare', 'sn')),
+    ('hat', ('hat', 'hihat', 'hh')),
+    ('tom', ('tom',)),
+    ('fill', ('fill', 'fills', 'drumfill')),
+    ('cymbal', ('cymbal', 'crash', 'ride', 'splash', 'china')),
+    ('percussion', ('perc', 'percussion', 'shaker', 'bongo', 'conga')),
+    ('bass', ('bass', 'sub', '808')),
+    ('melodic', ('pad', 'lead', 'synth', 'plucked', 'melody', 'arp')),
+    ('fx', ('fx', 'impact', 'sweep', 'whoosh')),
+]
+
+SCANNER_CLASSIFIER = KeywordClassifier(SCANNER_RULES)
+INSTRUMENT_CLASSIFIER = KeywordClassifier(INSTRUMENT_RULES)
+AUTOTAG_CLASSIFIER = KeywordClassifier(AUTOTAG_RULES)
+
+
+def compile_keyword_map(keyword_map: Sequence[Tuple[Iterable[str], str]]) -> KeywordClassifier:
+    """Compile a refine_sorting style [(keywords, rel_folder), ...] map;
+    `first()` then returns the folder of the first matching entry."""
+    return KeywordClassifier([(rel, kws) for kws, rel in keyword_map])
@@ -1,13 +1,40 @@
+import base64
 import sqlite3
 import json
+import threading
 from pathlib import Path
-from typing import Optional
+from typing import Dict, Iterable, Optional
+
+from .embeddings import put_embeddings
+from .landmarks import decode as decode_landmarks
 
 DB_PATH = Path(__file__).resolve().parent / "kass.db"
 
 # In-process cancel registry to allow immediate visibility for jobs cancelled
 # via db helper within the same Python process (useful for tests and in-process control)
-_inproc_cancel_registry: dict[str, int] = {}
+_inproc_cancel_registry: dict[str, threading.Event] = {}
+_inproc_cancel_lock = threading.Lock()
+
+
+def cancel_event(job_id: str) -> threading.Event:
+    """Return the in-process cancel event for a scan or DSP job, creating it on first use."""
+    with _inproc_cancel_lock:
+        ev = _inproc_cancel_registry.get(job_id)
+        if ev is None:
+            ev = _inproc_cancel_registry[job_id] = threading.Event()
+        return ev
+
+
+# inverted index over samples.landmarks (see landmarks.py): hash -> sample id
+# and anchor frame. Maintained by the helpers below from the blobs.
+LANDMARK_INDEX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS landmark_index (
+    hash INTEGER,
+    sample_id TEXT,
+    t INTEGER,
+    PRIMARY KEY (hash, sample_id, t)
+) WITHOUT ROWID;
+"""
 
 SCHEMA = """
 PRAGMA journal_mode=WAL;
@@ -31,6 +58,20 @@ CREATE TABLE IF NOT EXISTS samples (
     instrument_hint TEXT,
     fuzzy_score REAL,
     parsed_tokens TEXT,
+    mtime_ns INTEGER,
+    inode INTEGER,
+    dev INTEGER,
+    fingerprint TEXT,
+    bit_depth INTEGER,
+    loop_start INTEGER,
+    loop_end INTEGER,
+    root_note INTEGER,
+    landmarks BLOB,
+    key_confidence REAL,
+    key_margin REAL,
+    chroma BLOB,
+    analysis_policy TEXT,
+    loop_probability REAL,
     added_at DATETIME DEFAULT (datetime('now')),
     updated_at DATETIME DEFAULT (datetime('now'))
 );
@@ -48,6 +89,9 @@ CREATE TABLE IF NOT EXISTS scan_jobs (
     result TEXT,
     error TEXT,
     cancel_requested INTEGER DEFAULT 0,
+    scanned INTEGER DEFAULT 0,
+    total INTEGER DEFAULT 0,
+    throughput REAL,
     started_at DATETIME DEFAULT (datetime('now')),
     finished_at DATETIME
 );
@@ -59,6 +103,7 @@ CREATE TABLE IF NOT EXISTS dsp_jobs (
     db_path TEXT,
     processed INTEGER DEFAULT 0,
     total INTEGER DEFAULT 0,
+    throughput REAL,
     result TEXT,
     error TEXT,
     cancel_requested INTEGER DEFAULT 0,
@@ -75,6 +120,116 @@ CREATE TABLE IF NOT EXISTS autotags (
 );
 
 CREATE INDEX IF NOT EXISTS idx_autotags_sample ON autotags (sample_id);
+
+-- min/max peak pyramid per sample (see waveform.py), written by the DSP pass
+CREATE TABLE IF NOT EXISTS waveforms (
+    sample_id TEXT PRIMARY KEY,
+    data BLOB,
+    created_at DATETIME DEFAULT (datetime('now'))
+);
+
+-- row of each sample's timbre vector in the float32 store next to the DB
+-- (see embeddings.py)
+CREATE TABLE IF NOT EXISTS embeddings (
+    sample_id TEXT PRIMARY KEY,
+    row INTEGER NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_embeddings_row ON embeddings (row);
+
+-- extractor results per audio content (see dsp.analyzer_key), so copies and
+-- moved files are analysed once; values are JSON (dump_analysis/load_analysis)
+CREATE TABLE IF NOT EXISTS analysis_cache (
+    content_hash TEXT NOT NULL,
+    analyzer TEXT NOT NULL,
+    data TEXT NOT NULL,
+    created_at DATETIME DEFAULT (datetime('now')),
+    PRIMARY KEY (content_hash, analyzer)
+) WITHOUT ROWID;
+
+-- samples waiting for the DSP pass (see dsp_queue.py); ready_at is when the
+-- row can next be claimed: 0 when new, the lease expiry while claimed, the
+-- end of the backoff after a failure
+CREATE TABLE IF NOT EXISTS dsp_queue (
+    sample_id TEXT PRIMARY KEY,
+    priority INTEGER NOT NULL DEFAULT 0,
+    enqueued_at REAL NOT NULL,
+    ready_at REAL NOT NULL DEFAULT 0,
+    lease_owner TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT,
+    quarantined INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE INDEX IF NOT EXISTS idx_dsp_queue_claim ON dsp_queue (priority DESC, enqueued_at) WHERE quarantined = 0;
+
+-- DSP results of pruned samples, keyed by quick fingerprint + size so they can
+-- be restored if the same file shows up again
+CREATE TABLE IF NOT EXISTS sample_tombstones (
+    fingerprint TEXT,
+    size_bytes INTEGER,
+    bpm REAL,
+    duration REAL,
+    sample_rate INTEGER,
+    channels INTEGER,
+    content_hash TEXT,
+    key_detected TEXT,
+    bit_depth INTEGER,
+    loop_start INTEGER,
+    loop_end INTEGER,
+    root_note INTEGER,
+    landmarks BLOB,
+    key_confidence REAL,
+    key_margin REAL,
+    chroma BLOB,
+    analysis_policy TEXT,
+    loop_probability REAL,
+    deleted_at DATETIME DEFAULT (datetime('now')),
+    PRIMARY KEY (fingerprint, size_bytes)
+);
+
+""" + LANDMARK_INDEX_SCHEMA
+
+# Columns added after the initial schema. CREATE TABLE IF NOT EXISTS leaves
+# existing databases untouched, so init_db adds any of these that are missing.
+MIGRATIONS = [
+    ('samples', 'mtime_ns', 'INTEGER'),
+    ('samples', 'inode', 'INTEGER'),
+    ('samples', 'dev', 'INTEGER'),
+    ('samples', 'fingerprint', 'TEXT'),
+    ('samples', 'bit_depth', 'INTEGER'),
+    ('samples', 'loop_start', 'INTEGER'),
+    ('samples', 'loop_end', 'INTEGER'),
+    ('samples', 'root_note', 'INTEGER'),
+    ('sample_tombstones', 'bit_depth', 'INTEGER'),
+    ('sample_tombstones', 'loop_start', 'INTEGER'),
+    ('sample_tombstones', 'loop_end', 'INTEGER'),
+    ('sample_tombstones', 'root_note', 'INTEGER'),
+    ('samples', 'landmarks', 'BLOB'),
+    ('sample_tombstones', 'landmarks', 'BLOB'),
+    ('samples', 'analysis_policy', 'TEXT'),
+    ('sample_tombstones', 'analysis_policy', 'TEXT'),
+    ('samples', 'key_confidence', 'REAL'),
+    ('samples', 'key_margin', 'REAL'),
+    ('samples', 'chroma', 'BLOB'),
+    ('sample_tombstones', 'key_confidence', 'REAL'),
+    ('sample_tombstones', 'key_margin', 'REAL'),
+    ('sample_tombstones', 'chroma', 'BLOB'),
+    ('samples', 'loop_probability', 'REAL'),
+    ('sample_tombstones', 'loop_probability', 'REAL'),
+    ('scan_jobs', 'scanned', 'INTEGER DEFAULT 0'),
+    ('scan_jobs', 'total', 'INTEGER DEFAULT 0'),
+    ('scan_jobs', 'throughput', 'REAL'),
+    ('dsp_jobs', 'throughput', 'REAL'),
+]
+
+# Indexes that reference migrated columns; created after MIGRATIONS ran.
+POST_MIGRATION_SCHEMA = """
+CREATE INDEX IF NOT EXISTS idx_samples_root_dir ON samples (root_dir);
+CREATE INDEX IF NOT EXISTS idx_samples_fingerprint ON samples (fingerprint, size_bytes);
+CREATE INDEX IF NOT EXISTS idx_samples_size_hash ON samples (size_bytes, content_hash);
+-- the DSP backlog (dsp_queue.enqueue_unprocessed) without scanning processed rows
+CREATE INDEX IF NOT EXISTS idx_samples_unprocessed ON samples (added_at) WHERE content_hash IS NULL;
 """
 
 
@@ -93,11 +248,60 @@ def init_db(conn: sqlite3.Connection | None = None):
         own_conn = True
     cur = conn.cursor()
     cur.executescript(SCHEMA)
+    _migrate(conn)
+    cur.executescript(POST_MIGRATION_SCHEMA)
+    _migrate_data(conn)
     conn.commit()
     if own_conn:
         conn.close()
 
 
+def _migrate(conn: sqlite3.Connection):
+    existing: dict[str, set] = {}
+    for table, column, decl in MIGRATIONS:
+        if table not in existing:
+            existing[table] = {r[1] for r in conn.execute(f"PRAGMA table_info({table})").fetchall()}
+        if column not in existing[table]:
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+            existing[table].add(column)
+
+
+def _migrate_data(conn: sqlite3.Connection):
+    # reading user_version takes no write lock, so an up-to-date database
+    # initialises alongside a writer
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    for n, step in enumerate(DATA_MIGRATIONS[version:], start=version + 1):
+        conn.execute("BEGIN")
+        try:
+            step(conn)
+            conn.execute(f"PRAGMA user_version = {n}")
+        except BaseException:
+            conn.rollback()
+            raise
+        conn.commit()
+
+
+def _tag_content_hashes(conn: sqlite3.Connection):
+    # content hashes written before they were tagged with their algorithm are sha256
+    for table in ('samples', 'sample_tombstones'):
+        conn.execute(f"UPDATE {table} SET content_hash = 'sha256:' || content_hash WHERE instr(content_hash, ':') = 0")
+
+
+def _key_landmark_index_by_id(conn: sqlite3.Connection):
+    # postings used to point at samples.rowid, which VACUUM may renumber
+    conn.execute("DROP TABLE landmark_index")
+    conn.execute(LANDMARK_INDEX_SCHEMA)
+    index_landmarks(conn, "1")
+
+
+# One-off data rewrites, applied in order once per database in a transaction
+# each; PRAGMA user_version counts the ones already applied. Append only.
+DATA_MIGRATIONS = [
+    _tag_content_hashes,
+    _key_landmark_index_by_id,
+]
+
+
 ### Job helpers
 def create_job(conn: sqlite3.Connection, job_id: str, roots: str, db_path: Optional[str], batch_size: int, min_size: int):
     cur = conn.cursor()
@@ -124,10 +328,13 @@ def mark_job_cancel_requested(conn: sqlite3.Connection, job_id: str):
     cur = conn.cursor()
     cur.execute("UPDATE scan_jobs SET cancel_requested=1 WHERE id=?", (job_id,))
     conn.commit()
-    try:
-        _inproc_cancel_registry[job_id] = 1
-    except Exception:
-        pass
+    cancel_event(job_id).set()
+
+
+def set_job_progress(conn: sqlite3.Connection, job_id: str, scanned: int, total: int, throughput: Optional[float] = None):
+    cur = conn.cursor()
+    cur.execute("UPDATE scan_jobs SET scanned=?, total=?, throughput=? WHERE id=?", (scanned, total, throughput, job_id))
+    conn.commit()
 
 
 def get_job(conn: sqlite3.Connection, job_id: str) -> Optional[sqlite3.Row]:
@@ -146,9 +353,9 @@ def create_dsp_job(conn: sqlite3.Connection, job_id: str, params: str, db_path:
     conn.commit()
 
 
-def set_dsp_progress(conn: sqlite3.Connection, job_id: str, processed: int, total: int):
+def set_dsp_progress(conn: sqlite3.Connection, job_id: str, processed: int, total: int, throughput: Optional[float] = None):
     cur = conn.cursor()
-    cur.execute("UPDATE dsp_jobs SET processed=?, total=? WHERE id=?", (processed, total, job_id))
+    cur.execute("UPDATE dsp_jobs SET processed=?, total=?, throughput=? WHERE id=?", (processed, total, throughput, job_id))
     conn.commit()
 
 
@@ -168,6 +375,7 @@ def mark_dsp_cancel_requested(conn: sqlite3.Connection, job_id: str):
     cur = conn.cursor()
     cur.execute("UPDATE dsp_jobs SET cancel_requested=1 WHERE id=?", (job_id,))
     conn.commit()
+    cancel_event(job_id).set()
 
 
 def get_dsp_job(conn: sqlite3.Connection, job_id: str) -> Optional[sqlite3.Row]:
@@ -178,57 +386,323 @@ def get_dsp_job(conn: sqlite3.Connection, job_id: str) -> Optional[sqlite3.Row]:
 
 def list_dsp_jobs(conn: sqlite3.Connection, limit: int = 100, offset: int = 0):
     cur = conn.cursor()
-    cur.execute('SELECT id, status, params, db_path, processed, total, started_at, finished_at, cancel_requested FROM dsp_jobs ORDER BY started_at DESC LIMIT ? OFFSET ?', (limit, offset))
+    cur.execute('SELECT id, status, params, db_path, processed, total, throughput, started_at, finished_at, cancel_requested FROM dsp_jobs ORDER BY started_at DESC LIMIT ? OFFSET ?', (limit, offset))
     return [dict(r) for r in cur.fetchall()]
 
 
+# Column order shared by the single-row and bulk upsert paths.
+SAMPLE_COLUMNS = (
+    'id', 'full_path', 'rel_path', 'root_dir', 'filename', 'ext', 'size_bytes', 'bpm', 'duration',
+    'sample_rate', 'channels', 'content_hash', 'bpm_hint', 'key_hint', 'key_detected', 'instrument_hint',
+    'fuzzy_score', 'parsed_tokens', 'mtime_ns', 'inode', 'dev', 'fingerprint',
+    'bit_depth', 'loop_start', 'loop_end', 'root_note', 'landmarks', 'analysis_policy',
+    'key_confidence', 'key_margin', 'chroma', 'loop_probability',
+)
+
+# Filled in by the DSP pass. An upsert for the same id (same device/inode and
+# fingerprint, e.g. after a move) keeps them unless the file size changed;
+# values supplied by the caller still win. sample_tombstones mirrors them.
+DSP_COLUMNS = (
+    'bpm', 'duration', 'sample_rate', 'channels', 'content_hash', 'key_detected',
+    'bit_depth', 'loop_start', 'loop_end', 'root_note', 'landmarks', 'analysis_policy',
+    'key_confidence', 'key_margin', 'chroma', 'loop_probability',
+)
+
+
+def _upsert_assignment(c: str) -> str:
+    if c in DSP_COLUMNS:
+        return (f"{c}=CASE WHEN samples.size_bytes IS excluded.size_bytes "
+                f"THEN COALESCE(excluded.{c}, samples.{c}) ELSE excluded.{c} END")
+    return f"{c}=excluded.{c}"
+
+
+# Built once so sqlite3's statement cache reuses the same prepared statement
+# for every row and every batch.
+UPSERT_SAMPLE_SQL = (
+    f"INSERT INTO samples ({', '.join(SAMPLE_COLUMNS)}) VALUES ({', '.join('?' for _ in SAMPLE_COLUMNS)}) "
+    "ON CONFLICT(id) DO UPDATE SET "
+    + ', '.join(_upsert_assignment(c) for c in SAMPLE_COLUMNS if c != 'id')
+    + ", updated_at=CURRENT_TIMESTAMP"
+)
+
+
+def _sample_row(sample: dict) -> tuple:
+    # missing keys become NULL
+    return tuple(map(sample.get, SAMPLE_COLUMNS))
+
+
 def upsert_sample(conn: sqlite3.Connection, sample: dict):
         """Insert or update a sample row. sample is a dict matching table columns."""
-        sql = """
-        INSERT INTO samples (id, full_path, rel_path, root_dir, filename, ext, size_bytes, bpm, duration, sample_rate, channels, content_hash, bpm_hint, key_hint, key_detected, instrument_hint, fuzzy_score, parsed_tokens)
-        VALUES (:id, :full_path, :rel_path, :root_dir, :filename, :ext, :size_bytes, :bpm, :duration, :sample_rate, :channels, :content_hash, :bpm_hint, :key_hint, :key_detected, :instrument_hint, :fuzzy_score, :parsed_tokens)
-        ON CONFLICT(id) DO UPDATE SET
-            full_path=excluded.full_path,
-            rel_path=excluded.rel_path,
-            root_dir=excluded.root_dir,
-            filename=excluded.filename,
-            ext=excluded.ext,
-            size_bytes=excluded.size_bytes,
-            bpm=excluded.bpm,
-            duration=excluded.duration,
-            sample_rate=excluded.sample_rate,
-            channels=excluded.channels,
-            content_hash=excluded.content_hash,
-            bpm_hint=excluded.bpm_hint,
-            key_hint=excluded.key_hint,
-            key_detected=excluded.key_detected,
-            instrument_hint=excluded.instrument_hint,
-            fuzzy_score=excluded.fuzzy_score,
-            parsed_tokens=excluded.parsed_tokens,
-            updated_at=CURRENT_TIMESTAMP;
-        """
-        # ensure all expected params are present (use None as default)
-        params = {
-            'id': sample.get('id'),
-            'full_path': sample.get('full_path'),
-            'rel_path': sample.get('rel_path'),
-            'root_dir': sample.get('root_dir'),
-            'filename': sample.get('filename'),
-            'ext': sample.get('ext'),
-            'size_bytes': sample.get('size_bytes'),
-            'bpm': sample.get('bpm'),
-            'key_detected': sample.get('key_detected'),
-            'duration': sample.get('duration'),
-            'sample_rate': sample.get('sample_rate'),
-            'channels': sample.get('channels'),
-            'content_hash': sample.get('content_hash'),
-            'bpm_hint': sample.get('bpm_hint'),
-            'key_hint': sample.get('key_hint'),
-            'instrument_hint': sample.get('instrument_hint'),
-            'fuzzy_score': sample.get('fuzzy_score'),
-            'parsed_tokens': sample.get('parsed_tokens'),
-        }
-        conn.execute(sql, params)
+        conn.execute(UPSERT_SAMPLE_SQL, _sample_row(sample))
+
+
+def upsert_samples_bulk(conn: sqlite3.Connection, samples) -> int:
+    """Upsert an iterable of sample dicts with one executemany, so a batch
+    can share a transaction with its reconcile and seen-path bookkeeping.
+    Caller commits. Returns the number of rows written."""
+    return conn.executemany(UPSERT_SAMPLE_SQL, map(_sample_row, samples)).rowcount
+
+
+def get_sample_manifest(conn: sqlite3.Connection, roots: list[str]) -> dict[str, tuple]:
+    """Return {full_path: (size_bytes, mtime_ns, inode)} for samples under the given root_dirs."""
+    if not roots:
+        return {}
+    placeholders = ','.join('?' for _ in roots)
+    cur = conn.execute(f"SELECT full_path, size_bytes, mtime_ns, inode FROM samples WHERE root_dir IN ({placeholders})", tuple(roots))
+    return {r[0]: (r[1], r[2], r[3]) for r in cur}
+
+
+def get_loop_probabilities(conn: sqlite3.Connection, roots: list[str]) -> dict[str, float]:
+    """Return {full_path: loop_probability} for analysed samples below the
+    given roots; the scanner routes loops by them."""
+    out: dict[str, float] = {}
+    for root in roots:
+        cur = conn.execute("SELECT full_path, loop_probability FROM samples WHERE full_path >= ? AND full_path < ? "
+                           "AND loop_probability IS NOT NULL", _prefix_bounds(root))
+        out.update((r[0], r[1]) for r in cur)
+    return out
+
+
+def get_fingerprint_collisions(conn: sqlite3.Connection, root: Optional[str] = None) -> list:
+    """Rows sharing (size_bytes, fingerprint) with at least one other row --
+    the only candidates for a full-hash duplicate check.
+    Columns: id, full_path, size_bytes, fingerprint, content_hash."""
+    where = "WHERE fingerprint IS NOT NULL" + (" AND root_dir = ?" if root else "")
+    return conn.execute(
+        "SELECT id, full_path, size_bytes, fingerprint, content_hash FROM ("
+        "SELECT *, COUNT(*) OVER (PARTITION BY size_bytes, fingerprint) AS n "
+        f"FROM samples {where}) WHERE n > 1",
+        (root,) if root else (),
+    ).fetchall()
+
+
+def _duplicate_filter(root: Optional[str]) -> tuple[str, tuple]:
+    if root:
+        return "content_hash IS NOT NULL AND root_dir = ?", (root,)
+    return "content_hash IS NOT NULL", ()
+
+
+def get_duplicate_groups(conn: sqlite3.Connection, limit: int, after: Optional[tuple] = None, root: Optional[str] = None) -> list:
+    """One page of (size_bytes, content_hash, n) groups with n > 1, largest
+    files first. Keyset paged: pass the last (size_bytes, content_hash) of the
+    previous page as `after`. Reads idx_samples_size_hash in order, so no
+    page needs the whole grouping in memory."""
+    where, params = _duplicate_filter(root)
+    if after is not None:
+        where += " AND (size_bytes, content_hash) < (?, ?)"
+        params += tuple(after)
+    return conn.execute(
+        f"SELECT size_bytes, content_hash, COUNT(*) AS n FROM samples WHERE {where} "
+        "GROUP BY size_bytes, content_hash HAVING COUNT(*) > 1 "
+        "ORDER BY size_bytes DESC, content_hash DESC LIMIT ?",
+        params + (limit,),
+    ).fetchall()
+
+
+def get_duplicate_members(conn: sqlite3.Connection, keys: list[tuple], root: Optional[str] = None) -> list:
+    """Sample rows for the given (size_bytes, content_hash) groups."""
+    if not keys:
+        return []
+    where, params = _duplicate_filter(root)
+    values = ','.join('(?, ?)' for _ in keys)
+    return conn.execute(
+        "SELECT id, full_path, filename, size_bytes, content_hash, added_at FROM samples "
+        f"WHERE {where} AND (size_bytes, content_hash) IN (VALUES {values})",
+        params + tuple(v for k in keys for v in k),
+    ).fetchall()
+
+
+def get_duplicate_stats(conn: sqlite3.Connection, root: Optional[str] = None) -> dict:
+    """Totals over all duplicate groups: groups, redundant copies and the
+    bytes they take up."""
+    where, params = _duplicate_filter(root)
+    r = conn.execute(
+        "SELECT COUNT(*), COALESCE(SUM(n - 1), 0), COALESCE(SUM((n - 1) * size_bytes), 0) FROM ("
+        f"SELECT size_bytes, COUNT(*) AS n FROM samples WHERE {where} "
+        "GROUP BY size_bytes, content_hash HAVING COUNT(*) > 1)",
+        params,
+    ).fetchone()
+    return {'groups': r[0], 'redundant': r[1], 'wasted_bytes': r[2]}
+
+
+# Tombstones older than this are dropped at the next prune.
+TOMBSTONE_TTL_DAYS = 90
+
+_TOMBSTONE_SQL = (
+    f"INSERT OR REPLACE INTO sample_tombstones (fingerprint, size_bytes, {', '.join(DSP_COLUMNS)}) "
+    f"SELECT fingerprint, size_bytes, {', '.join(DSP_COLUMNS)} FROM samples "
+    "WHERE fingerprint IS NOT NULL AND content_hash IS NOT NULL AND "
+)
+
+
+def _prefix_bounds(dir_path: str) -> tuple[str, str]:
+    # range scan on the full_path unique index instead of LIKE (paths may contain % or _)
+    prefix = dir_path.rstrip('/') + '/'
+    return prefix, prefix[:-1] + chr(ord('/') + 1)
+
+
+# Tables keyed by sample_id whose rows follow their sample: re-keyed when a
+# legacy row adopts a stable id and deleted along with it.
+SAMPLE_CHILD_TABLES = ('autotags', 'waveforms', 'embeddings', 'dsp_queue')
+
+
+def _delete_children(conn: sqlite3.Connection, where: str, params_seq):
+    """Delete child rows of the samples matching `where` (before the samples)."""
+    params_seq = list(params_seq)
+    for table in SAMPLE_CHILD_TABLES:
+        conn.executemany(f"DELETE FROM {table} WHERE sample_id IN (SELECT id FROM samples WHERE {where})", params_seq)
+
+
+def _landmark_postings(conn: sqlite3.Connection, where: str, params_seq) -> list[tuple]:
+    """(hash, sample_id, t) rows for the landmark blobs of matching samples."""
+    rows = []
+    for params in params_seq:
+        for sample_id, blob in conn.execute(f"SELECT id, landmarks FROM samples WHERE landmarks IS NOT NULL AND {where}", params):
+            hashes, times = decode_landmarks(blob)
+            rows.extend((h, sample_id, t) for h, t in zip(hashes.tolist(), times.tolist()))
+    return rows
+
+
+def unindex_landmarks(conn: sqlite3.Connection, where: str, params_seq=((),)):
+    """Drop landmark_index rows of the samples matching `where`, before their
+    blobs are deleted or overwritten. Caller commits."""
+    if conn.execute("SELECT 1 FROM landmark_index LIMIT 1").fetchone() is None:
+        return
+    conn.executemany(
+        "DELETE FROM landmark_index WHERE hash=? AND sample_id=? AND t=?",
+        _landmark_postings(conn, where, params_seq),
+    )
+
+
+def index_landmarks(conn: sqlite3.Connection, where: str, params_seq=((),)):
+    """Add landmark_index rows for the samples matching `where`. Caller commits."""
+    conn.executemany(
+        "INSERT OR IGNORE INTO landmark_index (hash, sample_id, t) VALUES (?, ?, ?)",
+        _landmark_postings(conn, where, params_seq),
+    )
+
+
+def get_landmark_postings(conn: sqlite3.Connection, hashes: list[int], exclude_id: Optional[str] = None, max_postings: int = 1000) -> list:
+    """(sample_id, hash, t) postings for the given hashes. Hashes with more
+    than `max_postings` postings are too common to tell samples apart and
+    are skipped, which also bounds the cost of a lookup."""
+    out = []
+    for h in hashes:
+        rows = conn.execute(
+            "SELECT sample_id, hash, t FROM landmark_index WHERE hash = ? LIMIT ?", (h, max_postings + 1)
+        ).fetchall()
+        if len(rows) <= max_postings:
+            out.extend(r for r in rows if r[0] != exclude_id)
+    return out
+
+
+def delete_samples_by_path(conn: sqlite3.Connection, paths: list[str], tombstone: bool = False) -> int:
+    """Delete sample rows (and their child rows) by full_path. Caller commits.
+    Returns the number of sample rows removed."""
+    rows = [(p,) for p in paths]
+    if tombstone:
+        conn.executemany(_TOMBSTONE_SQL + "full_path=?", rows)
+    unindex_landmarks(conn, "full_path=?", rows)
+    _delete_children(conn, "full_path=?", rows)
+    return max(conn.executemany("DELETE FROM samples WHERE full_path=?", rows).rowcount, 0)
+
+
+def delete_samples_under(conn: sqlite3.Connection, dir_path: str, tombstone: bool = False) -> int:
+    """Delete sample rows for every file below a directory. Caller commits."""
+    bounds = _prefix_bounds(dir_path)
+    if tombstone:
+        conn.execute(_TOMBSTONE_SQL + "full_path >= ? AND full_path < ?", bounds)
+    unindex_landmarks(conn, "full_path >= ? AND full_path < ?", (bounds,))
+    _delete_children(conn, "full_path >= ? AND full_path < ?", (bounds,))
+    return conn.execute("DELETE FROM samples WHERE full_path >= ? AND full_path < ?", bounds).rowcount
+
+
+def reconcile_samples(conn: sqlite3.Connection, samples: list[dict]) -> int:
+    """Line existing rows up with incoming samples so the following upsert
+    updates them in place. Caller commits. Returns how many samples are
+    already indexed under another path (moves/renames).
+
+    - rows indexed before stable ids (no fingerprint) at the same path adopt
+      the new id, keeping their DSP results and autotags;
+    - rows that are moving have their path cleared first, so files trading
+      places within one batch don't trip the full_path unique constraint;
+    - rows left at one of the incoming paths under another id belong to a
+      file that was replaced there and are dropped.
+    """
+    if not samples:
+        return 0
+    adopt = [(s['id'], s['full_path'], s['id']) for s in samples]
+    for table in SAMPLE_CHILD_TABLES:
+        conn.executemany(
+            f"UPDATE OR IGNORE {table} SET sample_id=? WHERE sample_id=(SELECT id FROM samples WHERE full_path=? AND fingerprint IS NULL AND id<>?)",
+            adopt,
+        )
+    # landmark postings are keyed by id: move them along with the row
+    unindex_landmarks(conn, "id<>? AND full_path=? AND fingerprint IS NULL", [(a[2], a[1]) for a in adopt])
+    conn.executemany("UPDATE OR IGNORE samples SET id=? WHERE full_path=? AND fingerprint IS NULL AND id<>?", adopt)
+    index_landmarks(conn, "id=? AND fingerprint IS NULL", [(a[0],) for a in adopt])
+    # the upsert clears DSP results (landmarks included) of resized files
+    resized = [(s['id'], s['size_bytes']) for s in samples]
+    unindex_landmarks(conn, "id=? AND size_bytes IS NOT ?", resized)
+    for table in ('waveforms', 'embeddings'):
+        conn.executemany(f"DELETE FROM {table} WHERE sample_id IN (SELECT id FROM samples WHERE id=? AND size_bytes IS NOT ?)", resized)
+    cur = conn.executemany("UPDATE samples SET full_path=NULL WHERE id=? AND full_path IS NOT ?", [(s['id'], s['full_path']) for s in samples])
+    moved = max(cur.rowcount, 0)
+    replaced = [(s['full_path'], s['id']) for s in samples]
+    unindex_landmarks(conn, "full_path=? AND id<>?", replaced)
+    _delete_children(conn, "full_path=? AND id<>?", replaced)
+    conn.executemany("DELETE FROM samples WHERE full_path=? AND id<>?", replaced)
+    return moved
+
+
+def reset_seen_paths(conn: sqlite3.Connection):
+    """(Re)create the connection-local table of paths seen by a scan."""
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS seen_paths (full_path TEXT PRIMARY KEY) WITHOUT ROWID")
+    conn.execute("DELETE FROM temp.seen_paths")
+
+
+def add_seen_paths(conn: sqlite3.Connection, paths):
+    conn.executemany("INSERT OR IGNORE INTO temp.seen_paths (full_path) VALUES (?)", ((p,) for p in paths))
+
+
+def prune_unseen_samples(conn: sqlite3.Connection, root: str, tombstone: bool = True, exts: Optional[Iterable[str]] = None) -> int:
+    """Delete rows below `root` whose path is not in temp.seen_paths, with one
+    anti-join per statement. With `exts`, only rows with one of those
+    extensions are candidates: a scan limited to some file types says nothing
+    about the others. Caller commits. Returns the number removed."""
+    bounds = _prefix_bounds(root)
+    unseen = ("full_path >= ? AND full_path < ? AND NOT EXISTS "
+              "(SELECT 1 FROM temp.seen_paths s WHERE s.full_path = samples.full_path)")
+    params = bounds
+    if exts is not None:
+        exts = sorted(exts)
+        unseen += f" AND ext IN ({','.join('?' for _ in exts)})"
+        params = (*bounds, *exts)
+    if tombstone:
+        conn.execute("DELETE FROM sample_tombstones WHERE deleted_at < datetime('now', ?)", (f'-{TOMBSTONE_TTL_DAYS} days',))
+        conn.execute(_TOMBSTONE_SQL + unseen, params)
+    unindex_landmarks(conn, unseen, (params,))
+    _delete_children(conn, unseen, (params,))
+    return conn.execute(f"DELETE FROM samples WHERE {unseen}", params).rowcount
+
+
+_RESTORE_SQL = (
+    f"UPDATE samples SET ({', '.join(DSP_COLUMNS)}) = "
+    f"(SELECT {', '.join(DSP_COLUMNS)} FROM sample_tombstones t "
+    "WHERE t.fingerprint = samples.fingerprint AND t.size_bytes = samples.size_bytes) "
+    "WHERE id=? AND content_hash IS NULL AND EXISTS (SELECT 1 FROM sample_tombstones t "
+    "WHERE t.fingerprint = samples.fingerprint AND t.size_bytes = samples.size_bytes)"
+)
+
+
+def restore_from_tombstones(conn: sqlite3.Connection, samples: list[dict]) -> int:
+    """Copy tombstoned DSP results onto freshly upserted samples that have
+    none yet. Caller commits. Returns the number of rows restored."""
+    if not samples or conn.execute("SELECT 1 FROM sample_tombstones LIMIT 1").fetchone() is None:
+        return 0
+    restored = [(s['id'],) for s in samples if conn.execute(_RESTORE_SQL, (s['id'],)).rowcount > 0]
+    index_landmarks(conn, "id=?", restored)
+    return len(restored)
 
 
 def upsert_autotag(conn: sqlite3.Connection, sample_id: str, tag: str, confidence: float):
@@ -246,21 +720,99 @@ def get_autotags_for_sample(conn: sqlite3.Connection, sample_id: str):
     return cur.fetchall()
 
 
-def get_unprocessed_samples(conn: sqlite3.Connection, limit: int = 500):
-    cur = conn.cursor()
-    cur.execute("SELECT id, full_path FROM samples WHERE content_hash IS NULL LIMIT ?", (limit,))
-    return cur.fetchall()
+# Written by the DSP pass; every DSP column comes from the metadata dict.
+UPDATE_METADATA_SQL = (
+    f"UPDATE samples SET {', '.join(c + '=?' for c in DSP_COLUMNS)}, updated_at=CURRENT_TIMESTAMP WHERE id=?"
+)
+
+
+def _metadata_row(sample_id: str, metadata: dict) -> tuple:
+    return tuple(map(metadata.get, DSP_COLUMNS)) + (sample_id,)
 
 
 def update_sample_metadata(conn: sqlite3.Connection, sample_id: str, metadata: dict):
-    cur = conn.cursor()
-    cur.execute(
-        """
-        UPDATE samples SET bpm=?, duration=?, sample_rate=?, channels=?, content_hash=?, key_detected=?, updated_at=CURRENT_TIMESTAMP WHERE id=?
-        """,
-        (metadata.get('bpm'), metadata.get('duration'), metadata.get('sample_rate'), metadata.get('channels'), metadata.get('content_hash'), metadata.get('key_detected'), sample_id),
+    update_samples_metadata_bulk(conn, [(sample_id, metadata)])
+
+
+def update_samples_metadata_bulk(conn: sqlite3.Connection, items) -> int:
+    """Write DSP results for many samples in one transaction. `items` is an
+    iterable of (sample_id, metadata dict). Returns the number of rows updated."""
+    items = list(items)
+    ids = [(sid,) for sid, _ in items]
+    with conn:
+        unindex_landmarks(conn, "id=?", ids)
+        cur = conn.executemany(UPDATE_METADATA_SQL, (_metadata_row(sid, meta) for sid, meta in items))
+        index_landmarks(conn, "id=?", ids)
+        # analysed: off the DSP work queue
+        conn.executemany("DELETE FROM dsp_queue WHERE sample_id=?", ids)
+        put_waveforms(conn, [(sid, meta['waveform']) for sid, meta in items if meta.get('waveform')])
+        put_embeddings(conn, [(sid, meta['timbre']) for sid, meta in items if meta.get('timbre')])
+        put_cached_analyses(conn, [
+            (meta['content_hash'], analyzer, result)
+            for _, meta in items if meta.get('content_hash')
+            for analyzer, result in (meta.get('analyses') or {}).items()
+        ])
+    return cur.rowcount
+
+
+def dump_analysis(result: dict) -> str:
+    """JSON for an extractor result; bytes values become {"b64": ...}."""
+    return json.dumps({k: {'b64': base64.b64encode(v).decode()} if isinstance(v, bytes) else v for k, v in result.items()})
+
+
+def load_analysis(data: str) -> dict:
+    return {k: base64.b64decode(v['b64']) if isinstance(v, dict) else v for k, v in json.loads(data).items()}
+
+
+def get_cached_analyses(conn: sqlite3.Connection, content_hash: str, analyzers) -> Dict[str, dict]:
+    """{analyzer: result} for the given analyzer keys cached for this content."""
+    analyzers = list(analyzers)
+    if not analyzers:
+        return {}
+    placeholders = ','.join('?' for _ in analyzers)
+    rows = conn.execute(
+        f"SELECT analyzer, data FROM analysis_cache WHERE content_hash=? AND analyzer IN ({placeholders})",
+        (content_hash, *analyzers),
     )
-    conn.commit()
+    return {r[0]: load_analysis(r[1]) for r in rows}
+
+
+def put_cached_analyses(conn: sqlite3.Connection, items):
+    """Store (content_hash, analyzer, result dict) triples. Caller commits."""
+    conn.executemany(
+        "INSERT OR REPLACE INTO analysis_cache (content_hash, analyzer, data) VALUES (?, ?, ?)",
+        ((h, a, dump_analysis(r)) for h, a, r in items),
+    )
+
+
+def prune_analysis_cache(conn: sqlite3.Connection, current_analyzers=None) -> int:
+    """Drop cache entries of content no sample or tombstone has any more and,
+    if `current_analyzers` is given, entries from other analyzer versions."""
+    where = ["content_hash NOT IN (SELECT content_hash FROM samples WHERE content_hash IS NOT NULL "
+             "UNION SELECT content_hash FROM sample_tombstones WHERE content_hash IS NOT NULL)"]
+    params: list = []
+    if current_analyzers is not None:
+        current = list(current_analyzers)
+        where.append(f"analyzer NOT IN ({','.join('?' for _ in current)})" if current else "1")
+        params.extend(current)
+    with conn:
+        cur = conn.execute(f"DELETE FROM analysis_cache WHERE {' OR '.join(where)}", params)
+    return cur.rowcount
+
+
+def put_waveforms(conn: sqlite3.Connection, items):
+    """Store (sample_id, waveform blob) pairs. Caller commits."""
+    conn.executemany("INSERT OR REPLACE INTO waveforms (sample_id, data) VALUES (?, ?)", items)
+
+
+def get_waveform(conn: sqlite3.Connection, sample_id: str) -> Optional[sqlite3.Row]:
+    """(full_path, content_hash, data) for a sample; data is None when no
+    waveform is stored. None if the sample doesn't exist."""
+    return conn.execute(
+        "SELECT s.full_path, s.content_hash, w.data FROM samples s "
+        "LEFT JOIN waveforms w ON w.sample_id = s.id WHERE s.id=?",
+        (sample_id,),
+    ).fetchone()
 
 
 if __name__ == "__main__":
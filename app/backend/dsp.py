@@ -1,113 +1,371 @@
-import hashlib
+import io
 import json
+import os
 from pathlib import Path
-from typing import Dict
+from functools import cached_property
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple
 
 import soundfile as sf
 import numpy as np
 import warnings
 
+from .audio_probe import read_header
+from .hashing import hash_bytes, hash_file
+
 # Suppress known DeprecationWarning from audioread internals on newer Python
 warnings.filterwarnings("ignore", category=DeprecationWarning, module="audioread.rawread")
 
 
-def sha256_file(path: Path, chunk_size: int = 65536) -> str:
-    h = hashlib.sha256()
-    with open(path, 'rb') as f:
-        while True:
-            chunk = f.read(chunk_size)
-            if not chunk:
-                break
-            h.update(chunk)
-    return h.hexdigest()
+class AnalysisPolicy(NamedTuple):
+    """How much of a file the extractors get to see. Audio is mixed to mono
+    and resampled to `target_sr` (None keeps the file's rate); files longer
+    than `max_seconds` (None: no limit) are analysed from `segments` evenly
+    spaced excerpts adding up to that window, the first at the start of the
+    file and the last at its end. `tag` is stored with the results."""
+    target_sr: Optional[int] = 22050
+    max_seconds: Optional[float] = 30.0
+    segments: int = 3
 
+    @property
+    def tag(self) -> str:
+        sr = self.target_sr or 'native'
+        window = f"{self.max_seconds:g}s/{self.segments}" if self.max_seconds else 'full'
+        return f"mono@{sr}:{window}"
 
-def extract_audio_metadata(path: str) -> Dict:
-    p = Path(path)
-    res = {
-        'duration': None,
-        'sample_rate': None,
-        'channels': None,
-        'content_hash': None,
-        'bpm': None,
-    }
+    def spans(self, frames: int, sr: int) -> List[Tuple[int, int]]:
+        """(start, stop) frame ranges to decode from a file of `frames`."""
+        if not self.max_seconds or frames <= self.max_seconds * sr:
+            return [(0, frames)]
+        n = max(1, self.segments)
+        seg = int(self.max_seconds * sr / n)
+        starts = np.linspace(0, frames - seg, n).astype(int)
+        return [(int(a), int(a) + seg) for a in starts]
+
+
+DEFAULT_POLICY = AnalysisPolicy()
+
+# files up to this size are read once, then hashed and decoded from memory;
+# larger ones are hashed in a stream and only the policy's spans are decoded
+INMEMORY_MAX_BYTES = 16 << 20
+
+
+class AudioBuffer:
+    """A decoded file shared by every extractor: mono float32 samples, the
+    source format details, and a lazily computed power spectrogram so
+    extractors that work in the STFT domain share one transform.
+
+    `y` is at `sr` after the analysis policy was applied; `frames` and
+    `source_sr` describe the whole file. For a windowed file `y` is the
+    concatenated excerpts, of which the first `head` samples are contiguous
+    from the start, and `overview` is a waveform of the whole file."""
+
+    # librosa's defaults for onset strength and chroma_stft
+    N_FFT = 2048
+    HOP_LENGTH = 512
+
+    def __init__(self, y: np.ndarray, sr: int, channels: int, frames: int, source_sr: Optional[int] = None,
+                 head: Optional[int] = None, overview=None, policy: AnalysisPolicy = DEFAULT_POLICY):
+        self.y = y
+        self.sr = sr
+        self.channels = channels
+        self.frames = frames
+        self.source_sr = source_sr or sr
+        self.head = len(y) if head is None else head
+        self.overview = overview
+        self.policy = policy
+
+    @property
+    def duration(self) -> Optional[float]:
+        return self.frames / float(self.source_sr) if self.source_sr and self.frames else None
+
+    @property
+    def windowed(self) -> bool:
+        return self.head < len(self.y)
+
+    @property
+    def n_fft(self) -> int:
+        # a safe n_fft to avoid warnings on short signals
+        return min(self.N_FFT, max(256, len(self.y)))
+
+    @cached_property
+    def power_spectrogram(self) -> np.ndarray:
+        import librosa
+        return np.abs(librosa.stft(self.y, n_fft=self.n_fft, hop_length=self.HOP_LENGTH)) ** 2
+
+
+# name -> fn(AudioBuffer) -> dict of sample columns, run in registration order
+EXTRACTORS: Dict[str, Callable[[AudioBuffer], Dict]] = {}
+# name -> version; bump it when an extractor's output changes so only its
+# cached results are recomputed
+EXTRACTOR_VERSIONS: Dict[str, int] = {'format': 1}
+
+# looks up cached results: (content hash, analyzer keys) -> {analyzer key: result}
+CacheLookup = Callable[[str, List[str]], Dict[str, Dict]]
+
+
+def register_extractor(name: str, version: int = 1):
+    """Decorator adding a feature extractor to the pipeline. Extractors get the
+    shared AudioBuffer and return the metadata keys they fill in."""
+    def deco(fn: Callable[[AudioBuffer], Dict]):
+        EXTRACTORS[name] = fn
+        EXTRACTOR_VERSIONS[name] = version
+        return fn
+    return deco
+
+
+def analyzer_key(name: str, policy: AnalysisPolicy = DEFAULT_POLICY) -> str:
+    """Cache key of an extractor's results: its name, version and the policy
+    the audio was decoded under. 'format' is the decoded duration, rate and
+    channels, cached for files without a readable header."""
+    if name == 'format':
+        return f"format/v{EXTRACTOR_VERSIONS['format']}"
+    return f"{name}/v{EXTRACTOR_VERSIONS.get(name, 1)}/{policy.tag}"
+
+
+def _mono(y: np.ndarray) -> np.ndarray:
+    return y.mean(axis=1) if y.shape[1] > 1 else y[:, 0]
+
+
+def _read_spans(source, policy: AnalysisPolicy):
+    """Decode only the policy's spans of `source` (a path or file object)
+    with libsndfile. Returns (mono excerpts, sr, channels, frames, overview);
+    the overview is streamed block by block when the file is windowed."""
+    from . import waveform
+    with sf.SoundFile(source) as f:
+        sr, channels, frames = int(f.samplerate), int(f.channels), int(f.frames)
+        parts = []
+        for start, stop in policy.spans(frames, sr):
+            f.seek(start)
+            parts.append(_mono(f.read(stop - start, dtype='float32', always_2d=True)))
+        overview = None
+        if len(parts) > 1:
+            f.seek(0)
+            blocks = (_mono(b) for b in f.blocks(blocksize=1 << 16, dtype='float32', always_2d=True))
+            overview = waveform.compute_blocks(blocks, frames, frames / float(sr))
+    return parts, sr, channels, frames, overview
+
+
+def _load_spans(path: Path | str, policy: AnalysisPolicy):
+    """librosa fallback for formats libsndfile can't decode (e.g. some
+    mp3s): the same spans, loaded with offset/duration."""
+    import librosa
+    sr = int(librosa.get_samplerate(str(path)))
+    total = librosa.get_duration(path=str(path))
+    frames = int(round(total * sr))
+    spans = policy.spans(frames, sr)
+    if len(spans) == 1:
+        y, sr = librosa.load(str(path), sr=None, mono=False)
+        channels = 1 if y.ndim == 1 else y.shape[0]
+        mono = y if y.ndim == 1 else y.mean(axis=0)
+        return [mono.astype(np.float32, copy=False)], int(sr), int(channels), len(mono), None
+    parts = [
+        librosa.load(str(path), sr=None, mono=True, offset=a / sr, duration=(b - a) / sr)[0].astype(np.float32, copy=False)
+        for a, b in spans
+    ]
+    return parts, sr, 1, frames, None
+
+
+def read_and_hash(path: Path | str) -> Tuple[Optional[bytes], Optional[str]]:
+    """(bytes, tagged content hash). Files up to INMEMORY_MAX_BYTES are read
+    once and hashed from memory so decoding can reuse the bytes; larger ones
+    are hashed in a stream and come back without bytes. (None, None) if the
+    file can't be read."""
     try:
-        # soundfile gives frames and samplerate
-        info = sf.info(str(p))
-        samplerate = info.samplerate
-        frames = info.frames
-        channels = info.channels
-        duration = frames / float(samplerate) if samplerate and frames else None
-        res.update({'duration': duration, 'sample_rate': samplerate, 'channels': channels})
-    except Exception:
-        # fallback: ignore metadata
-        pass
+        if os.path.getsize(path) <= INMEMORY_MAX_BYTES:
+            with open(path, 'rb') as f:
+                data = f.read()
+            return data, hash_bytes(data)
+    except OSError:
+        return None, None
+    return None, hash_file(path)
+
 
+def _decode(path: Path | str, data: Optional[bytes], policy: AnalysisPolicy) -> Optional[AudioBuffer]:
     try:
-        res['content_hash'] = sha256_file(p)
+        decoded = _read_spans(io.BytesIO(data) if data is not None else str(path), policy)
     except Exception:
-        res['content_hash'] = None
+        try:
+            decoded = _load_spans(path, policy)
+        except Exception:
+            return None
+    parts, sr, channels, frames, overview = decoded
+    if policy.target_sr and sr != policy.target_sr:
+        import librosa
+        parts = [librosa.resample(p, orig_sr=sr, target_sr=policy.target_sr) for p in parts]
+    y = np.ascontiguousarray(np.concatenate(parts), dtype=np.float32)
+    return AudioBuffer(y, policy.target_sr or sr, channels, frames, source_sr=sr, head=len(parts[0]),
+                       overview=overview, policy=policy)
 
-    # Attempt BPM detection using librosa (may be slow for very long files)
+
+def decode_audio(path: Path | str, decode: bool = True, policy: AnalysisPolicy = DEFAULT_POLICY) -> Tuple[Optional[AudioBuffer], Optional[str]]:
+    """Hash the file and decode what `policy` asks for. Small files are read
+    once and both steps work on those bytes; large ones are hashed in a
+    stream and only the analysis window is decoded, so memory and DSP time
+    stay bounded however long the file is.
+    Returns (buffer, tagged content hash); either is None when that step failed
+    (or was skipped with decode=False)."""
+    data, content_hash = read_and_hash(path)
+    if content_hash is None or not decode:
+        return None, content_hash
+    return _decode(path, data, policy), content_hash
+
+
+@register_extractor('tempo')
+def extract_tempo(buf: AudioBuffer) -> Dict:
+    # import librosa lazily so module import doesn't fail if librosa isn't installed
+    import librosa
+    # onset strength from the shared spectrogram (same as onset_strength(y=...))
+    mel = librosa.feature.melspectrogram(S=buf.power_spectrogram, sr=buf.sr)
+    onset_env = librosa.onset.onset_strength(S=librosa.power_to_db(mel), sr=buf.sr, hop_length=buf.HOP_LENGTH)
+    # Use the newer tempo API to avoid FutureWarning; the submodule is imported
+    # explicitly because librosa's lazy loader doesn't expose it until then
     try:
-        # import librosa lazily so module import doesn't fail if librosa isn't installed
-        import librosa
+        from librosa.feature.rhythm import tempo as tempo_fn
+    except ImportError:
+        # fallback to older alias if rhythm.tempo isn't present
+        tempo_fn = librosa.beat.tempo
+    tempo = tempo_fn(onset_envelope=onset_env, sr=buf.sr, hop_length=buf.HOP_LENGTH)
+    if hasattr(tempo, '__len__') and len(tempo) > 0:
+        return {'bpm': float(tempo[0])}
+    return {'bpm': float(tempo)}
+
+
+@register_extractor('key')
+def extract_key(buf: AudioBuffer) -> Dict:
+    """Mean chroma matched against the key templates (see keydetect.py). The
+    chroma is kept so keys can be re-estimated without decoding."""
+    import librosa
+    from .keydetect import encode_chroma, estimate
+    chroma = librosa.feature.chroma_stft(S=buf.power_spectrogram, sr=buf.sr, n_fft=buf.n_fft)
+    chroma_mean = np.mean(chroma, axis=1)
+    est = estimate(chroma_mean)[0]
+    return {
+        'key_detected': est.key,
+        'key_confidence': est.confidence,
+        'key_margin': est.margin,
+        'chroma': encode_chroma(chroma_mean),
+    }
+
+
+@register_extractor('landmarks')
+def extract_landmarks(buf: AudioBuffer) -> Dict:
+    """Perceptual fingerprint for near-duplicate search (see landmarks.py)."""
+    from .landmarks import encode, landmark_hashes
+    # anchor times need contiguous audio: only the head excerpt of a windowed file
+    hashes, times = landmark_hashes(buf.y[:buf.head], buf.sr)
+    return {'landmarks': encode(hashes, times) if len(hashes) else None}
+
+
+@register_extractor('waveform')
+def extract_waveform(buf: AudioBuffer) -> Dict:
+    """Min/max peak pyramid for GET /samples/{id}/waveform (see waveform.py)."""
+    from . import waveform
+    wf = buf.overview if buf.overview is not None else waveform.compute(buf.y, buf.duration)
+    return {'waveform': waveform.encode(wf)}
+
+
+@register_extractor('envelope')
+def extract_envelope(buf: AudioBuffer) -> Dict:
+    """Loop / one-shot probability from the amplitude envelope (see envelope.py)."""
+    from .envelope import analyze
+    return {'loop_probability': analyze(buf.y, buf.sr, buf.duration, head=buf.head if buf.windowed else None).loop_probability}
 
-        # librosa.load will handle resampling if needed, and returns mono by default
-        y, sr = librosa.load(str(p), sr=None, mono=True)
-        # Use the newer tempo API to avoid FutureWarning
+
+@register_extractor('timbre')
+def extract_timbre(buf: AudioBuffer) -> Dict:
+    """Fixed-length timbre embedding for similar-sample search (see embeddings.py)."""
+    from .embeddings import timbre_vector
+    return {'timbre': timbre_vector(buf.power_spectrogram, buf.sr).tobytes()}
+
+
+def extract_audio_metadata(path: str, extractors: Optional[Iterable[str]] = None, policy: AnalysisPolicy = DEFAULT_POLICY,
+                           cache: Optional[CacheLookup] = None) -> Dict:
+    """Decode `path` once under `policy` and run the registered extractors
+    (or the named subset) over the shared buffer. A failing extractor leaves
+    its keys None. `analysis_policy` records the policy's tag whenever the
+    extractors ran.
+
+    Format details, loop points and root note come from the file header. An
+    ACID tempo is exact, so it replaces the 'tempo' estimate; when no
+    extractor is left to run the file is hashed but never decoded.
+
+    With a `cache`, results already stored for the file's content hash (see
+    analyzer_key) are used as they are, and the file is decoded only for the
+    extractors that missed. Fresh results are returned under 'analyses'
+    ({analyzer key: result}) for the caller to store.
+
+    `error` says why nothing useful came out: the file can't be read (no
+    content hash), or it can't be decoded for extractors that still had to
+    run. It is None otherwise."""
+    res = {
+        'duration': None,
+        'sample_rate': None,
+        'channels': None,
+        'content_hash': None,
+        'bpm': None,
+        'key_detected': None,
+        'key_confidence': None,
+        'key_margin': None,
+        'chroma': None,
+        'bit_depth': None,
+        'loop_start': None,
+        'loop_end': None,
+        'root_note': None,
+        'landmarks': None,
+        'waveform': None,
+        'timbre': None,
+        'loop_probability': None,
+        'analysis_policy': None,
+        'analyses': {},
+        'error': None,
+    }
+    names = list(EXTRACTORS) if extractors is None else list(extractors)
+    header = read_header(path)
+    if header is not None:
+        res.update({
+            'duration': header.duration,
+            'sample_rate': header.sample_rate,
+            'channels': header.channels,
+            'bit_depth': header.bit_depth,
+            'root_note': header.root_note,
+        })
+        if header.loops:
+            res['loop_start'], res['loop_end'] = header.loops[0]
+        if header.acid_bpm and not header.acid_one_shot:
+            res['bpm'] = header.acid_bpm
+            names = [n for n in names if n != 'tempo']
+    need_format = header is None or not header.duration
+    data, res['content_hash'] = read_and_hash(path)
+    if res['content_hash'] is None:
+        res['error'] = "can't read file"
+        return res
+    if names:
+        res['analysis_policy'] = policy.tag
+    keys = {n: analyzer_key(n, policy) for n in names + (['format'] if need_format else [])}
+    hits = cache(res['content_hash'], list(keys.values())) if cache is not None and keys else {}
+    for key in keys.values():
+        res.update(hits.get(key, {}))
+    todo = [n for n in keys if keys[n] not in hits]
+    if not todo:
+        return res
+    buf = _decode(path, data, policy)
+    del data
+    if buf is None:
+        if not hits:
+            res['analysis_policy'] = None
+        res['error'] = "can't decode audio"
+        return res
+    for name in todo:
         try:
-            tempo = librosa.feature.rhythm.tempo(y=y, sr=sr)
+            if name == 'format':
+                out = {'duration': buf.duration, 'sample_rate': buf.source_sr, 'channels': buf.channels}
+            else:
+                out = EXTRACTORS[name](buf)
         except Exception:
-            # fallback to older alias if rhythm.tempo isn't present
-            tempo = librosa.beat.tempo(y=y, sr=sr)
-        if hasattr(tempo, '__len__') and len(tempo) > 0:
-            res['bpm'] = float(tempo[0])
-        else:
-            res['bpm'] = float(tempo)
-    except Exception:
-        # if librosa fails or is not installed, leave bpm as None
-        pass
-    # Attempt key detection (chroma + simple template matching)
-    try:
-        import librosa
-        y2, sr2 = librosa.load(str(p), sr=None, mono=True)
-        # compute chroma using STFT and a safe n_fft to avoid warnings on short signals
-        n_fft = min(2048, max(256, len(y2)))
-        chroma = librosa.feature.chroma_stft(y=y2, sr=sr2, n_fft=n_fft)
-        chroma_mean = np.mean(chroma, axis=1)
-        # Krumhansl major/minor templates (normalized)
-        major_template = np.array([6.35,2.23,3.48,2.33,4.38,4.09,2.52,5.19,2.39,3.66,2.29,2.88])
-        minor_template = np.array([6.33,2.68,3.52,5.38,2.60,3.53,2.54,4.75,3.98,2.69,3.34,3.17])
-        # correlate rotated templates to find best tonic
-        best = None
-        best_score = -1e9
-        for tonic in range(12):
-            # rotate templates
-            maj = np.roll(major_template, tonic)
-            mino = np.roll(minor_template, tonic)
-            # normalize
-            maj = maj / np.linalg.norm(maj)
-            mino = mino / np.linalg.norm(mino)
-            chroma_norm = chroma_mean / (np.linalg.norm(chroma_mean) + 1e-9)
-            smaj = np.dot(chroma_norm, maj)
-            smin = np.dot(chroma_norm, mino)
-            if smaj > best_score:
-                best_score = smaj
-                best = (tonic, 'maj', smaj)
-            if smin > best_score:
-                best_score = smin
-                best = (tonic, 'min', smin)
-        if best is not None:
-            tonic_index, mode, score = best
-            # map tonic index to note names (C=0)
-            note_names = ['C','C#','D','D#','E','F','F#','G','G#','A','A#','B']
-            res['key_detected'] = f"{note_names[tonic_index]}:{'maj' if mode=='maj' else 'min'}"
-        else:
-            res['key_detected'] = None
-    except Exception:
-        res['key_detected'] = None
-
+            # if librosa fails or is not installed, leave this feature as None
+            continue
+        res.update(out)
+        res['analyses'][keys[name]] = out
     return res
 
 
@@ -0,0 +1,193 @@
+"""Persistent, prioritised work queue for the DSP pass.
+
+Every sample without DSP results has a row in dsp_queue. The runner claims
+work a chunk at a time, highest priority first and first-in-first-out
+within a priority, so an interrupted run picks up exactly where the order
+says it should and a large backlog drains predictably:
+
+- PRIORITY_VIEWED: samples the user opened (GET /samples/{id});
+- PRIORITY_ROOT: everything under a root the user asked for first;
+- PRIORITY_IMPORT: samples imported in the last IMPORT_WINDOW;
+- PRIORITY_BACKLOG: the rest.
+
+A claim is a lease: the row's ready_at moves LEASE_SECONDS ahead and its
+attempt count goes up, so work held by a runner that died comes back when
+the lease runs out. Writing a sample's DSP results removes its row
+(db.update_samples_metadata_bulk). A failure pushes ready_at back by
+RETRY_BASE_SECONDS, doubling per attempt up to RETRY_MAX_SECONDS; after
+MAX_ATTEMPTS failed or abandoned claims the row is quarantined and only
+release_quarantined() puts it back, so a file that crashes the decoder
+cannot stall the queue.
+"""
+from __future__ import annotations
+
+import os
+import socket
+import sqlite3
+import time
+import uuid
+from typing import Iterable, List, Optional, Tuple
+
+PRIORITY_BACKLOG = 0
+PRIORITY_IMPORT = 10
+PRIORITY_ROOT = 50
+PRIORITY_VIEWED = 100
+IMPORT_WINDOW = '-1 day'
+
+LEASE_SECONDS = 600.0
+RETRY_BASE_SECONDS = 60.0
+RETRY_MAX_SECONDS = 6 * 3600.0
+MAX_ATTEMPTS = 3
+
+
+def lease_owner() -> str:
+    """Identifies one runner in lease_owner (host, pid and a random tag)."""
+    return f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+
+
+def enqueue_unprocessed(conn: sqlite3.Connection, now: Optional[float] = None) -> int:
+    """Queue every sample without DSP results that isn't queued yet; recent
+    imports get PRIORITY_IMPORT. Returns the rows added."""
+    now = time.time() if now is None else now
+    with conn:
+        cur = conn.execute(
+            "INSERT OR IGNORE INTO dsp_queue (sample_id, priority, enqueued_at) "
+            "SELECT id, CASE WHEN added_at >= datetime('now', ?) THEN ? ELSE ? END, ? "
+            "FROM samples WHERE content_hash IS NULL",
+            (IMPORT_WINDOW, PRIORITY_IMPORT, PRIORITY_BACKLOG, now),
+        )
+    return max(cur.rowcount, 0)
+
+
+def prioritize(conn: sqlite3.Connection, priority: int, sample_ids: Iterable[str] = (), root: Optional[str] = None,
+               now: Optional[float] = None) -> int:
+    """Queue unprocessed samples by id and/or every one below `root` at
+    `priority` at least; queued rows only ever move up. Quarantined rows stay
+    quarantined. Returns the rows queued or raised."""
+    from .db import _prefix_bounds
+    now = time.time() if now is None else now
+    upsert = (
+        "INSERT INTO dsp_queue (sample_id, priority, enqueued_at) SELECT id, ?, ? FROM samples "
+        "WHERE {} AND content_hash IS NULL "
+        "ON CONFLICT (sample_id) DO UPDATE SET priority = excluded.priority WHERE excluded.priority > priority"
+    )
+    n = 0
+    with conn:
+        ids = [(priority, now, sid) for sid in sample_ids]
+        if ids:
+            n += max(conn.executemany(upsert.format("id = ?"), ids).rowcount, 0)
+        if root:
+            n += max(conn.execute(upsert.format("full_path >= ? AND full_path < ?"), (priority, now, *_prefix_bounds(root))).rowcount, 0)
+    return n
+
+
+def claim(conn: sqlite3.Connection, owner: str, limit: int, lease_seconds: float = LEASE_SECONDS,
+          now: Optional[float] = None) -> List[Tuple[str, str]]:
+    """Lease up to `limit` ready rows to `owner`, best first. Returns their
+    (sample_id, full_path) pairs in queue order."""
+    now = time.time() if now is None else now
+    with conn:
+        # one statement, so concurrent runners never claim the same row
+        claimed = conn.execute(
+            "UPDATE dsp_queue SET lease_owner = ?, ready_at = ?, attempts = attempts + 1 WHERE sample_id IN ("
+            "SELECT sample_id FROM dsp_queue WHERE quarantined = 0 AND ready_at <= ? "
+            "ORDER BY priority DESC, enqueued_at LIMIT ?) RETURNING sample_id",
+            (owner, now + lease_seconds, now, limit),
+        ).fetchall()
+    if not claimed:
+        return []
+    placeholders = ','.join('?' for _ in claimed)
+    return [(r[0], r[1]) for r in conn.execute(
+        f"SELECT s.id, s.full_path FROM dsp_queue q JOIN samples s ON s.id = q.sample_id "
+        f"WHERE q.sample_id IN ({placeholders}) ORDER BY q.priority DESC, q.enqueued_at",
+        [r[0] for r in claimed])]
+
+
+def fail(conn: sqlite3.Connection, failures: Iterable[Tuple[str, str]], now: Optional[float] = None) -> int:
+    """Give claimed (sample_id, error) rows back for a retry with backoff, or
+    quarantine them after MAX_ATTEMPTS. Returns how many were quarantined."""
+    now = time.time() if now is None else now
+    failures = list(failures)
+    if not failures:
+        return 0
+    with conn:
+        conn.executemany(
+            "UPDATE dsp_queue SET lease_owner = NULL, last_error = ?, quarantined = (attempts >= ?), "
+            "ready_at = ? + min(?, ? * (1 << min(attempts - 1, 30))) WHERE sample_id = ?",
+            ((err, MAX_ATTEMPTS, now, RETRY_MAX_SECONDS, RETRY_BASE_SECONDS, sid) for sid, err in failures),
+        )
+        placeholders = ','.join('?' for _ in failures)
+        return conn.execute(f"SELECT COUNT(*) FROM dsp_queue WHERE quarantined = 1 AND sample_id IN ({placeholders})",
+                            [sid for sid, _ in failures]).fetchone()[0]
+
+
+def release(conn: sqlite3.Connection, owner: str) -> int:
+    """Hand back rows `owner` still holds (claimed but never analysed, e.g.
+    after a cancel) as ready now, without counting the attempt. Returns the
+    rows released."""
+    with conn:
+        return conn.execute("UPDATE dsp_queue SET lease_owner = NULL, ready_at = 0, attempts = max(attempts - 1, 0) "
+                            "WHERE lease_owner = ? AND quarantined = 0",
+                            (owner,)).rowcount
+
+
+def release_quarantined(conn: sqlite3.Connection, sample_ids: Optional[Iterable[str]] = None) -> int:
+    """Give quarantined rows (all, or the given ones) a fresh set of
+    attempts. Returns the rows released."""
+    sql = "UPDATE dsp_queue SET quarantined = 0, attempts = 0, ready_at = 0, lease_owner = NULL WHERE quarantined = 1"
+    with conn:
+        if sample_ids is None:
+            return conn.execute(sql).rowcount
+        return max(conn.executemany(sql + " AND sample_id = ?", ((sid,) for sid in sample_ids)).rowcount, 0)
+
+
+def ready_count(conn: sqlite3.Connection, now: Optional[float] = None) -> int:
+    now = time.time() if now is None else now
+    return conn.execute("SELECT COUNT(*) FROM dsp_queue WHERE quarantined = 0 AND ready_at <= ?", (now,)).fetchone()[0]
+
+
+def stats(conn: sqlite3.Connection, now: Optional[float] = None) -> dict:
+    """Row counts by state: ready, leased (claimed by a runner), retrying
+    (waiting out a backoff) and quarantined."""
+    now = time.time() if now is None else now
+    r = conn.execute(
+        "SELECT COALESCE(SUM(quarantined = 0 AND ready_at <= ?), 0), "
+        "COALESCE(SUM(quarantined = 0 AND ready_at > ? AND lease_owner IS NOT NULL), 0), "
+        "COALESCE(SUM(quarantined = 0 AND ready_at > ? AND lease_owner IS NULL), 0), "
+        "COALESCE(SUM(quarantined = 1), 0) FROM dsp_queue",
+        (now, now, now),
+    ).fetchone()
+    return {'ready': r[0], 'leased': r[1], 'retrying': r[2], 'quarantined': r[3]}
+
+
+def list_quarantined(conn: sqlite3.Connection, limit: int = 100) -> list:
+    return [dict(r) for r in conn.execute(
+        "SELECT q.sample_id, s.full_path, q.attempts, q.last_error FROM dsp_queue q "
+        "LEFT JOIN samples s ON s.id = q.sample_id WHERE q.quarantined = 1 ORDER BY s.full_path LIMIT ?", (limit,))]
+
+
+if __name__ == '__main__':
+    import argparse
+
+    from . import db as dbmod
+
+    parser = argparse.ArgumentParser(description='Inspect and steer the DSP work queue')
+    parser.add_argument('action', choices=('stats', 'quarantined', 'release', 'prioritize'))
+    parser.add_argument('--db', default=None)
+    parser.add_argument('--root', default=None, help='prioritize: queue everything below this directory first')
+    parser.add_argument('--priority', type=int, default=PRIORITY_ROOT)
+    args = parser.parse_args()
+    conn = dbmod.get_conn(args.db) if args.db else dbmod.get_conn()
+    dbmod.init_db(conn)
+    if args.action == 'stats':
+        enqueue_unprocessed(conn)
+        print(stats(conn))
+    elif args.action == 'quarantined':
+        for r in list_quarantined(conn, limit=1000):
+            print(r['attempts'], r['full_path'], r['last_error'], sep='\t')
+    elif args.action == 'release':
+        print('released', release_quarantined(conn))
+    else:
+        enqueue_unprocessed(conn)
+        print('queued', prioritize(conn, args.priority, root=args.root))
+    conn.close()
@@ -1,38 +1,195 @@
-import sqlite3
+"""Run DSP analysis over samples that have not been processed yet.
+
+Work comes from the dsp_queue table (see dsp_queue.py): the runner queues
+any unprocessed samples, then claims leases a chunk at a time, best
+priority first, up to `limit` samples. Results remove their rows from the
+queue when written; failures (files that are missing or can't be
+decoded included) go back for a retry with backoff, and repeatedly failing
+files end up quarantined.
+
+With workers > 1 the chunks are analysed on a process pool (librosa work is
+CPU-bound and holds the GIL); workers only return metadata dicts, and this
+process writes them back in batches of `write_batch` rows as the only DB
+writer. A worker dying mid-file (a decoder crash) is traced to the file
+that caused it, which fails like any other error. Cancellation and progress go through
+JobControl and the dsp_jobs table either way.
+
+The AnalysisPolicy (resample rate, analysis window) bounds the work per
+file; its tag is stored with every result.
+
+Workers look up the analysis_cache table (read only) by content hash before
+decoding, so copies of already analysed audio cost one hash; new results go
+back to this process and are cached with the rest of the batch.
+"""
+import multiprocessing
+import os
 import time
-from app.backend.db import get_conn, init_db, get_unprocessed_samples
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Iterator, List, Optional, Tuple
+
+from app.backend.db import get_conn, init_db
 import app.backend.dsp as dsp
 import app.backend.db as dbmod
+import app.backend.dsp_queue as dsp_queue
+from app.backend.jobs import JobControl
+
+DEFAULT_CHUNK_SIZE = 8
+DEFAULT_WRITE_BATCH = 64
+DEFAULT_WORKERS = os.cpu_count() or 1
+
+# (sample id, metadata or None, error or None)
+Result = Tuple[str, Optional[dict], Optional[str]]
+
+
+def analyze_chunk(rows: List[Tuple[str, str]], policy: dsp.AnalysisPolicy = dsp.DEFAULT_POLICY,
+                  cache_db: Optional[str] = None, use_cache: bool = False) -> List[Result]:
+    """Worker body: extract metadata for (id, full_path) pairs, reusing
+    results cached in `cache_db` (the default DB if None) when use_cache."""
+    out: List[Result] = []
+    conn = (get_conn(cache_db) if cache_db else get_conn()) if use_cache else None
+    cache = (lambda h, keys: dbmod.get_cached_analyses(conn, h, keys)) if conn is not None else None
+    try:
+        for sample_id, full_path in rows:
+            try:
+                meta = dsp.extract_audio_metadata(full_path, policy=policy, cache=cache)
+            except Exception as e:
+                out.append((sample_id, None, str(e)))
+                continue
+            # missing and undecodable files go back to the queue to be retried
+            out.append((sample_id, None, meta['error']) if meta.get('error') else (sample_id, meta, None))
+    finally:
+        if conn is not None:
+            conn.close()
+    return out
+
 
+def _iter_serial(next_rows: Callable[[], list], job: JobControl, analyze_args: tuple) -> Iterator[List[Result]]:
+    while not job.cancelled():
+        rows = next_rows()
+        if not rows:
+            return
+        yield analyze_chunk(rows, *analyze_args)
 
-def run_once(db_path: str = None, limit: int = 500, job_id: str | None = None):
+
+def _new_pool(workers: int) -> ProcessPoolExecutor:
+    # spawn: the API runs this on a thread, and forking a threaded process is unsafe
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+
+
+def _isolate(rows, analyze_args: tuple) -> Iterator[List[Result]]:
+    """Analyse rows one at a time on a single worker, replacing it whenever
+    it dies, so a crash is pinned on the file that caused it."""
+    pool = _new_pool(1)
+    try:
+        for row in rows:
+            try:
+                yield pool.submit(analyze_chunk, [row], *analyze_args).result()
+            except BrokenProcessPool as e:
+                yield [(row[0], None, f'analysis process died: {e}')]
+                pool.shutdown(wait=True)
+                pool = _new_pool(1)
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+def _iter_pool(next_rows: Callable[[], list], workers: int, job: JobControl, analyze_args: tuple) -> Iterator[List[Result]]:
+    """Yield chunk results as they complete. At most 2x workers chunks are in
+    flight so a cancel stops new work quickly. A worker dying breaks the
+    whole pool and takes every chunk in flight with it: those are re-run a
+    file at a time (_isolate), then a new pool carries on."""
+    pool = _new_pool(workers)
+    try:
+        in_flight = {}
+        crashed = []
+        exhausted = False
+        while True:
+            if crashed and not in_flight:
+                pool.shutdown(wait=True)
+                yield from _isolate(crashed, analyze_args)
+                crashed = []
+                pool = _new_pool(workers)
+            while not (exhausted or crashed or job.cancelled()) and len(in_flight) < workers * 2:
+                rows = next_rows()
+                if not rows:
+                    exhausted = True
+                    break
+                in_flight[pool.submit(analyze_chunk, rows, *analyze_args)] = rows
+            if not in_flight:
+                return
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for fut in done:
+                rows = in_flight.pop(fut)
+                try:
+                    results = fut.result()
+                except BrokenProcessPool:
+                    crashed.extend(rows)
+                    continue
+                yield results
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+def run_once(db_path: str = None, limit: int = 500, job_id: str | None = None, workers: int = 1,
+             chunk_size: int = DEFAULT_CHUNK_SIZE, write_batch: int = DEFAULT_WRITE_BATCH,
+             policy: dsp.AnalysisPolicy = dsp.DEFAULT_POLICY, use_cache: bool = True):
     conn = get_conn(db_path) if db_path else get_conn()
     init_db(conn)
-    rows = get_unprocessed_samples(conn, limit=limit)
-    processed = 0
-    total = len(rows)
+    dsp_queue.enqueue_unprocessed(conn)
+    processed = failed = quarantined = 0
+    total = min(limit, dsp_queue.ready_count(conn))
 
     # persist dsp job row if job_id provided
     if job_id:
         create_dsp = dbmod.create_dsp_job
         create_dsp(conn, job_id, params='{}', db_path=db_path, total=total)
 
-    for r in rows:
-        # check cancel
-        if job_id:
-            j = dbmod.get_dsp_job(conn, job_id)
-            if j and j['cancel_requested'] == 1:
-                break
-        try:
-            dsp.process_sample(conn, r, dbmod)
-            processed += 1
-            if job_id:
-                dbmod.set_dsp_progress(conn, job_id, processed, total)
-        except Exception as e:
-            print('error processing', r[0], e)
+    job = JobControl(conn, job_id, kind='dsp')
+    chunk_size = max(1, chunk_size)
+    owner = dsp_queue.lease_owner()
+    claimed = 0
+
+    def next_rows() -> List[Tuple[str, str]]:
+        nonlocal claimed
+        rows = dsp_queue.claim(conn, owner, min(chunk_size, limit - claimed)) if claimed < limit else []
+        claimed += len(rows)
+        return rows
+
+    pending: List[Tuple[str, dict]] = []
+    analyze_args = (policy, db_path, use_cache)
+    if workers > 1:
+        results = _iter_pool(next_rows, workers, job, analyze_args)
+    else:
+        results = _iter_serial(next_rows, job, analyze_args)
+    try:
+        for chunk in results:
+            errors = []
+            for sample_id, meta, err in chunk:
+                if err is not None:
+                    print('error processing', sample_id, err)
+                    errors.append((sample_id, err))
+                    continue
+                pending.append((sample_id, meta))
+            if errors:
+                failed += len(errors)
+                quarantined += dsp_queue.fail(conn, errors)
+            if len(pending) >= write_batch:
+                processed += dbmod.update_samples_metadata_bulk(conn, pending)
+                pending = []
+            job.progress(processed + len(pending), total)
+        # chunks finished before a cancel are still written
+        if pending:
+            processed += dbmod.update_samples_metadata_bulk(conn, pending)
+        job.progress(processed, total)
+    finally:
+        results.close()
+        job.close()
+        # anything claimed but not written goes straight back to the queue
+        dsp_queue.release(conn, owner)
     # finalize
     if job_id:
-        dbmod.set_dsp_result(conn, job_id, {'processed': processed, 'total': total})
+        dbmod.set_dsp_result(conn, job_id, {'processed': processed, 'total': total, 'failed': failed,
+                                            'quarantined': quarantined, 'canceled': job.cancelled()})
     conn.close()
     return processed
 
@@ -42,7 +199,30 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('--db', default=None)
     parser.add_argument('--limit', type=int, default=500)
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help='Analysis processes (1 = analyse in this process)')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help='Samples handed to a worker at a time')
+    parser.add_argument('--target-sr', type=int, default=dsp.DEFAULT_POLICY.target_sr, help='Analysis sample rate (0 = keep the file rate)')
+    parser.add_argument('--max-seconds', type=float, default=dsp.DEFAULT_POLICY.max_seconds, help='Longest analysis window per file (0 = whole file)')
+    parser.add_argument('--segments', type=int, default=dsp.DEFAULT_POLICY.segments, help='Excerpts the window of a long file is split into')
+    parser.add_argument('--no-cache', action='store_true', help='Analyse every file even if its content was analysed before')
+    parser.add_argument('--root', default=None, help='Analyse samples below this directory before the rest of the queue')
+    parser.add_argument('--prune-cache', action='store_true', help='Drop cached results of vanished content and old analyzer versions, then exit')
     args = parser.parse_args()
-    print('processing...')
-    n = run_once(db_path=args.db, limit=args.limit)
-    print('processed', n)
+    policy = dsp.AnalysisPolicy(args.target_sr or None, args.max_seconds or None, args.segments)
+    if args.prune_cache:
+        conn = get_conn(args.db) if args.db else get_conn()
+        init_db(conn)
+        current = [dsp.analyzer_key(name, policy) for name in ['format', *dsp.EXTRACTORS]]
+        print('pruned', dbmod.prune_analysis_cache(conn, current), 'cache entries')
+        conn.close()
+        raise SystemExit(0)
+    if args.root:
+        conn = get_conn(args.db) if args.db else get_conn()
+        init_db(conn)
+        dsp_queue.prioritize(conn, dsp_queue.PRIORITY_ROOT, root=args.root)
+        conn.close()
+    print('processing...', policy.tag)
+    t0 = time.monotonic()
+    n = run_once(db_path=args.db, limit=args.limit, workers=args.workers, chunk_size=args.chunk_size, policy=policy,
+                 use_cache=not args.no_cache)
+    print('processed', n, f'in {time.monotonic() - t0:.1f}s')
@@ -0,0 +1,242 @@
+"""Exact and near duplicate detection, and cleanup of exact copies.
+
+Samples are grouped by (size_bytes, content_hash) straight off the
+idx_samples_size_hash index, a page of groups at a time, so a library of any
+size is walked without loading it into Python. Each group keeps one sample
+(see KEEP_POLICIES); the others can be replaced by hard links to it or moved
+to a trash directory. Every change is appended to an undo CSV as it happens,
+and undo_duplicates() reverses a log.
+
+Both actions drop the duplicate's row: a hard link is the same file as the
+kept sample, and a trashed file has left the library.
+
+find_near_duplicates() covers copies that differ in bytes (another sample
+rate or bit depth, trimmed silence) using the landmark fingerprints.
+"""
+from __future__ import annotations
+
+import csv
+import os
+import shutil
+from pathlib import Path
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+from . import db as dbmod
+from .hashing import hash_file, split_content_hash
+from .landmarks import MIN_MATCHES, decode as decode_landmarks, match_offsets
+from .mover import move_file
+
+DEFAULT_PAGE_SIZE = 500
+ACTIONS = ('report', 'hardlink', 'delete')
+
+# sort key per policy; the first sample of a sorted group is kept
+KEEP_POLICIES = {
+    'oldest': lambda s: (s['added_at'] or '', s['full_path']),
+    'shortest': lambda s: (len(s['full_path']), s['full_path']),
+}
+
+UNDO_HEADER = ['action', 'path', 'keeper', 'trash']
+
+
+class DuplicateGroup(NamedTuple):
+    size_bytes: int
+    content_hash: str
+    # kept sample first
+    samples: List[dict]
+
+    @property
+    def wasted_bytes(self) -> int:
+        return self.size_bytes * (len(self.samples) - 1)
+
+    def to_dict(self) -> dict:
+        return {
+            'size_bytes': self.size_bytes,
+            'content_hash': self.content_hash,
+            'count': len(self.samples),
+            'wasted_bytes': self.wasted_bytes,
+            'samples': self.samples,
+        }
+
+
+def encode_cursor(group: DuplicateGroup) -> str:
+    return f"{group.size_bytes}:{group.content_hash}"
+
+
+def decode_cursor(cursor: str) -> Tuple[int, str]:
+    size, _, content_hash = cursor.partition(':')
+    return int(size), content_hash
+
+
+def get_duplicates_page(conn, limit: int = 50, after: Optional[Tuple[int, str]] = None, root: Optional[str] = None, keep: str = 'oldest') -> List[DuplicateGroup]:
+    """One page of duplicate groups, largest files first, each sorted so the
+    sample to keep comes first."""
+    keys = [(r[0], r[1]) for r in dbmod.get_duplicate_groups(conn, limit, after=after, root=root)]
+    members: Dict[tuple, List[dict]] = {k: [] for k in keys}
+    for r in dbmod.get_duplicate_members(conn, keys, root=root):
+        members[(r['size_bytes'], r['content_hash'])].append(
+            {'id': r['id'], 'full_path': r['full_path'], 'filename': r['filename'], 'added_at': r['added_at']}
+        )
+    key_fn = KEEP_POLICIES[keep]
+    return [DuplicateGroup(k[0], k[1], sorted(members[k], key=key_fn)) for k in keys]
+
+
+def iter_duplicate_groups(conn, root: Optional[str] = None, keep: str = 'oldest', page_size: int = DEFAULT_PAGE_SIZE) -> Iterator[DuplicateGroup]:
+    after = None
+    while True:
+        page = get_duplicates_page(conn, page_size, after=after, root=root, keep=keep)
+        yield from page
+        if len(page) < page_size:
+            return
+        after = (page[-1].size_bytes, page[-1].content_hash)
+
+
+def find_near_duplicates(conn, sample_id: str, limit: int = 20, min_matches: int = MIN_MATCHES) -> Optional[List[dict]]:
+    """Samples sharing at least `min_matches` time-aligned landmarks with
+    `sample_id`, best first. `score` is the aligned share of the smaller
+    fingerprint. None when the sample has no fingerprint yet."""
+    row = conn.execute("SELECT landmarks FROM samples WHERE id=?", (sample_id,)).fetchone()
+    if row is None or row[0] is None:
+        return None
+    hashes, times = decode_landmarks(row[0])
+    postings = dbmod.get_landmark_postings(conn, sorted(set(hashes.tolist())), exclude_id=sample_id)
+    # match_offsets votes on integer candidates
+    ids = list({p[0]: None for p in postings})
+    index = {sid: i for i, sid in enumerate(ids)}
+    votes = match_offsets(zip(hashes.tolist(), times.tolist()), ((index[p[0]], p[1], p[2]) for p in postings))
+    matched = {ids[c]: n for c, n in votes.items() if n >= min_matches}
+    best = sorted(matched, key=matched.get, reverse=True)[:limit]
+    if not best:
+        return []
+    placeholders = ','.join('?' for _ in best)
+    rows = {r[0]: r for r in conn.execute(
+        f"SELECT id, full_path, filename, length(landmarks) / 6 FROM samples WHERE id IN ({placeholders})", best)}
+    out = []
+    for sid in best:
+        r = rows.get(sid)
+        if r is None or not r[3]:
+            continue
+        n = matched[sid]
+        out.append({'id': sid, 'full_path': r[1], 'filename': r[2], 'matches': n,
+                    'score': round(n / min(len(hashes), r[3]), 3)})
+    return out
+
+
+def _same_content(a: str, b: str, content_hash: str) -> bool:
+    """Re-hash both files before touching them; the stored hash may be stale."""
+    algo = split_content_hash(content_hash)[0]
+    ha = hash_file(a, algo)
+    return ha is not None and ha == hash_file(b, algo)
+
+
+def _hardlink(keeper: str, path: str):
+    # link under a temporary name, then atomically replace the duplicate
+    tmp = f"{path}.kass-link"
+    os.link(keeper, tmp)
+    try:
+        os.replace(tmp, path)
+    except OSError:
+        os.unlink(tmp)
+        raise
+
+
+def _trash_path(trash_dir: Path, sample: dict) -> Path:
+    # the id prefix keeps same-named duplicates from different folders apart
+    return trash_dir / f"{sample['id'][:12]}_{sample['filename']}"
+
+
+def apply_duplicates(conn, action: str, undo_csv: str, trash_dir: Optional[str] = None, root: Optional[str] = None, keep: str = 'oldest', verify: bool = True) -> Dict[str, int]:
+    """Hard link (action='hardlink') or trash (action='delete') every
+    duplicate but the kept sample of each group, logging each change to
+    `undo_csv`. Files whose content no longer matches (verify=True) or that
+    can't be changed are skipped and counted under `skipped`."""
+    if action not in ('hardlink', 'delete'):
+        raise ValueError(f"unknown action: {action}")
+    if action == 'delete':
+        if not trash_dir:
+            raise ValueError("delete needs a trash directory")
+        trash = Path(trash_dir)
+        trash.mkdir(parents=True, exist_ok=True)
+    done = skipped = freed = 0
+    with open(undo_csv, 'w', newline='') as fh:
+        w = csv.writer(fh)
+        w.writerow(UNDO_HEADER)
+        for group in iter_duplicate_groups(conn, root=root, keep=keep):
+            keeper = group.samples[0]['full_path']
+            removed = []
+            for sample in group.samples[1:]:
+                path = sample['full_path']
+                try:
+                    if verify and not _same_content(keeper, path, group.content_hash):
+                        skipped += 1
+                        continue
+                    if action == 'hardlink':
+                        if not os.path.samefile(keeper, path):
+                            _hardlink(keeper, path)
+                        w.writerow(['hardlink', path, keeper, ''])
+                    else:
+                        dst = _trash_path(trash, sample)
+                        move_file(Path(path), dst)
+                        w.writerow(['delete', path, keeper, str(dst)])
+                except OSError:
+                    # e.g. a hard link across devices, or the file is gone
+                    skipped += 1
+                    continue
+                fh.flush()
+                removed.append(path)
+                freed += group.size_bytes
+            if removed:
+                with conn:
+                    done += dbmod.delete_samples_by_path(conn, removed)
+    return {'action': action, 'done': done, 'skipped': skipped, 'freed_bytes': freed}
+
+
+def undo_duplicates(undo_csv: str) -> Dict[str, int]:
+    """Reverse a log written by apply_duplicates, newest change first. Hard
+    links are replaced by copies of the kept file and trashed files are moved
+    back. The restored files are indexed again by the next scan."""
+    with open(undo_csv, newline='') as fh:
+        rows = list(csv.DictReader(fh))
+    restored = failed = 0
+    for row in reversed(rows):
+        path = row['path']
+        try:
+            if row['action'] == 'hardlink':
+                tmp = f"{path}.kass-copy"
+                shutil.copy2(row['keeper'], tmp)
+                os.replace(tmp, path)
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                move_file(Path(row['trash']), Path(path))
+            restored += 1
+        except OSError:
+            failed += 1
+    return {'restored': restored, 'failed': failed}
+
+
+if __name__ == '__main__':
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(description='Find byte-identical samples and optionally hard link or trash the copies')
+    parser.add_argument('action', nargs='?', choices=ACTIONS, default='report')
+    parser.add_argument('--db', default=None)
+    parser.add_argument('--root', default=None, help='Only consider samples under this scan root')
+    parser.add_argument('--keep', choices=sorted(KEEP_POLICIES), default='oldest', help='Which sample of each group to keep')
+    parser.add_argument('--undo-csv', default=None, help='Undo log to write (hardlink/delete)')
+    parser.add_argument('--trash', default=None, help='Directory that deleted duplicates are moved to')
+    parser.add_argument('--undo', default=None, metavar='CSV', help='Reverse a previous hardlink/delete run')
+    args = parser.parse_args()
+    if args.undo:
+        print(undo_duplicates(args.undo))
+        raise SystemExit(0)
+    conn = dbmod.get_conn(args.db) if args.db else dbmod.get_conn()
+    dbmod.init_db(conn)
+    if args.action == 'report':
+        for group in iter_duplicate_groups(conn, root=args.root, keep=args.keep):
+            print(json.dumps(group.to_dict()))
+        print(json.dumps({'summary': dbmod.get_duplicate_stats(conn, root=args.root)}))
+    else:
+        if not args.undo_csv:
+            parser.error(f'{args.action} needs --undo-csv')
+        print(apply_duplicates(conn, args.action, args.undo_csv, trash_dir=args.trash, root=args.root, keep=args.keep))
+    conn.close()
@@ -0,0 +1,260 @@
+"""Timbre embeddings and similar-sample search.
+
+The 'timbre' extractor (dsp.py) summarises a sample as EMBED_DIM floats:
+the mean, then the std, of N_MFCC MFCCs and of spectral centroid,
+bandwidth, rolloff and flatness (the first three relative to Nyquist).
+
+Vectors are kept out of SQLite in a flat little-endian float32 file next to
+the DB (store_path), read through a memory map; the embeddings table maps
+sample ids to rows. A re-analysed sample overwrites its row, new samples
+append, and rows whose sample was deleted stay in the file until compact().
+
+Search standardises every dimension over the library (MFCC 0 would swamp
+the rest otherwise), L2-normalises the rows and scores all of them against
+the query in one vectorised dot product: brute-force cosine similarity. The
+prepared matrix is kept per process and rebuilt when the file changes. With
+quantize=True it is held as int8, a quarter of the memory, and scored in
+float32 chunks of QUANT_CHUNK rows.
+"""
+from __future__ import annotations
+
+import os
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+N_MFCC = 20
+# MFCCs plus centroid, bandwidth, rolloff, flatness; mean and std of each
+EMBED_DIM = 2 * (N_MFCC + 4)
+DTYPE = np.dtype('<f4')
+ROW_BYTES = EMBED_DIM * DTYPE.itemsize
+QUANT_CHUNK = 2048
+DEFAULT_K = 20
+
+
+def timbre_vector(power: np.ndarray, sr: int) -> np.ndarray:
+    """EMBED_DIM float32 summary of a power spectrogram."""
+    import librosa
+    mfcc = librosa.feature.mfcc(S=librosa.power_to_db(librosa.feature.melspectrogram(S=power, sr=sr)), n_mfcc=N_MFCC)
+    mag = np.sqrt(power)
+    nyquist = sr / 2.0
+    feats = np.vstack([
+        mfcc,
+        librosa.feature.spectral_centroid(S=mag, sr=sr) / nyquist,
+        librosa.feature.spectral_bandwidth(S=mag, sr=sr) / nyquist,
+        librosa.feature.spectral_rolloff(S=mag, sr=sr) / nyquist,
+        librosa.feature.spectral_flatness(S=mag),
+    ])
+    return np.concatenate([feats.mean(axis=1), feats.std(axis=1)]).astype(DTYPE)
+
+
+def store_path(conn: sqlite3.Connection) -> Optional[Path]:
+    """The vector file of the connection's main database; None for an
+    in-memory database."""
+    db_file = conn.execute("PRAGMA database_list").fetchone()[2]
+    return Path(db_file + '-timbre.f32') if db_file else None
+
+
+def _row_count(path: Path) -> int:
+    try:
+        return os.path.getsize(path) // ROW_BYTES
+    except OSError:
+        return 0
+
+
+def open_vectors(path: Path) -> np.ndarray:
+    """(rows, EMBED_DIM) read-only memory map of the store (empty if none)."""
+    n = _row_count(path)
+    if n == 0:
+        return np.empty((0, EMBED_DIM), DTYPE)
+    return np.memmap(path, DTYPE, mode='r', shape=(n, EMBED_DIM))
+
+
+def put_embeddings(conn: sqlite3.Connection, items) -> int:
+    """Store (sample_id, vector bytes) pairs and map them to their rows.
+    Caller commits."""
+    items = [(sid, vec) for sid, vec in items if vec is not None and len(vec) == ROW_BYTES]
+    path = store_path(conn)
+    if not items or path is None:
+        return 0
+    placeholders = ','.join('?' for _ in items)
+    existing = dict(conn.execute(
+        f"SELECT sample_id, row FROM embeddings WHERE sample_id IN ({placeholders})", [sid for sid, _ in items]))
+    rows: Dict[str, int] = {}
+    new = [(sid, vec) for sid, vec in items if sid not in existing]
+    if new:
+        end = _row_count(path)
+        with open(path, 'ab') as fh:
+            # a torn earlier append would misalign every later row
+            fh.truncate(end * ROW_BYTES)
+            fh.write(b''.join(vec for _, vec in new))
+        rows.update((sid, end + i) for i, (sid, _) in enumerate(new))
+    if existing:
+        with open(path, 'r+b') as fh:
+            for sid, vec in items:
+                if sid in existing:
+                    fh.seek(existing[sid] * ROW_BYTES)
+                    fh.write(vec)
+    conn.executemany("INSERT OR REPLACE INTO embeddings (sample_id, row) VALUES (?, ?)", rows.items())
+    return len(items)
+
+
+class _Index:
+    """Standardised, normalised copy of the store, ready for dot products."""
+
+    def __init__(self, vectors: np.ndarray, live: np.ndarray, quantize: bool):
+        x = np.asarray(vectors, dtype=np.float32)
+        n = len(x)
+        self.quantize = quantize
+        if n == 0 or not live.any():
+            mean, std = np.zeros(EMBED_DIM, np.float32), np.ones(EMBED_DIM, np.float32)
+        else:
+            mean, std = x[live].mean(axis=0), x[live].std(axis=0)
+        z = (x - mean) / np.where(std > 1e-9, std, 1.0)
+        norm = np.linalg.norm(z, axis=1, keepdims=True)
+        z = np.divide(z, norm, out=np.zeros_like(z), where=norm > 1e-9)
+        # dead rows score 0 against anything
+        z[~live] = 0
+        if quantize:
+            self.matrix = np.round(z * 127).astype(np.int8)
+        else:
+            # column-major: one contiguous pass per dimension beats row-wise gemv here
+            self.matrix = np.ascontiguousarray(z.T)
+        self.n = n
+
+    def vector(self, row: int) -> np.ndarray:
+        if self.quantize:
+            return self.matrix[row].astype(np.float32) / 127
+        return self.matrix[:, row].copy()
+
+    def scores(self, q: np.ndarray) -> np.ndarray:
+        if not self.quantize:
+            return q @ self.matrix
+        out = np.empty(self.n, np.float32)
+        buf = np.empty((QUANT_CHUNK, EMBED_DIM), np.float32)
+        for i in range(0, self.n, QUANT_CHUNK):
+            chunk = self.matrix[i:i + QUANT_CHUNK]
+            b = buf[:len(chunk)]
+            np.copyto(b, chunk)
+            np.dot(b, q, out=out[i:i + len(chunk)])
+        return out / 127
+
+
+_index_cache: Dict[Tuple[str, bool], Tuple[tuple, _Index]] = {}
+_index_lock = threading.Lock()
+
+
+def load_index(conn: sqlite3.Connection, quantize: bool = False) -> Optional[_Index]:
+    """The prepared index for the connection's store, rebuilt only when the
+    vector file changed since it was last built in this process."""
+    path = store_path(conn)
+    if path is None:
+        return None
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    stamp = (st.st_size, st.st_mtime_ns)
+    key = (str(path), quantize)
+    with _index_lock:
+        cached = _index_cache.get(key)
+        if cached is not None and cached[0] == stamp:
+            return cached[1]
+        vectors = open_vectors(path)
+        live = np.zeros(len(vectors), bool)
+        rows = np.fromiter((r[0] for r in conn.execute("SELECT row FROM embeddings")), np.int64)
+        live[rows[rows < len(vectors)]] = True
+        index = _Index(vectors, live, quantize)
+        _index_cache[key] = (stamp, index)
+        return index
+
+
+def find_similar(conn: sqlite3.Connection, sample_id: str, k: int = DEFAULT_K, quantize: bool = False) -> Optional[List[dict]]:
+    """The k samples whose timbre is closest to `sample_id`'s, best first,
+    with their cosine similarity as `score`. None when the sample has no
+    embedding yet."""
+    row = conn.execute("SELECT row FROM embeddings WHERE sample_id=?", (sample_id,)).fetchone()
+    index = load_index(conn, quantize) if row is not None else None
+    if index is None or row[0] >= index.n:
+        return None
+    scores = index.scores(index.vector(row[0]))
+    scores[row[0]] = -np.inf
+    # over-fetch a little: rows of deleted samples are dropped below
+    take = min(index.n, k + 16)
+    while True:
+        top = np.argpartition(-scores, take - 1)[:take] if take < index.n else np.arange(index.n)
+        top = top[np.argsort(-scores[top], kind='stable')]
+        placeholders = ','.join('?' for _ in top)
+        found = {r[0]: r for r in conn.execute(
+            f"SELECT e.row, s.id, s.full_path, s.filename FROM embeddings e JOIN samples s ON s.id = e.sample_id "
+            f"WHERE e.row IN ({placeholders})", top.tolist())}
+        out = [
+            {'id': found[r][1], 'full_path': found[r][2], 'filename': found[r][3], 'score': round(float(scores[r]), 4)}
+            for r in top.tolist() if r in found and r != row[0]
+        ]
+        if len(out) >= k or take >= index.n:
+            return out[:k]
+        take = min(index.n, take * 4)
+
+
+def compact(conn: sqlite3.Connection) -> int:
+    """Rewrite the store with only the rows samples still map to, in row
+    order, and renumber them. Returns the rows kept."""
+    path = store_path(conn)
+    if path is None or not path.exists():
+        return 0
+    vectors = open_vectors(path)
+    mapping = conn.execute("SELECT sample_id, row FROM embeddings WHERE row < ? ORDER BY row", (len(vectors),)).fetchall()
+    tmp = path.with_name(path.name + '.tmp')
+    with open(tmp, 'wb') as fh:
+        for i in range(0, len(mapping), 65536):
+            fh.write(np.ascontiguousarray(vectors[[r[1] for r in mapping[i:i + 65536]]]).tobytes())
+    del vectors
+    with conn:
+        conn.execute("DELETE FROM embeddings WHERE row >= ?", (_row_count(path),))
+        conn.executemany("UPDATE embeddings SET row=? WHERE sample_id=?", ((i, r[0]) for i, r in enumerate(mapping)))
+        os.replace(tmp, path)
+    return len(mapping)
+
+
+def backfill(conn: sqlite3.Connection, limit: Optional[int] = None) -> int:
+    """Embed analysed samples that have no vector (analysed before timbre
+    existed, or restored from a tombstone), from the analysis cache where
+    possible. Returns how many were embedded."""
+    from . import db as dbmod
+    from . import dsp
+    sql = ("SELECT id, full_path FROM samples WHERE content_hash IS NOT NULL "
+           "AND id NOT IN (SELECT sample_id FROM embeddings)")
+    rows = conn.execute(sql + (" LIMIT ?" if limit else ""), (limit,) if limit else ()).fetchall()
+    cache = lambda h, keys: dbmod.get_cached_analyses(conn, h, keys)
+    done = 0
+    for sample_id, full_path in rows:
+        meta = dsp.extract_audio_metadata(full_path, extractors=['timbre'], cache=cache)
+        if meta.get('timbre') is None:
+            continue
+        with conn:
+            done += put_embeddings(conn, [(sample_id, meta['timbre'])])
+            dbmod.put_cached_analyses(conn, [(meta['content_hash'], a, r) for a, r in meta['analyses'].items()])
+    return done
+
+
+if __name__ == '__main__':
+    import argparse
+
+    from . import db as dbmod
+
+    parser = argparse.ArgumentParser(description='Maintain the timbre vector store')
+    parser.add_argument('action', choices=('backfill', 'compact'))
+    parser.add_argument('--db', default=None)
+    parser.add_argument('--limit', type=int, default=None)
+    args = parser.parse_args()
+    conn = dbmod.get_conn(args.db) if args.db else dbmod.get_conn()
+    dbmod.init_db(conn)
+    if args.action == 'backfill':
+        print('embedded', backfill(conn, args.limit))
+    else:
+        print('kept', compact(conn), 'rows')
+    conn.close()
@@ -0,0 +1,169 @@
+"""Amplitude envelope features and a loop / one-shot estimate.
+
+Everything works on a 10 ms RMS envelope built with one reshape, so a
+30 s buffer costs a millisecond or two and the analysis can run on every
+file, including at scan time (analyze_file) where only a bounded part of
+the file is decoded.
+
+- attack: seconds from the envelope first coming within ATTACK_DB of its
+  peak to the peak;
+- decay: seconds from the peak to the last frame within DECAY_DB of it;
+- onsets: jumps of at least ONSET_DB between frames that are local maxima
+  of the envelope rise, at least MIN_ONSET_GAP apart;
+- periodicity: the highest normalised autocorrelation of the onset curve at
+  lags of LAG_RANGE seconds (30-300 BPM), 0 when there is no pulse;
+- tail: level of the loudest frame in the last TAIL_FRACTION of the file,
+  relative to the peak (loops end at full level, one-shots die out).
+
+loop_probability() folds these and the duration into a logistic score.
+"""
+from __future__ import annotations
+
+import math
+from pathlib import Path
+from typing import NamedTuple, Optional, Tuple
+
+import numpy as np
+
+FRAME_SECONDS = 0.01
+ATTACK_DB = 20.0
+DECAY_DB = 20.0
+ONSET_DB = 6.0
+# onsets are only counted while the envelope is within this of the peak
+ONSET_FLOOR_DB = 35.0
+MIN_ONSET_GAP = 0.05
+LAG_RANGE = (0.2, 2.0)
+TAIL_FRACTION = 0.1
+MIN_TAIL_SECONDS = 0.1
+SILENCE_DB = -90.0
+# at most this much of a file is decoded by analyze_file: the start, plus
+# TAIL_SECONDS from the end of longer files
+MAX_SECONDS = 20.0
+TAIL_SECONDS = 2.0
+
+# logistic weights for loop_probability, hand-fitted on labelled loops and
+# one-shots
+LOOP_BIAS = -2.0
+LOOP_TAIL_WEIGHT = 2.5
+LOOP_PERIODICITY_WEIGHT = 2.5
+LOOP_ONSET_WEIGHT = 0.6
+LOOP_DURATION_WEIGHT = 1.0
+LOOP_SINGLE_HIT_PENALTY = 1.5
+
+
+class EnvelopeFeatures(NamedTuple):
+    attack: float
+    decay: float
+    onsets: int
+    periodicity: float
+    tail_db: float
+    duration: float
+
+    @property
+    def loop_probability(self) -> float:
+        return loop_probability(self)
+
+
+def _rms_db(y: np.ndarray, hop: int) -> np.ndarray:
+    n = len(y) // hop
+    if n == 0:
+        return np.full(1, SILENCE_DB)
+    frames = y[:n * hop].reshape(n, hop)
+    rms = np.sqrt(np.einsum('ij,ij->i', frames, frames) / hop)
+    return np.maximum(20 * np.log10(rms + 1e-12), SILENCE_DB)
+
+
+def _onsets(db: np.ndarray, peak_db: float, hop_s: float) -> Tuple[np.ndarray, np.ndarray]:
+    """Frame indices of onsets, and the onset curve they were picked from."""
+    rise = np.maximum(np.diff(db, prepend=db[0]), 0.0)
+    gap = max(1, int(round(MIN_ONSET_GAP / hop_s)))
+    padded = np.pad(rise, gap, mode='constant')
+    local_max = np.lib.stride_tricks.sliding_window_view(padded, 2 * gap + 1).max(axis=1)
+    picked = np.flatnonzero((rise >= ONSET_DB) & (rise == local_max) & (db >= peak_db - ONSET_FLOOR_DB))
+    # plateaus of equal rise give neighbouring maxima: keep the first of each
+    if len(picked) > 1:
+        picked = picked[np.r_[True, np.diff(picked) > gap]]
+    return picked, rise
+
+
+def _periodicity(rise: np.ndarray, hop_s: float) -> float:
+    lo, hi = (int(round(s / hop_s)) for s in LAG_RANGE)
+    x = rise - rise.mean()
+    # two full periods of the slowest pulse are needed to call it periodic
+    if len(x) < 2 * lo or not x.any():
+        return 0.0
+    n = 1 << (2 * len(x) - 1).bit_length()
+    spec = np.fft.rfft(x, n)
+    ac = np.fft.irfft(spec * np.conj(spec), n)[:len(x)]
+    if ac[0] <= 0:
+        return 0.0
+    hi = min(hi, len(x) // 2)
+    # unbiased: scale each lag by how many frame pairs it covers
+    ac = ac[lo:hi + 1] / ac[0] * (len(x) / (len(x) - np.arange(lo, hi + 1)))
+    return float(np.clip(ac.max(), 0.0, 1.0)) if len(ac) else 0.0
+
+
+def analyze(y: np.ndarray, sr: int, duration: Optional[float] = None, head: Optional[int] = None) -> EnvelopeFeatures:
+    """Envelope features of mono samples `y`. Attack, onsets and periodicity
+    come from the contiguous first `head` samples (all of y by default); the
+    tail from the end of y, which is the end of the file."""
+    y = np.asarray(y, dtype=np.float32)
+    hop = max(1, int(round(sr * FRAME_SECONDS)))
+    hop_s = hop / float(sr)
+    duration = float(duration if duration else len(y) / float(sr))
+    db = _rms_db(y if head is None else y[:head], hop)
+    peak = int(db.argmax())
+    peak_db = float(db[peak])
+    if peak_db <= SILENCE_DB:
+        return EnvelopeFeatures(0.0, 0.0, 0, 0.0, 0.0, duration)
+    start = int(np.argmax(db >= peak_db - ATTACK_DB))
+    after = np.flatnonzero(db[peak:] >= peak_db - DECAY_DB)
+    onsets, rise = _onsets(db, peak_db, hop_s)
+    tail_len = max(hop, int(max(MIN_TAIL_SECONDS, TAIL_FRACTION * len(y) / sr) * sr))
+    tail_db = float(_rms_db(y[-tail_len:], hop).max()) - peak_db
+    return EnvelopeFeatures(
+        attack=round((peak - start) * hop_s, 4),
+        decay=round(float(after[-1]) * hop_s, 4),
+        onsets=int(len(onsets)),
+        periodicity=round(_periodicity(rise, hop_s), 4),
+        tail_db=round(min(tail_db, 0.0), 2),
+        duration=duration,
+    )
+
+
+def loop_probability(f: EnvelopeFeatures) -> float:
+    """Logistic loop score: a loop keeps its level to the end, has a pulse,
+    several onsets and some length; a one-shot is a single hit dying out."""
+    z = (LOOP_BIAS
+         + LOOP_TAIL_WEIGHT * min(max((f.tail_db + 30.0) / 20.0, 0.0), 1.5)
+         + LOOP_PERIODICITY_WEIGHT * f.periodicity
+         + LOOP_ONSET_WEIGHT * min(math.log2(max(f.onsets, 1)), 4.0)
+         + LOOP_DURATION_WEIGHT * min(max(math.log2(max(f.duration, 1e-3)), -2.0), 3.0)
+         - LOOP_SINGLE_HIT_PENALTY * (f.onsets <= 1))
+    return round(1.0 / (1.0 + math.exp(-z)), 4)
+
+
+def analyze_file(path: Path | str, max_seconds: float = MAX_SECONDS) -> Optional[EnvelopeFeatures]:
+    """Envelope features from at most `max_seconds` of a file: the start,
+    plus its last TAIL_SECONDS when it is longer. None if libsndfile can't
+    read it."""
+    import soundfile as sf
+    try:
+        with sf.SoundFile(str(path)) as f:
+            sr, frames = int(f.samplerate), int(f.frames)
+            limit = int(max_seconds * sr)
+            if frames <= limit:
+                y = f.read(dtype='float32', always_2d=True)
+                head = None
+            else:
+                tail = int(TAIL_SECONDS * sr)
+                y = f.read(limit - tail, dtype='float32', always_2d=True)
+                head = len(y)
+                f.seek(frames - tail)
+                y = np.concatenate([y, f.read(tail, dtype='float32', always_2d=True)])
+    except Exception:
+        return None
+    if frames == 0:
+        return None
+    mono = y.mean(axis=1) if y.shape[1] > 1 else y[:, 0]
+    return analyze(mono, sr, frames / float(sr), head=head)
@@ -0,0 +1,150 @@
+"""File identity helpers.
+
+A sample's id is derived from where the file lives on the filesystem
+(st_dev, st_ino) plus a quick content fingerprint, not from its path, so
+moving or renaming a file keeps its row -- and the DSP results and autotags
+attached to it. The fingerprint guards against inode reuse after a delete.
+
+Full content hashes are stored as "<algo>:<hex>". Finding duplicates is two
+stage: files are grouped by (size, quick fingerprint), which the scanner
+already stores, and only files whose fingerprint collides are hashed in full.
+"""
+from __future__ import annotations
+
+import hashlib
+import os
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# bytes read from each end of the file for the quick fingerprint
+FINGERPRINT_BLOCK = 4096
+
+# 256-bit digests either way. sha256 runs on SHA-NI / ARMv8 crypto extensions
+# and beats blake2b wherever those exist; blake2b is faster on CPUs without.
+HASH_ALGOS = {
+    'sha256': hashlib.sha256,
+    'blake2b': lambda: hashlib.blake2b(digest_size=32),
+}
+DEFAULT_HASH_ALGO = 'sha256'
+# readinto() buffer for full-file hashing
+HASH_BUFFER = 1 << 20
+
+
+def quick_fingerprint(path: Path | str, size: Optional[int] = None) -> Optional[str]:
+    """blake2b over the size and the first/last FINGERPRINT_BLOCK bytes.
+    Two reads at most per file; returns None when the file can't be read."""
+    h = hashlib.blake2b(digest_size=16)
+    try:
+        with open(path, 'rb', buffering=0) as f:
+            if size is None:
+                size = os.fstat(f.fileno()).st_size
+            h.update(str(size).encode('ascii'))
+            h.update(f.read(FINGERPRINT_BLOCK))
+            if size > FINGERPRINT_BLOCK:
+                f.seek(max(FINGERPRINT_BLOCK, size - FINGERPRINT_BLOCK))
+                h.update(f.read(FINGERPRINT_BLOCK))
+    except OSError:
+        return None
+    return h.hexdigest()
+
+
+def sample_id(dev: int, inode: int, fingerprint: Optional[str], full_path: Path | str) -> str:
+    """Stable sample id. Falls back to the path where the platform reports no
+    inode (e.g. FAT volumes, DirEntry.stat on Windows)."""
+    m = hashlib.sha256()
+    if inode:
+        m.update(f"{dev}:{inode}".encode('ascii'))
+    else:
+        m.update(str(full_path).encode('utf-8'))
+    m.update(b"|")
+    m.update((fingerprint or '').encode('ascii'))
+    return m.hexdigest()
+
+
+def hash_bytes(data, algo: str = DEFAULT_HASH_ALGO) -> str:
+    h = HASH_ALGOS[algo]()
+    h.update(data)
+    return f"{algo}:{h.hexdigest()}"
+
+
+def hash_file(path: Path | str, algo: str = DEFAULT_HASH_ALGO) -> Optional[str]:
+    """Tagged content hash of the whole file, read into one reused buffer.
+    Returns None when the file can't be read."""
+    h = HASH_ALGOS[algo]()
+    buf = bytearray(HASH_BUFFER)
+    view = memoryview(buf)
+    try:
+        with open(path, 'rb', buffering=0) as f:
+            while True:
+                n = f.readinto(buf)
+                if not n:
+                    break
+                h.update(view[:n])
+    except OSError:
+        return None
+    return f"{algo}:{h.hexdigest()}"
+
+
+def split_content_hash(value: str) -> Tuple[str, str]:
+    """(algo, hex) of a stored content hash; untagged values are sha256."""
+    algo, sep, digest = value.partition(':')
+    return (algo, digest) if sep else ('sha256', value)
+
+
+# (item id, path, size, quick fingerprint, stored content hash or None)
+HashCandidate = Tuple[str, str, int, Optional[str], Optional[str]]
+
+
+def find_duplicates(candidates: Iterable[HashCandidate], algo: str = DEFAULT_HASH_ALGO) -> Tuple[Dict[str, List[str]], int]:
+    """Group candidates by identical content.
+
+    Candidates are bucketed by (size, fingerprint) first; only buckets with
+    more than one member are hashed in full, reusing a stored hash when it was
+    made with `algo`. Returns ({content hash: [item ids]} for groups of two or
+    more, number of files hashed)."""
+    buckets: Dict[Tuple[int, str], List[HashCandidate]] = {}
+    for c in candidates:
+        _, path, size, fp, _ = c
+        fp = fp or quick_fingerprint(path, size)
+        if fp is not None:
+            buckets.setdefault((size, fp), []).append(c)
+    groups: Dict[str, List[str]] = {}
+    hashed = 0
+    for bucket in buckets.values():
+        if len(bucket) < 2:
+            continue
+        for item_id, path, _, _, stored in bucket:
+            if stored and split_content_hash(stored)[0] == algo:
+                digest = stored
+            else:
+                digest = hash_file(path, algo)
+                hashed += 1
+            if digest is not None:
+                groups.setdefault(digest, []).append(item_id)
+    return {k: v for k, v in groups.items() if len(v) > 1}, hashed
+
+
+if __name__ == '__main__':
+    import argparse
+    import time
+
+    from .db import get_conn, get_fingerprint_collisions, init_db
+
+    parser = argparse.ArgumentParser(description='Report duplicate samples (size/fingerprint prefilter, then full hash)')
+    parser.add_argument('--db', default=None)
+    parser.add_argument('--root', default=None, help='Only consider samples under this scan root')
+    parser.add_argument('--algo', choices=sorted(HASH_ALGOS), default=DEFAULT_HASH_ALGO)
+    args = parser.parse_args()
+    conn = get_conn(args.db) if args.db else get_conn()
+    init_db(conn)
+    total = conn.execute("SELECT COUNT(*) FROM samples").fetchone()[0]
+    t0 = time.monotonic()
+    rows = get_fingerprint_collisions(conn, args.root)
+    groups, hashed = find_duplicates(((r[0], r[1], r[2], r[3], r[4]) for r in rows), args.algo)
+    paths = {r[0]: r[1] for r in rows}
+    for digest, ids in groups.items():
+        print(digest)
+        for i in ids:
+            print('  ', paths[i])
+    print(f'{len(groups)} duplicate groups; hashed {hashed} of {total} files in {time.monotonic() - t0:.1f}s')
+    conn.close()
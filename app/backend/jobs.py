@@ -0,0 +1,85 @@
+"""Shared cancellation and progress reporting for scan and DSP jobs.
+
+Cancellation is an in-process threading.Event (see db.cancel_event), so the
+hot loop checks a flag instead of querying the DB. Progress is buffered and
+written at most once per `flush_interval`; the same flush also polls the
+job's cancel_requested column so cancels from another process are picked up.
+"""
+from __future__ import annotations
+
+import sqlite3
+import time
+from typing import Optional
+
+from . import db as dbmod
+
+DEFAULT_FLUSH_INTERVAL = 0.25
+
+# kind -> (table, progress writer)
+JOB_TABLES = {
+    'scan': ('scan_jobs', dbmod.set_job_progress),
+    'dsp': ('dsp_jobs', dbmod.set_dsp_progress),
+}
+
+
+class JobControl:
+    def __init__(self, conn: sqlite3.Connection, job_id: Optional[str], kind: str = 'scan', flush_interval: float = DEFAULT_FLUSH_INTERVAL):
+        """A job_id of None gives a no-op control (never cancelled, nothing written)."""
+        self.conn = conn
+        self.job_id = job_id
+        self.table, self._write_progress = JOB_TABLES[kind]
+        self.flush_interval = flush_interval
+        self.done = 0
+        self.total: Optional[int] = None
+        self._event = dbmod.cancel_event(job_id) if job_id else None
+        self._started = time.monotonic()
+        self._last_flush = self._started
+        self._dirty = False
+        if job_id:
+            self._poll_cancel()
+
+    def cancelled(self) -> bool:
+        return self._event is not None and self._event.is_set()
+
+    def progress(self, done: int, total: Optional[int] = None):
+        """Record progress; writes to the DB only when flush_interval has elapsed."""
+        self.done = done
+        if total is not None:
+            self.total = total
+        self._dirty = True
+        if self.job_id and time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def throughput(self) -> float:
+        elapsed = time.monotonic() - self._started
+        return self.done / elapsed if elapsed > 0 else 0.0
+
+    def flush(self):
+        """Write buffered progress now and poll for a cross-process cancel."""
+        self._last_flush = time.monotonic()
+        if not self.job_id:
+            return
+        try:
+            if self._dirty:
+                self._write_progress(self.conn, self.job_id, self.done, self.total if self.total is not None else 0,
+                                     round(self.throughput(), 2))
+                self._dirty = False
+            self._poll_cancel()
+        except sqlite3.Error:
+            # progress is best-effort; never fail the job over it
+            pass
+
+    def _poll_cancel(self):
+        try:
+            r = self.conn.execute(f"SELECT cancel_requested FROM {self.table} WHERE id=?", (self.job_id,)).fetchone()
+        except sqlite3.Error:
+            return
+        if r and r[0] == 1:
+            self._event.set()
+
+    def close(self):
+        """Final progress flush; call when the job loop ends."""
+        if self.job_id:
+            self.flush()
+            with dbmod._inproc_cancel_lock:
+                dbmod._inproc_cancel_registry.pop(self.job_id, None)
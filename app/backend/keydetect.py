@@ -0,0 +1,126 @@
+"""Musical key estimation from chroma.
+
+Every major and minor key is a Krumhansl profile rotated to its tonic. The
+24 profiles are mean-centred and normalised once into TEMPLATES, so scoring
+a batch of 12-bin chroma vectors (centred and normalised the same way) is a
+single matmul, and each score is the Pearson correlation between a chroma
+vector and a key profile.
+
+An estimate keeps the best key, its correlation (`confidence`) and the gap
+to the runner-up (`margin`; relative major/minor pairs are often close).
+The DSP pass stores the mean chroma of each sample as a blob, so
+rekey() can re-estimate a whole library without decoding any audio.
+"""
+from __future__ import annotations
+
+import sqlite3
+from typing import Iterable, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from .audio_probe import NOTE_NAMES
+
+# Krumhansl major/minor profiles
+MAJOR_TEMPLATE = np.array([6.35, 2.23, 3.48, 2.33, 4.38, 4.09, 2.52, 5.19, 2.39, 3.66, 2.29, 2.88])
+MINOR_TEMPLATE = np.array([6.33, 2.68, 3.52, 5.38, 2.60, 3.53, 2.54, 4.75, 3.98, 2.69, 3.34, 3.17])
+
+# row order of TEMPLATES: the 12 major keys from C, then the 12 minor keys
+KEY_NAMES = [f"{n}:maj" for n in NOTE_NAMES] + [f"{n}:min" for n in NOTE_NAMES]
+
+REKEY_BATCH = 10_000
+
+
+def _centre(x: np.ndarray) -> np.ndarray:
+    """Mean-centre and L2-normalise rows; all-flat rows become zeros."""
+    x = x - x.mean(axis=-1, keepdims=True)
+    norm = np.linalg.norm(x, axis=-1, keepdims=True)
+    return np.divide(x, norm, out=np.zeros_like(x), where=norm > 1e-12)
+
+
+TEMPLATES = _centre(np.stack(
+    [np.roll(MAJOR_TEMPLATE, t) for t in range(12)] + [np.roll(MINOR_TEMPLATE, t) for t in range(12)]
+)).astype(np.float32)
+
+
+class KeyEstimate(NamedTuple):
+    key: Optional[str]
+    confidence: Optional[float]
+    margin: Optional[float]
+
+
+def score(chroma: np.ndarray) -> np.ndarray:
+    """(n, 24) correlations of n chroma vectors (shape (n, 12) or (12,))
+    with every key, in KEY_NAMES order."""
+    c = np.atleast_2d(np.asarray(chroma, dtype=np.float32))
+    return _centre(c) @ TEMPLATES.T
+
+
+def top_keys(chroma: np.ndarray, k: int = 3) -> List[List[Tuple[str, float]]]:
+    """The k best (key, correlation) pairs per chroma vector, best first."""
+    s = score(chroma)
+    idx = np.argsort(-s, axis=1, kind='stable')[:, :k]
+    return [[(KEY_NAMES[j], float(row[j])) for j in order] for row, order in zip(s, idx)]
+
+
+def estimate(chroma: np.ndarray) -> List[KeyEstimate]:
+    """Best key per chroma vector with its confidence and margin. A silent
+    or flat chroma correlates with nothing and gets KeyEstimate(None, ...)."""
+    s = score(chroma)
+    top2 = -np.partition(-s, 1, axis=1)[:, :2]
+    best = s.argmax(axis=1)
+    out = []
+    for i, j in enumerate(best):
+        if not s[i].any():
+            out.append(KeyEstimate(None, None, None))
+            continue
+        out.append(KeyEstimate(KEY_NAMES[j], round(float(top2[i, 0]), 4), round(float(top2[i, 0] - top2[i, 1]), 4)))
+    return out
+
+
+def encode_chroma(chroma: np.ndarray) -> bytes:
+    return np.asarray(chroma, dtype='<f4').reshape(12).tobytes()
+
+
+def decode_chroma(blobs: Iterable[bytes]) -> np.ndarray:
+    """(n, 12) array from n chroma blobs."""
+    return np.frombuffer(b''.join(blobs), '<f4').reshape(-1, 12)
+
+
+def rekey(conn: sqlite3.Connection, batch: int = REKEY_BATCH) -> int:
+    """Re-estimate key_detected/key_confidence/key_margin of every sample
+    with a stored chroma, `batch` rows (one matmul) at a time."""
+    done = 0
+    last = 0
+    while True:
+        rows = conn.execute(
+            "SELECT rowid, chroma FROM samples WHERE rowid > ? AND chroma IS NOT NULL ORDER BY rowid LIMIT ?",
+            (last, batch),
+        ).fetchall()
+        if not rows:
+            return done
+        ests = estimate(decode_chroma(r[1] for r in rows))
+        with conn:
+            conn.executemany(
+                "UPDATE samples SET key_detected=?, key_confidence=?, key_margin=? WHERE rowid=?",
+                [(e.key, e.confidence, e.margin, r[0]) for e, r in zip(ests, rows)],
+            )
+        done += len(rows)
+        last = rows[-1][0]
+
+
+if __name__ == '__main__':
+    import argparse
+    import time
+
+    from . import db as dbmod
+
+    parser = argparse.ArgumentParser(description='Re-estimate sample keys from the chroma stored by the DSP pass')
+    parser.add_argument('--db', default=None)
+    parser.add_argument('--batch', type=int, default=REKEY_BATCH)
+    args = parser.parse_args()
+    conn = dbmod.get_conn(args.db) if args.db else dbmod.get_conn()
+    dbmod.init_db(conn)
+    t0 = time.monotonic()
+    n = rekey(conn, args.batch)
+    print('rekeyed', n, f'in {time.monotonic() - t0:.1f}s')
+    conn.close()
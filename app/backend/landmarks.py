@@ -0,0 +1,134 @@
+"""Perceptual fingerprints from spectral peak landmarks.
+
+Audio is resampled to FP_SR and the strongest local maxima of its log
+spectrogram are paired with a few later peaks nearby ("landmarks"). Each pair
+hashes to (anchor bin, target bin, frame delta), which survives re-exports
+at another bit depth or sample rate; the anchor frame is kept alongside, so
+trimmed or padded silence only shifts every match by the same offset.
+
+A sample's landmarks are stored as a blob (encode/decode below) and fanned
+out into the landmark_index table, an inverted index from hash to sample.
+match_offsets() scores candidates by the largest set of hashes that agree on
+one time offset.
+"""
+from __future__ import annotations
+
+from typing import Dict, Iterable, List, Tuple
+
+import numpy as np
+
+FP_SR = 11025
+FP_N_FFT = 1024
+FP_HOP = 256
+# only the first minute is fingerprinted
+FP_MAX_SECONDS = 60
+# local-maximum neighbourhood in (bins, frames)
+PEAK_NEIGHBORHOOD = (15, 7)
+# strongest peaks kept per second of audio, and landmarks kept per sample
+PEAKS_PER_SECOND = 30
+MAX_LANDMARKS = 64
+# target zone: up to FAN_OUT peaks within DT frames after the anchor and
+# DF bins of it
+FAN_OUT = 3
+MAX_DT = 63
+MAX_DF = 127
+# hashes drop the lowest bit of each bin and of the delta, so peaks that
+# move by one bin/frame between re-exports still collide: 8 + 8 + 5 bits
+F_SHIFT = 1
+DT_SHIFT = 1
+# frames of slack when matching offsets
+OFFSET_SLACK = 1
+# aligned hashes needed to call two samples near-duplicates
+MIN_MATCHES = 5
+
+
+def _peaks(y: np.ndarray, sr: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """(bins, frames, strengths) of spectral peaks, strongest first."""
+    import librosa
+    from scipy.ndimage import maximum_filter
+
+    if sr != FP_SR:
+        y = librosa.resample(y, orig_sr=sr, target_sr=FP_SR)
+    y = y[:FP_SR * FP_MAX_SECONDS]
+    if len(y) < FP_N_FFT:
+        return np.empty(0, int), np.empty(0, int), np.empty(0)
+    spec = np.log1p(np.abs(librosa.stft(y, n_fft=FP_N_FFT, hop_length=FP_HOP)) * 100.0)
+    # drop the DC bin and the Nyquist bin: 511 bins
+    spec = spec[1:-1]
+    floor = spec.mean() + spec.std()
+    mask = (spec == maximum_filter(spec, size=PEAK_NEIGHBORHOOD, mode='constant')) & (spec > floor)
+    bins, frames = np.nonzero(mask)
+    strength = spec[bins, frames]
+    keep = max(1, int(PEAKS_PER_SECOND * len(y) / FP_SR))
+    order = np.argsort(-strength, kind='stable')[:keep]
+    return bins[order], frames[order], strength[order]
+
+
+def landmark_hashes(y: np.ndarray, sr: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Up to MAX_LANDMARKS (hash, anchor frame) pairs, strongest anchors first."""
+    bins, frames, _ = _peaks(np.asarray(y, dtype=np.float32), sr)
+    hashes: List[int] = []
+    times: List[int] = []
+    seen = set()
+    # peaks in time order for the target zone search
+    by_time = np.argsort(frames, kind='stable')
+    t_sorted = frames[by_time]
+    for f1, t1 in zip(bins, frames):
+        start = np.searchsorted(t_sorted, t1 + 1)
+        stop = np.searchsorted(t_sorted, t1 + MAX_DT + 1)
+        paired = 0
+        for j in by_time[start:stop]:
+            f2 = bins[j]
+            if abs(int(f2) - int(f1)) > MAX_DF:
+                continue
+            h = ((int(f1) >> F_SHIFT) << 13) | ((int(f2) >> F_SHIFT) << 5) | (int(frames[j] - t1) >> DT_SHIFT)
+            if (h, t1) not in seen:
+                seen.add((h, t1))
+                hashes.append(h)
+                times.append(int(t1))
+            paired += 1
+            if paired == FAN_OUT:
+                break
+        if len(hashes) >= MAX_LANDMARKS:
+            break
+    return np.array(hashes[:MAX_LANDMARKS], dtype=np.uint32), np.array(times[:MAX_LANDMARKS], dtype=np.uint16)
+
+
+def encode(hashes: np.ndarray, times: np.ndarray) -> bytes:
+    return hashes.astype('<u4').tobytes() + np.minimum(times, 0xFFFF).astype('<u2').tobytes()
+
+
+def decode(blob: bytes) -> Tuple[np.ndarray, np.ndarray]:
+    n = len(blob) // 6
+    return np.frombuffer(blob, '<u4', n), np.frombuffer(blob, '<u2', n, offset=4 * n)
+
+
+def match_offsets(query: Iterable[Tuple[int, int]], postings: Iterable[Tuple[int, int, int]]) -> Dict[int, int]:
+    """Count, per candidate, the query hashes that line up on its best time
+    offset. `query` is (hash, time) pairs; `postings` (candidate, hash, time)
+    rows for those hashes, candidates being integers."""
+    q = np.array(list(query), dtype=np.int64).reshape(-1, 2)
+    p = np.array(list(postings), dtype=np.int64).reshape(-1, 3)
+    if not len(q) or not len(p):
+        return {}
+    cands, offsets = [], []
+    # one vector pass per distinct query hash (at most MAX_LANDMARKS)
+    for h in np.unique(q[:, 0]):
+        hit = p[p[:, 1] == h]
+        for qt in q[q[:, 0] == h, 1]:
+            cands.append(hit[:, 0])
+            offsets.append((hit[:, 2] - qt) // (OFFSET_SLACK + 1))
+    cand = np.concatenate(cands)
+    off = np.concatenate(offsets)
+    if not len(cand):
+        return {}
+    # votes per (candidate, offset bin); the neighbouring bin is added so
+    # frame jitter from resampling doesn't split a match
+    keys, counts = np.unique(np.stack([cand, off], axis=1), axis=0, return_counts=True)
+    nxt = np.zeros_like(counts)
+    same = (keys[1:, 0] == keys[:-1, 0]) & (keys[1:, 1] == keys[:-1, 1] + 1)
+    nxt[:-1][same] = counts[1:][same]
+    votes = counts + nxt
+    starts = np.flatnonzero(np.r_[True, keys[1:, 0] != keys[:-1, 0]])
+    best = np.maximum.reduceat(votes, starts)
+    return dict(zip(keys[starts, 0].tolist(), best.tolist()))
@@ -1,13 +1,22 @@
-from fastapi import FastAPI, BackgroundTasks
+from fastapi import FastAPI, BackgroundTasks, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from typing import List, Optional
+import hashlib
+import json
 import threading
 import uuid
 import time
 
-from .scanner import scan_roots
+from .scanner import iter_dry_run, scan_roots
+from . import waveform as waveform_mod
+from .embeddings import DEFAULT_K, find_similar
+from . import dsp_queue
+from .dsp_runner import DEFAULT_CHUNK_SIZE
+from .duplicates import decode_cursor, encode_cursor, find_near_duplicates, get_duplicates_page, KEEP_POLICIES
 from .db import get_conn, init_db, create_job, set_job_result, set_job_failed, mark_job_cancel_requested, get_job
+from .db import get_waveform, put_waveforms
 from .db import create_dsp_job, set_dsp_progress, set_dsp_result, set_dsp_failed, mark_dsp_cancel_requested, get_dsp_job, list_dsp_jobs
 import sqlite3
 
@@ -32,6 +41,10 @@ class ScanRequest(BaseModel):
     db_path: Optional[str] = None
     batch_size: Optional[int] = 500
     min_size: Optional[int] = 512
+    incremental: Optional[bool] = False
+    workers: Optional[int] = 1
+    # decode part of each file without a stored loop probability to route loops
+    analyze_audio: Optional[bool] = False
 
 
 @app.get("/")
@@ -44,7 +57,8 @@ def health():
     return {"status": "ok", "version": app.version}
 
 
-def _run_scan_job(job_id: str, roots: List[str], db_path: Optional[str], batch_size: int, min_size: int):
+def _run_scan_job(job_id: str, roots: List[str], db_path: Optional[str], batch_size: int, min_size: int, incremental: bool = False, workers: int = 1,
+                  analyze_audio: bool = False):
     conn = get_conn(db_path) if db_path else get_conn()
     # ensure schema exists
     init_db(conn)
@@ -58,7 +72,8 @@ def _run_scan_job(job_id: str, roots: List[str], db_path: Optional[str], batch_s
             _time.sleep(0.02)
         except Exception:
             pass
-        res = scan_roots(roots, db_path=db_path, batch_size=batch_size, min_size=min_size, job_id=job_id)
+        res = scan_roots(roots, db_path=db_path, batch_size=batch_size, min_size=min_size, job_id=job_id, incremental=incremental, workers=workers,
+                          analyze_audio=analyze_audio)
         set_job_result(conn, job_id, res)
         with _jobs_lock:
             if job_id in _jobs:
@@ -98,20 +113,25 @@ def start_scan(req: ScanRequest, background: BackgroundTasks):
         conn.close()
 
     # run in background thread to avoid blocking the server
-    t = threading.Thread(target=_run_scan_job, args=(job_id, req.roots, req.db_path, req.batch_size, req.min_size), daemon=True)
+    t = threading.Thread(target=_run_scan_job, args=(job_id, req.roots, req.db_path, req.batch_size, req.min_size, bool(req.incremental), req.workers or 1, bool(req.analyze_audio)), daemon=True)
     t.start()
     return {'job_id': job_id}
 
 
 @app.post('/scan/dryrun')
 def scan_dryrun(req: ScanRequest):
-    """Run a synchronous scan in dry-run mode and return planned moves summary."""
-    # call scan_roots with dry_run=True and return the summary directly
-    try:
-        res = scan_roots(req.roots, db_path=req.db_path, batch_size=req.batch_size, min_size=req.min_size, dry_run=True)
-        return res
-    except Exception as e:
-        return {'error': str(e)}, 500
+    """Stream the planned moves of a scan as NDJSON: one {"src", "dst",
+    "reasons"} line per move, then a {"summary": {...}} line. Nothing is moved
+    and the DB is not touched."""
+    def lines():
+        try:
+            for entry in iter_dry_run(req.roots, min_size=req.min_size, workers=req.workers or 1, analyze_audio=bool(req.analyze_audio)):
+                yield json.dumps(entry) + '\n'
+        except Exception as e:
+            # headers are already sent; report the failure in-band
+            yield json.dumps({'error': str(e)}) + '\n'
+    return StreamingResponse(lines(), media_type='application/x-ndjson')
+
 @app.post('/scan/{job_id}/cancel')
 def cancel_scan(job_id: str, db_path: Optional[str] = None):
     conn = get_conn(db_path) if db_path else get_conn()
@@ -160,20 +180,25 @@ def scan_status(job_id: str):
 def list_scans(limit: int = 100, offset: int = 0, db_path: Optional[str] = None):
     conn = get_conn(db_path) if db_path else get_conn()
     cur = conn.cursor()
-    cur.execute('SELECT id, status, roots, started_at, finished_at, cancel_requested FROM scan_jobs ORDER BY started_at DESC LIMIT ? OFFSET ?', (limit, offset))
+    cur.execute('SELECT id, status, roots, scanned, total, throughput, started_at, finished_at, cancel_requested FROM scan_jobs ORDER BY started_at DESC LIMIT ? OFFSET ?', (limit, offset))
     rows = [dict(r) for r in cur.fetchall()]
     conn.close()
     return {'rows': rows}
 
 
 @app.post('/dsp')
-def start_dsp(background: BackgroundTasks, db_path: Optional[str] = None, limit: int = 500):
-    """Start a DSP job to process unprocessed samples."""
+def start_dsp(background: BackgroundTasks, db_path: Optional[str] = None, limit: int = 500, workers: int = 1, chunk_size: int = DEFAULT_CHUNK_SIZE,
+              target_sr: int = 22050, max_seconds: float = 30.0, segments: int = 3, root: Optional[str] = None):
+    """Start a DSP job to process up to `limit` samples from the work queue,
+    samples below `root` first if given. target_sr and max_seconds (0 = file
+    rate / whole file) set the analysis policy."""
     job_id = str(uuid.uuid4())
     # persist job row
     conn = get_conn(db_path) if db_path else get_conn()
     init_db(conn)
     try:
+        if root:
+            dsp_queue.prioritize(conn, dsp_queue.PRIORITY_ROOT, root=root)
         create_dsp_job(conn, job_id, params='{}', db_path=db_path, total=0)
     finally:
         conn.close()
@@ -182,7 +207,9 @@ def start_dsp(background: BackgroundTasks, db_path: Optional[str] = None, limit:
     def _runner(jid, dbp, lim):
         try:
             import app.backend.dsp_runner as runner
-            n = runner.run_once(db_path=dbp, limit=lim, job_id=jid)
+            from app.backend.dsp import AnalysisPolicy
+            policy = AnalysisPolicy(target_sr or None, max_seconds or None, segments)
+            n = runner.run_once(db_path=dbp, limit=lim, job_id=jid, workers=workers, chunk_size=chunk_size, policy=policy)
         except Exception as e:
             conn2 = get_conn(dbp) if dbp else get_conn()
             try:
@@ -195,6 +222,43 @@ def start_dsp(background: BackgroundTasks, db_path: Optional[str] = None, limit:
     return {'job_id': job_id}
 
 
+class DspQueueRequest(BaseModel):
+    sample_ids: List[str] = []
+    root: Optional[str] = None
+    priority: int = dsp_queue.PRIORITY_ROOT
+    release_quarantined: bool = False
+    db_path: Optional[str] = None
+
+
+@app.get('/dsp/queue')
+def dsp_queue_status(quarantined_limit: int = 100, db_path: Optional[str] = None):
+    """DSP work queue counts by state, and the quarantined files with the
+    error that put them there."""
+    conn = get_conn(db_path) if db_path else get_conn()
+    try:
+        dsp_queue.enqueue_unprocessed(conn)
+        return {**dsp_queue.stats(conn), 'quarantined_samples': dsp_queue.list_quarantined(conn, limit=quarantined_limit)}
+    finally:
+        conn.close()
+
+
+@app.post('/dsp/queue')
+def prioritize_dsp(req: DspQueueRequest):
+    """Move samples (by id and/or below a root) up the DSP work queue;
+    release_quarantined gives the given quarantined samples (all of them
+    when no ids are given) another set of attempts first."""
+    conn = get_conn(req.db_path) if req.db_path else get_conn()
+    init_db(conn)
+    try:
+        released = 0
+        if req.release_quarantined:
+            released = dsp_queue.release_quarantined(conn, req.sample_ids or None)
+        queued = dsp_queue.prioritize(conn, req.priority, req.sample_ids, root=req.root)
+    finally:
+        conn.close()
+    return {'queued': queued, 'released': released}
+
+
 @app.get('/dsp/{job_id}')
 def dsp_status(job_id: str, db_path: Optional[str] = None):
     conn = get_conn(db_path) if db_path else get_conn()
@@ -223,28 +287,75 @@ def cancel_dsp(job_id: str, db_path: Optional[str] = None):
         conn.close()
 
 
+class WatchRequest(BaseModel):
+    roots: List[str]
+    db_path: Optional[str] = None
+    min_size: Optional[int] = 512
+    poll: Optional[bool] = False
+
+
+_watcher = None
+_watcher_lock = threading.Lock()
+
+
+@app.post('/watch')
+def start_watch(req: WatchRequest):
+    """Start (or restart) the live watcher for the given roots."""
+    global _watcher
+    from .watcher import LibraryWatcher
+    with _watcher_lock:
+        if _watcher is not None:
+            _watcher.stop()
+        _watcher = LibraryWatcher(req.roots, db_path=req.db_path, min_size=req.min_size, backend='poll' if req.poll else 'auto').start()
+        return {'status': 'watching', 'roots': [str(r) for r in _watcher.roots]}
+
+
+@app.get('/watch')
+def watch_status():
+    with _watcher_lock:
+        if _watcher is None or not _watcher.running:
+            return {'status': 'stopped'}
+        return {'status': 'watching', 'roots': [str(r) for r in _watcher.roots], 'stats': dict(_watcher.stats)}
+
+
+@app.post('/watch/stop')
+def stop_watch():
+    global _watcher
+    with _watcher_lock:
+        if _watcher is not None:
+            _watcher.stop()
+            _watcher = None
+    return {'status': 'stopped'}
+
+
 @app.get('/samples')
 def list_samples(
     limit: int = 100,
     offset: int = 0,
     instrument: Optional[str] = None,
+    min_key_confidence: Optional[float] = None,
     sort_by: Optional[str] = 'added_at',
     sort_dir: Optional[str] = 'desc',
     db_path: Optional[str] = None,
 ):
-    """List samples with optional sorting. `sort_by` is whitelisted to prevent SQL injection."""
-    allowed = {'added_at', 'filename', 'size_bytes', 'bpm', 'sample_rate', 'fuzzy_score', 'instrument_hint', 'added_at'}
+    """List samples with optional sorting. `sort_by` is whitelisted to prevent SQL injection.
+    `min_key_confidence` keeps only samples whose detected key correlates at least that well."""
+    allowed = {'added_at', 'filename', 'size_bytes', 'bpm', 'sample_rate', 'fuzzy_score', 'instrument_hint', 'key_confidence', 'added_at'}
     sort_col = sort_by if sort_by in allowed else 'added_at'
     sort_direction = 'ASC' if (sort_dir or '').lower() == 'asc' else 'DESC'
 
     conn = get_conn(db_path) if db_path else get_conn()
     cur = conn.cursor()
-    sql = 'SELECT id, full_path, filename, ext, size_bytes, bpm, sample_rate, channels, instrument_hint, fuzzy_score, added_at FROM samples'
+    sql = ('SELECT id, full_path, filename, ext, size_bytes, bpm, sample_rate, channels, instrument_hint, fuzzy_score, '
+           'key_detected, key_confidence, added_at FROM samples')
     where = []
     params = {}
     if instrument:
         where.append('instrument_hint = :instrument')
         params['instrument'] = instrument
+    if min_key_confidence is not None:
+        where.append('key_confidence >= :min_key_confidence')
+        params['min_key_confidence'] = min_key_confidence
     if where:
         sql += ' WHERE ' + ' AND '.join(where)
     sql += f' ORDER BY {sort_col} {sort_direction} LIMIT :limit OFFSET :offset'
@@ -256,13 +367,118 @@ def list_samples(
     return {'rows': rows}
 
 
+@app.get('/duplicates')
+def list_duplicates(
+    limit: int = 50,
+    cursor: Optional[str] = None,
+    root: Optional[str] = None,
+    keep: str = 'oldest',
+    db_path: Optional[str] = None,
+):
+    """Byte-identical sample groups, largest files first. Pass `next_cursor`
+    back as `cursor` for the next page. The sample to keep comes first."""
+    if keep not in KEEP_POLICIES:
+        keep = 'oldest'
+    conn = get_conn(db_path) if db_path else get_conn()
+    try:
+        after = decode_cursor(cursor) if cursor else None
+    except ValueError:
+        conn.close()
+        return JSONResponse({'error': 'bad cursor'}, status_code=400)
+    groups = get_duplicates_page(conn, limit, after=after, root=root, keep=keep)
+    conn.close()
+    return {
+        'groups': [g.to_dict() for g in groups],
+        'next_cursor': encode_cursor(groups[-1]) if len(groups) == limit else None,
+    }
+
+
 @app.get('/samples/{sample_id}')
 def get_sample(sample_id: str, db_path: Optional[str] = None):
     conn = get_conn(db_path) if db_path else get_conn()
     cur = conn.cursor()
     cur.execute('SELECT * FROM samples WHERE id = :id', {'id': sample_id})
     r = cur.fetchone()
+    if r and r['content_hash'] is None:
+        # being looked at: analyse it before the rest of the backlog (a hint;
+        # a database no writer has migrated yet has no queue)
+        try:
+            dsp_queue.prioritize(conn, dsp_queue.PRIORITY_VIEWED, [sample_id])
+        except sqlite3.OperationalError:
+            pass
     conn.close()
     if not r:
         return {'error': 'not found'}, 404
-    return dict(r)
+    # binary DSP columns (landmarks) aren't JSON; they have their own endpoints
+    return {k: r[k] for k in r.keys() if not isinstance(r[k], bytes)}
+
+
+@app.get('/samples/{sample_id}/near-duplicates')
+def near_duplicates(sample_id: str, limit: int = 20, db_path: Optional[str] = None):
+    """Samples that sound like re-exports of this one (landmark fingerprint
+    matches), best first. Empty with fingerprinted=false until the DSP pass
+    has run for the sample."""
+    conn = get_conn(db_path) if db_path else get_conn()
+    try:
+        if conn.execute("SELECT 1 FROM samples WHERE id=?", (sample_id,)).fetchone() is None:
+            return JSONResponse({'error': 'not found'}, status_code=404)
+        matches = find_near_duplicates(conn, sample_id, limit=limit)
+    finally:
+        conn.close()
+    return {'sample_id': sample_id, 'fingerprinted': matches is not None, 'matches': matches or []}
+
+
+@app.get('/samples/{sample_id}/similar')
+def similar_samples(sample_id: str, k: int = DEFAULT_K, quantize: bool = False, db_path: Optional[str] = None):
+    """The k samples closest in timbre ("kicks like this one"), best first,
+    scored by cosine similarity. quantize=true searches the int8 copy of the
+    vectors. Empty with embedded=false until the DSP pass has run for the
+    sample."""
+    conn = get_conn(db_path) if db_path else get_conn()
+    try:
+        if conn.execute("SELECT 1 FROM samples WHERE id=?", (sample_id,)).fetchone() is None:
+            return JSONResponse({'error': 'not found'}, status_code=404)
+        matches = find_similar(conn, sample_id, k=max(1, min(k, 500)), quantize=quantize)
+    finally:
+        conn.close()
+    return {'sample_id': sample_id, 'embedded': matches is not None, 'matches': matches or []}
+
+
+# waveforms only change with the file, and the ETag lets clients revalidate cheaply
+WAVEFORM_CACHE_CONTROL = 'public, max-age=3600'
+
+
+@app.get('/samples/{sample_id}/waveform')
+def sample_waveform(sample_id: str, request: Request, width: int = 128, format: str = 'json', db_path: Optional[str] = None):
+    """Min/max peaks at the coarsest precomputed level with >= `width`
+    columns. JSON: {"peaks": [min0, max0, min1, max1, ...] as int8, "width",
+    "scale" (absolute peak the int8 values are relative to), "duration"}.
+    format=bin returns the raw int8 pairs. Waveforms missing from the DSP
+    pass are computed and stored on first request."""
+    conn = get_conn(db_path) if db_path else get_conn()
+    row = get_waveform(conn, sample_id)
+    if row is None:
+        conn.close()
+        return JSONResponse({'error': 'not found'}, status_code=404)
+    data = row['data']
+    if data is None:
+        wf = waveform_mod.compute_file(row['full_path'])
+        if wf is None:
+            conn.close()
+            return JSONResponse({'error': 'audio could not be decoded'}, status_code=404)
+        data = waveform_mod.encode(wf)
+        with conn:
+            put_waveforms(conn, [(sample_id, data)])
+    conn.close()
+    etag = '"' + hashlib.blake2b(data + f'{width}:{format}'.encode(), digest_size=12).hexdigest() + '"'
+    headers = {'ETag': etag, 'Cache-Control': WAVEFORM_CACHE_CONTROL}
+    if request.headers.get('if-none-match') == etag:
+        return Response(status_code=304, headers=headers)
+    wf = waveform_mod.decode(data)
+    peaks = wf.level_for(width)
+    if format == 'bin':
+        return Response(peaks.tobytes(), media_type='application/octet-stream', headers=headers)
+    return JSONResponse(
+        {'peaks': peaks.ravel().tolist(), 'width': len(peaks), 'scale': wf.scale, 'duration': wf.duration},
+        headers=headers,
+    )
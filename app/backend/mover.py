@@ -0,0 +1,125 @@
+"""Plan/execute split for file moves.
+
+MovePlanner resolves destination names (with `_N` collision suffixes) against
+an in-memory set of taken names, listing each target directory at most once.
+MoveExecutor performs planned moves on a thread pool using os.rename, falling
+back to copy + unlink when source and destination are on different devices.
+"""
+from __future__ import annotations
+
+import errno
+import os
+import shutil
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+DEFAULT_MOVE_WORKERS = 8
+
+
+class PlannedMove(NamedTuple):
+    src: Path
+    dst: Path
+
+
+class MovePlanner:
+    def __init__(self, keep_moves: bool = True):
+        # target dir -> casefolded names present on disk or already planned.
+        # Casefolded so case-insensitive filesystems never get an overwrite.
+        self._taken: Dict[Path, Set[str]] = {}
+        self.moves: List[PlannedMove] = []
+        # streaming callers consume plan()'s return value and skip the list
+        self.keep_moves = keep_moves
+
+    def _names(self, target_dir: Path) -> Set[str]:
+        names = self._taken.get(target_dir)
+        if names is None:
+            try:
+                names = {n.casefold() for n in os.listdir(target_dir)}
+            except OSError:
+                names = set()
+            self._taken[target_dir] = names
+        return names
+
+    def plan(self, src: Path, target_dir: Path) -> Optional[Path]:
+        """Reserve a free destination for `src` inside `target_dir` and record
+        the move (when keep_moves). Returns None when src already lives below
+        target_dir."""
+        if target_dir in src.parents:
+            return None
+        names = self._names(target_dir)
+        name = src.name
+        if name.casefold() in names:
+            stem, suf = src.stem, src.suffix
+            i = 1
+            while f"{stem}_{i}{suf}".casefold() in names:
+                i += 1
+            name = f"{stem}_{i}{suf}"
+        names.add(name.casefold())
+        dst = target_dir / name
+        if self.keep_moves:
+            self.moves.append(PlannedMove(src, dst))
+        return dst
+
+
+def move_file(src: Path, dst: Path) -> Path:
+    """Rename src to dst; copy + unlink when they are on different devices."""
+    try:
+        os.rename(src, dst)
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+        shutil.copy2(src, dst)
+        os.unlink(src)
+    return dst
+
+
+class MoveExecutor:
+    """Runs planned moves on a bounded thread pool. Use as a context manager."""
+
+    def __init__(self, max_workers: int = DEFAULT_MOVE_WORKERS):
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='kass-move')
+        self._made_dirs: Set[Path] = set()
+        self._lock = threading.Lock()
+
+    def _ensure_dir(self, d: Path):
+        with self._lock:
+            if d in self._made_dirs:
+                return
+        os.makedirs(d, exist_ok=True)
+        with self._lock:
+            self._made_dirs.add(d)
+
+    def _run(self, move: PlannedMove) -> Path:
+        self._ensure_dir(move.dst.parent)
+        return move_file(move.src, move.dst)
+
+    def submit(self, moves: Iterable[PlannedMove]) -> List[Future]:
+        """Start moves in the background; each future resolves to the dst Path
+        or raises the OSError that stopped the move."""
+        return [self._pool.submit(self._run, m) for m in moves]
+
+    def close(self):
+        self._pool.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def execute_moves(moves: Iterable[PlannedMove], max_workers: int = DEFAULT_MOVE_WORKERS) -> Tuple[List[PlannedMove], List[Tuple[PlannedMove, Exception]]]:
+    """Run a plan to completion. Returns (done, failed)."""
+    moves = list(moves)
+    done: List[PlannedMove] = []
+    failed: List[Tuple[PlannedMove, Exception]] = []
+    with MoveExecutor(max_workers=max_workers) as ex:
+        for m, fut in zip(moves, ex.submit(moves)):
+            try:
+                fut.result()
+                done.append(m)
+            except Exception as e:
+                failed.append((m, e))
+    return done, failed
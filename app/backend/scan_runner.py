@@ -23,6 +23,8 @@ def run() -> None:
     parser.add_argument('--min-size', type=int, default=512, help='Minimum file size (bytes) to consider')
     parser.add_argument('--exts', default=None, help='Comma-separated list of extensions to include (e.g. .wav,.flac)')
     parser.add_argument('--job-id', default=None, help='Optional job id to record progress/cancellation')
+    parser.add_argument('--incremental', action='store_true', help='Only process files that are new or changed since the last scan')
+    parser.add_argument('--workers', type=int, default=1, help='Worker processes; roots and their top-level folders are scanned in parallel')
     parser.add_argument('--dry-run', action='store_true', help='Run scan without modifying your real DB (uses temporary DB)')
     parser.add_argument('--log-level', default='INFO', help='Logging level')
     args = parser.parse_args()
@@ -42,7 +44,7 @@ def run() -> None:
     if args.exts:
         exts = [e.strip() for e in args.exts.split(',') if e.strip()]
 
-    result = scan_roots(args.roots, db_path=db_path, batch_size=args.batch_size, min_size=args.min_size, exts=exts, job_id=args.job_id)
+    result = scan_roots(args.roots, db_path=db_path, batch_size=args.batch_size, min_size=args.min_size, exts=exts, job_id=args.job_id, incremental=args.incremental, workers=args.workers)
     print('Scan result:', result)
 
     if temp_db:
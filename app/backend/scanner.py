@@ -1,18 +1,21 @@
-import hashlib
 import json
-import os
-import shutil
 import csv
+import multiprocessing
+import os
+import queue
 from pathlib import Path
-from typing import Dict, Iterable, List, Optional
+from typing import Any, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
 
 from .filename_parser import parse_filename
+from .hashing import quick_fingerprint, sample_id
 from . import db as dbmod
-from .db import get_conn, init_db, upsert_sample
-try:
-    from .dsp import extract_audio_metadata
-except Exception:
-    extract_audio_metadata = None
+from .db import get_conn, init_db, upsert_samples_bulk
+from .walker import FileRecord, walk_files
+from .classifier import DRUM_SUBFOLDERS, INSTRUMENT_CLASSIFIER, SCANNER_CLASSIFIER
+from .mover import DEFAULT_MOVE_WORKERS, MoveExecutor, MovePlanner
+from .jobs import JobControl
+from .audio_probe import probe_duration
+from .envelope import analyze_file as analyze_envelope
 
 # folder name used for loops classification
 LOOPS_SUBPATH = "06 Loops & Grooves"
@@ -21,16 +24,17 @@ VOCALS_SUBPATH = "05 Vocals"
 # folder name used for drums classification
 DRUMS_SUBPATH = "01 Drums"
 LOOP_MIN_SECONDS = 2.0
+# loop probability (envelope.py, stored by the DSP pass) a file needs to be
+# routed to Loops: with a BPM hint in its name, and without any naming hint
+LOOP_PROBABILITY = 0.5
+LOOP_PROBABILITY_UNLABELED = 0.8
 
 DEFAULT_EXTS = {".wav", ".aiff", ".aif", ".flac", ".ogg", ".mp3"}
 
-
-def make_id(full_path: Path, size: int) -> str:
-    m = hashlib.sha256()
-    m.update(str(full_path).encode("utf-8"))
-    m.update(b"|")
-    m.update(str(size).encode("utf-8"))
-    return m.hexdigest()
+# records per message a shard worker sends back to the writer
+SHARD_CHUNK_SIZE = 256
+# walker threads inside each shard worker process
+SHARD_WALK_WORKERS = 4
 
 
 def valid_file(p: Path, exts: Optional[Iterable[str]] = None, min_size: int = 512) -> bool:
@@ -51,23 +55,364 @@ def valid_file(p: Path, exts: Optional[Iterable[str]] = None, min_size: int = 51
 
 
 def iter_files(roots: List[Path], exts: Optional[Iterable[str]] = None) -> Iterable[Path]:
+    for rec in iter_file_records(roots, exts=exts):
+        yield rec.path
+
+
+def iter_file_records(roots: List[Path], exts: Optional[Iterable[str]] = None, max_workers: Optional[int] = None) -> Iterable[FileRecord]:
+    """Like iter_files but yields FileRecord(path, size, mtime_ns, inode) so
+    callers don't need to stat each file again."""
     exts_set = set(e.lower() for e in (exts or DEFAULT_EXTS))
+    kwargs = {} if max_workers is None else {'max_workers': max_workers}
+    return walk_files([Path(r) for r in roots], exts=exts_set, **kwargs)
+
+
+def route_sample(p: Path, parsed: dict, root: Path, loop_probability: Optional[float] = None,
+                 analyze_audio: bool = False) -> Optional[Path]:
+    """Return the classification folder under `root` that `p` belongs in, or
+    None when it should stay where it is."""
+    return explain_route(p, parsed, root, loop_probability, analyze_audio)[0]
+
+
+def explain_route(p: Path, parsed: dict, root: Path, loop_probability: Optional[float] = None,
+                  analyze_audio: bool = False) -> Tuple[Optional[Path], List[str]]:
+    """route_sample plus the reasons behind the chosen folder, e.g.
+    ["rule: drum (filename)", "rule: Kicks (filename)"].
+
+    `loop_probability` is the one the DSP pass stored for the file, if any.
+    Without it only the header is read, unless analyze_audio asks for a
+    bounded decode (envelope.analyze_file) to estimate it."""
+    # one pass over the filename for every keyword rule; parser tokens are
+    # substrings of the name so they need no separate check, but a fuzzy
+    # instrument hint may not appear in the name at all
+    name_hits = SCANNER_CLASSIFIER.categories(p.name)
+    hint_hits: List[str] = []
+    instrument = parsed.get("instrument") or ""
+    if isinstance(instrument, str) and instrument:
+        hint_hits = INSTRUMENT_CLASSIFIER.categories(instrument)
+    hits = set(name_hits) | set(hint_hits)
+
+    def why(label: str) -> str:
+        return f"rule: {label} ({'filename' if label in name_hits else 'instrument hint'})"
+
+    # Prefer vocal classification first so vocal samples aren't swallowed by
+    # loop/BPM detection.
+    if 'vocal' in hits:
+        return root / VOCALS_SUBPATH, [why('vocal')]
+
+    target: Optional[Path] = None
+    subname: Optional[str] = None
+    reasons: List[str] = []
+    # drums-specific sorting: detect drum one-shots, fills, cymbals, toms, hats, snares
+    if 'drum' in hits:
+        subname = next((sub for sub in DRUM_SUBFOLDERS if sub in hits), None)
+        target = root / DRUMS_SUBPATH / (subname or "One Shots")
+        reasons = [why('drum'), why(subname) if subname else "default: One Shots"]
+
+    # loop/BPM-based routing overrides the drum folder:
+    # - If the filename explicitly contains 'loop', move to Loops.
+    # - Otherwise, unless the name already pins a drum type, go by the
+    #   envelope's loop probability when it is known. A BPM hint lowers the
+    #   bar it has to clear.
+    # - Without one, a BPM hint moves to Loops when duration >=
+    #   LOOP_MIN_SECONDS (or the duration can't be read).
+    if 'loop' in hits:
+        return root / LOOPS_SUBPATH, [why('loop')]
+    bpm = parsed.get("bpm")
+    prob = None
+    if bpm is not None or target is None or subname is None:
+        prob = loop_probability
+        if prob is None and analyze_audio:
+            features = analyze_envelope(p)
+            prob = features.loop_probability if features is not None else None
+    if prob is not None:
+        if prob >= (LOOP_PROBABILITY if bpm is not None else LOOP_PROBABILITY_UNLABELED):
+            hint = [f"bpm hint: {bpm}"] if bpm is not None else []
+            return root / LOOPS_SUBPATH, hint + [f"loop probability: {prob:.2f}"]
+        if target is not None and subname is None:
+            reasons = [reasons[0], f"one-shot: loop probability {prob:.2f}"]
+        return target, reasons
+    if bpm is not None:
+        should_move_loop = True
+        duration_note = "duration unknown"
+        # header-only probe: scans never decode audio unless asked to
+        dur = probe_duration(p)
+        if dur is not None:
+            should_move_loop = float(dur) >= float(LOOP_MIN_SECONDS)
+            duration_note = f"duration: {float(dur):.2f}s >= {LOOP_MIN_SECONDS}s"
+        if should_move_loop:
+            return root / LOOPS_SUBPATH, [f"bpm hint: {bpm}", duration_note]
+    return target, reasons
+
+
+def _set_sample_path(sample: dict, path: Path):
+    # the id does not depend on the path, so moves keep it
+    full_path = path.resolve()
+    sample["full_path"] = str(full_path)
+    sample["rel_path"] = str(full_path)
+    sample["filename"] = path.name
+    sample["ext"] = path.suffix.lower()
+
+
+def make_sample(rec: FileRecord, root: Path, parsed: Optional[dict] = None, path: Optional[Path] = None, fingerprint: Optional[str] = None) -> dict:
+    """Build a samples row for a walked file. `path` overrides rec.path when
+    the file is (about to be) moved; the record's size/mtime/inode still apply.
+    The id comes from the record's device/inode and quick fingerprint (read
+    from rec.path unless given), so it survives the move."""
+    if parsed is None:
+        parsed = parse_filename(rec.path.name)
+    if fingerprint is None:
+        fingerprint = quick_fingerprint(rec.path, rec.size)
+    sample = {
+        "id": sample_id(rec.dev, rec.inode, fingerprint, rec.path.resolve()),
+        "root_dir": str(root),
+        "size_bytes": rec.size,
+        "bpm_hint": parsed.get("bpm"),
+        "key_hint": parsed.get("key"),
+        "instrument_hint": parsed.get("instrument"),
+        "fuzzy_score": parsed.get("fuzzy_score"),
+        "parsed_tokens": json.dumps(parsed.get("tokens")),
+        "mtime_ns": rec.mtime_ns,
+        "inode": rec.inode,
+        "dev": rec.dev,
+        "fingerprint": fingerprint,
+    }
+    _set_sample_path(sample, path if path is not None else rec.path)
+    return sample
+
+
+# outcomes of _analyze_record
+SMALL, UNCHANGED, NEW, CHANGED, SCANNED = 'small', 'unchanged', 'new', 'changed', 'scanned'
+
+class ScanItem(NamedTuple):
+    root: Path
+    rec: FileRecord
+    status: str
+    parsed: Optional[dict] = None
+    target: Optional[Path] = None
+    reasons: List[str] = []
+    fingerprint: Optional[str] = None
+
+
+def _analyze_record(rec: FileRecord, root: Path, min_size: int, manifest: Optional[Dict[str, tuple]] = None, fingerprint: bool = True,
+                    loop_probs: Optional[Dict[str, float]] = None, analyze_audio: bool = False) -> ScanItem:
+    """Parse, route and (optionally) fingerprint one walked file. Files that
+    are too small or unchanged since the stored row in `manifest` come back
+    with only their status set. `loop_probs` holds stored loop probabilities
+    by path (see explain_route)."""
+    if rec.size < min_size:
+        return ScanItem(root, rec, SMALL)
+    status = SCANNED
+    if manifest is not None:
+        prev = manifest.get(str(rec.path))
+        if prev is None:
+            status = NEW
+        elif prev == (rec.size, rec.mtime_ns, rec.inode):
+            # hard-linked files need their id to tell the links apart
+            fp = quick_fingerprint(rec.path, rec.size) if fingerprint and rec.nlink > 1 else None
+            return ScanItem(root, rec, UNCHANGED, fingerprint=fp)
+        else:
+            status = CHANGED
+    parsed = parse_filename(rec.path.name)
+    try:
+        prob = loop_probs.get(str(rec.path)) if loop_probs else None
+        target, reasons = explain_route(rec.path, parsed, root, prob, analyze_audio)
+    except Exception:
+        target, reasons = None, []
+    fp = quick_fingerprint(rec.path, rec.size) if fingerprint else None
+    return ScanItem(root, rec, status, parsed, target, reasons, fp)
+
+
+def plan_shards(roots: List[Path]) -> List[Tuple[Path, Path, bool]]:
+    """Split roots into independently walkable (root, dir, recursive) shards:
+    the files directly inside each root plus one shard per top-level subdir."""
+    shards = []
     for root in roots:
-        root = Path(root)
-        if not root.exists():
+        shards.append((root, root, False))
+        try:
+            with os.scandir(root) as it:
+                subdirs = sorted(e.path for e in it if e.is_dir(follow_symlinks=False))
+        except OSError:
             continue
-        for p in root.rglob("*"):
-            if p.is_dir():
+        shards.extend((root, Path(d), True) for d in subdirs)
+    return shards
+
+
+def _split_manifest(manifest: Dict[str, Any], shards: List[Tuple[Path, Path, bool]]) -> List[Dict[str, Any]]:
+    """Bucket manifest (or any path-keyed) entries by shard in one pass."""
+    index = {(str(d), recursive): i for i, (_, d, recursive) in enumerate(shards)}
+    roots = sorted({str(r) for r, _, _ in shards}, key=len, reverse=True)
+    out: List[Dict[str, Any]] = [{} for _ in shards]
+    for path, stat in manifest.items():
+        for r in roots:
+            if not path.startswith(r + os.sep):
+                continue
+            head, sep, _ = path[len(r) + 1:].partition(os.sep)
+            i = index.get((os.path.join(r, head), True) if sep else (r, False))
+            if i is not None:
+                out[i][path] = stat
+            break
+    return out
+
+
+_shard_queue = None
+
+
+def _init_shard_worker(q):
+    global _shard_queue
+    _shard_queue = q
+
+
+def _scan_shard(idx: int, root: Path, shard_dir: Path, recursive: bool, exts: set, min_size: int, manifest: Optional[Dict[str, tuple]], fingerprint: bool,
+                loop_probs: Optional[Dict[str, float]] = None, analyze_audio: bool = False):
+    """Worker process body: walk, parse and route one shard, streaming chunks
+    of ScanItems to the parent's queue. (idx, None) marks the shard done."""
+    chunk: List[ScanItem] = []
+    try:
+        for rec in walk_files([shard_dir], exts=exts, max_workers=SHARD_WALK_WORKERS, recursive=recursive):
+            chunk.append(_analyze_record(rec, root, min_size, manifest, fingerprint, loop_probs, analyze_audio))
+            if len(chunk) >= SHARD_CHUNK_SIZE:
+                _shard_queue.put((idx, chunk))
+                chunk = []
+        if chunk:
+            _shard_queue.put((idx, chunk))
+    finally:
+        _shard_queue.put((idx, None))
+
+
+def _iter_serial(roots: List[Path], exts: Optional[Iterable[str]], min_size: int, manifest: Optional[Dict[str, tuple]], fingerprint: bool = True,
+                 loop_probs: Optional[Dict[str, float]] = None, analyze_audio: bool = False) -> Iterator[ScanItem]:
+    for root in roots:
+        for rec in iter_file_records([root], exts=exts):
+            yield _analyze_record(rec, root, min_size, manifest, fingerprint, loop_probs, analyze_audio)
+
+
+def _iter_sharded(roots: List[Path], exts: Optional[Iterable[str]], min_size: int, manifest: Optional[Dict[str, tuple]], workers: int, fingerprint: bool = True,
+                  loop_probs: Optional[Dict[str, float]] = None, analyze_audio: bool = False) -> Iterator[ScanItem]:
+    """Walk shards of `roots` on a pool of `workers` processes and yield their
+    records as chunks arrive. Closing the generator terminates the pool."""
+    shards = plan_shards(roots)
+    if not shards:
+        return
+    exts_set = set(e.lower() for e in (exts or DEFAULT_EXTS))
+    manifests = _split_manifest(manifest, shards) if manifest is not None else [None] * len(shards)
+    probs = _split_manifest(loop_probs, shards) if loop_probs else [None] * len(shards)
+    # spawn: the API runs scans on threads, and forking a threaded process is unsafe
+    ctx = multiprocessing.get_context('spawn')
+    q = ctx.Queue()
+    pool = ctx.Pool(processes=min(workers, len(shards)), initializer=_init_shard_worker, initargs=(q,))
+    try:
+        results = [pool.apply_async(_scan_shard, (i, root, d, recursive, exts_set, min_size, manifests[i], fingerprint,
+                                                   probs[i], analyze_audio))
+                   for i, (root, d, recursive) in enumerate(shards)]
+        remaining = len(shards)
+        while remaining:
+            try:
+                idx, chunk = q.get(timeout=1.0)
+            except queue.Empty:
+                # a worker that died without reaching its finally never reports
+                failed = [r for r in results if r.ready() and not r.successful()]
+                if failed:
+                    failed[0].get()
                 continue
-            if p.suffix.lower() not in exts_set:
+            if chunk is None:
+                remaining -= 1
                 continue
-            yield p
+            yield from chunk
+    finally:
+        pool.terminate()
+        pool.join()
+        q.close()
 
 
-def scan_roots(roots: List[str], db_path: Optional[str] = None, batch_size: int = 500, min_size: int = 512, exts: Optional[Iterable[str]] = None, job_id: Optional[str] = None, dry_run: bool = False, undo_csv: Optional[str] = None) -> Dict[str, int]:
+def iter_dry_run(roots: List[str], min_size: int = 512, exts: Optional[Iterable[str]] = None, workers: int = 1,
+                 analyze_audio: bool = False) -> Iterator[dict]:
+    """Stream the moves a scan of `roots` would make without touching the
+    filesystem or the DB.
+
+    Yields {"src", "dst", "reasons"} per planned move as it is decided, then
+    one final {"summary": {...}} record. Only destination-name reservations
+    are kept (for collision suffixes), so memory does not grow with the
+    number of moves. Without the DB there are no stored loop probabilities:
+    routing goes by names and headers, plus a bounded decode per file with
+    analyze_audio=True.
+    """
+    roots_paths = [Path(r).resolve() for r in roots]
+    planner = MovePlanner(keep_moves=False)
+    scanned = skipped = planned = 0
+    if workers > 1:
+        items = _iter_sharded(roots_paths, exts, min_size, None, workers, fingerprint=False, analyze_audio=analyze_audio)
+    else:
+        items = _iter_serial(roots_paths, exts, min_size, None, fingerprint=False, analyze_audio=analyze_audio)
+    try:
+        for root, rec, status, parsed, target, reasons, _ in items:
+            scanned += 1
+            if status == SMALL:
+                skipped += 1
+                continue
+            if target is None:
+                continue
+            dst = planner.plan(rec.path, target)
+            if dst is None:
+                continue
+            planned += 1
+            yield {"src": str(rec.path), "dst": str(dst), "reasons": reasons}
+    finally:
+        items.close()
+    yield {"summary": {"scanned": scanned, "skipped": skipped, "planned_moves": planned}}
+
+
+def scan_roots(roots: List[str], db_path: Optional[str] = None, batch_size: int = 500, min_size: int = 512, exts: Optional[Iterable[str]] = None, job_id: Optional[str] = None, dry_run: bool = False, undo_csv: Optional[str] = None, incremental: bool = False, move_workers: int = DEFAULT_MOVE_WORKERS, workers: int = 1, prune: bool = True, tombstones: bool = True, analyze_audio: bool = False) -> Dict[str, int]:
     """Scan provided root paths, parse filenames, and upsert into DB.
     Returns summary dict.
+
+    Classification moves are planned during the walk and executed per batch on
+    a thread pool (`move_workers`) while scanning continues; a batch is written
+    to the DB once its moves have finished, with any failed move recorded at
+    its original path.
+
+    With incremental=True, files whose (size, mtime_ns, inode) match the row
+    already stored for that path are skipped without parsing; the summary
+    then also reports new/changed/unchanged counts.
+
+    Every path seen (files under `min_size` included) is recorded in a temp
+    table, and once a scan completes (not canceled) rows below each scanned
+    root with one of the scanned extensions that were not seen are pruned
+    with one anti-join DELETE per root and counted under `pruned`.
+    With tombstones=True the DSP results of pruned rows are kept aside and
+    restored if a file with the same fingerprint and size is indexed again.
+
+    Sample ids follow the file (device, inode and a quick fingerprint), so a
+    file that was moved or renamed since it was indexed -- by this scan's
+    classification moves or anything else -- keeps its row, DSP results and
+    autotags; its path is updated in place and counted under `renamed`.
+    Hard links to one file share that id: only the first link seen is
+    indexed and the others are counted under `linked`.
+
+    With workers > 1, each root's top-level files and each of its top-level
+    subdirectories are walked, parsed and routed in a pool of worker
+    processes; records stream back to this process, which plans and runs the
+    moves and is the only DB writer. Every sample is attributed to, and
+    routed within, the root it was found under.
+
+    Files are routed by name and header; unlabeled ones and BPM-tagged ones
+    also by the loop probability the DSP pass stored for them, if any. The
+    scan itself decodes no audio unless analyze_audio=True, which estimates
+    it for files that have none (a bounded decode per file).
+
+    dry_run=True only reports planned moves (see iter_dry_run); nothing is
+    moved and the DB is not opened.
     """
+    if dry_run:
+        examples = []
+        for entry in iter_dry_run(roots, min_size=min_size, exts=exts, workers=workers, analyze_audio=analyze_audio):
+            if "summary" in entry:
+                summary = entry["summary"]
+            elif len(examples) < 50:
+                examples.append((entry["src"], entry["dst"]))
+        summary["inserted"] = 0
+        summary["planned_move_examples"] = examples
+        return summary
     roots_paths = [Path(r).resolve() for r in roots]
     conn = get_conn(db_path) if db_path else get_conn()
     init_db(conn)
@@ -75,221 +420,153 @@ def scan_roots(roots: List[str], db_path: Optional[str] = None, batch_size: int
     skipped = 0
     scanned = 0
 
+    # full_path -> (size, mtime_ns, inode) of indexed rows
+    manifest: Dict[str, tuple] = dbmod.get_sample_manifest(conn, [str(r) for r in roots_paths]) if incremental else {}
+    loop_probs = dbmod.get_loop_probabilities(conn, [str(r) for r in roots_paths])
+    counts = {'new': 0, 'changed': 0, 'unchanged': 0}
+    renamed = 0
+    restored = 0
+    # indexed paths seen but not upserted (unchanged files), written to the
+    # seen_paths temp table with the next batch
+    seen: List[str] = []
+    # sample id -> link to index (None once an indexed link was seen), for
+    # files with more than one hard link
+    linked: Dict[str, Optional[ScanItem]] = {}
+    linked_skipped = 0
+    dbmod.reset_seen_paths(conn)
+
     batch: List[dict] = []
-    # collect planned or executed moves for optional undo logging
+    # (sample, planned move) pairs for the current batch
+    batch_moves: List[tuple] = []
+    # previous batch waiting on its moves: (samples, [(sample, move, future)])
+    pending: Optional[tuple] = None
+    planner = MovePlanner()
+    executor = MoveExecutor(max_workers=move_workers)
+    # executed moves for optional undo logging
     moves: List[tuple] = []
 
-    def move_if_needed(curr: Path, target_dir: Path) -> Path:
-        """Move file to target_dir safely. If dry_run, record planned move and
-        return original Path. Otherwise perform move, record it if undo_csv is
-        requested, and return new Path for continued processing."""
-        try:
-            resolved = curr.resolve()
-        except Exception:
-            resolved = curr
-        try:
-            if target_dir.resolve() in resolved.parents:
-                return curr
-        except Exception:
-            # fallback proceed
-            pass
-        os.makedirs(target_dir, exist_ok=True)
-        dest = target_dir / curr.name
-        if dest.exists():
-            base = dest.stem
-            suf = dest.suffix
-            i = 1
-            while True:
-                candidate = target_dir / f"{base}_{i}{suf}"
-                if not candidate.exists():
-                    dest = candidate
-                    break
-                i += 1
-        if dry_run:
-            moves.append((str(curr), str(dest)))
-            return curr
-        try:
-            shutil.move(str(curr), str(dest))
-            moves.append((str(curr), str(dest)))
-            return Path(dest)
-        except Exception:
-            return curr
-    # check cancel flag every file by default for responsiveness
-    cancel_check_interval = 1
-    file_check_counter = 0
-    canceled = False
-    for p in iter_files(roots_paths, exts=exts):
-        scanned += 1
-        # if a job id was provided, check for cancellation requests frequently
-        if job_id:
-            # fast path: check in-process registry first for immediate visibility
-            try:
-                if getattr(dbmod, '_inproc_cancel_registry', {}).get(job_id) == 1:
-                    canceled = True
-                    break
-            except Exception:
-                pass
+    def settle(entry) -> int:
+        """Wait for a batch's moves, fix up failed ones, then upsert it."""
+        nonlocal renamed, restored, seen
+        samples, started = entry
+        for sample, move, fut in started:
             try:
-                if file_check_counter % cancel_check_interval == 0:
-                    cur = conn.cursor()
-                    cur.execute("SELECT cancel_requested FROM scan_jobs WHERE id=?", (job_id,))
-                    r = cur.fetchone()
-                    if r and r[0] == 1:
-                        # cancellation requested
-                        canceled = True
-                        break
+                fut.result()
+                moves.append((str(move.src), str(move.dst)))
             except Exception:
-                # ignore DB errors here and continue
-                pass
-            finally:
-                file_check_counter += 1
-        try:
-            stat = p.stat()
-            if stat.st_size < min_size:
-                skipped += 1
-                continue
-        except OSError:
-            skipped += 1
-            continue
+                # move failed: index the file where it still is
+                _set_sample_path(sample, move.src)
+        with conn:
+            renamed += dbmod.reconcile_samples(conn, samples)
+            upsert_samples_bulk(conn, samples)
+            restored += dbmod.restore_from_tombstones(conn, samples)
+            dbmod.add_seen_paths(conn, [s["full_path"] for s in samples])
+            dbmod.add_seen_paths(conn, seen)
+            seen = []
+        return len(samples)
 
-        # parse filename first to detect bpm hints
-        parsed = parse_filename(p.name)
+    def flush():
+        nonlocal batch, batch_moves, pending, inserted
+        started = []
+        if batch_moves:
+            futs = executor.submit([m for _, m in batch_moves])
+            started = [(sample, m, f) for (sample, m), f in zip(batch_moves, futs)]
+        if pending is not None:
+            inserted += settle(pending)
+        pending = (batch, started)
+        batch = []
+        batch_moves = []
 
-        # Prefer vocal classification first so vocal samples aren't swallowed by
-        # loop/BPM detection. If a vocal keyword is detected, move the file
-        # into the Vocals folder under the scanned root. Otherwise fall back
-        # to the existing loop/BPM move logic.
-        try:
-            vocals_root = roots_paths[0] / VOCALS_SUBPATH if roots_paths else None
-            name_l = p.name.lower()
-            instrument = parsed.get("instrument") or ""
-            tokens = parsed.get("tokens") or []
-            # basic vocal keyword checks (filename, parsed instrument, or tokens)
-            is_vocal_word = any(k in name_l for k in ("vocal", "vox", "voice", "singer", "vocalhit", "vocal_hit", "vocoder", "vocal_loop"))
-            instrument_is_vocal = isinstance(instrument, str) and any(k in instrument.lower() for k in ("vocal", "vox", "voice"))
-            tokens_is_vocal = any(isinstance(t, str) and any(k in t.lower() for k in ("vocal", "vox", "voice")) for t in tokens)
-            is_vocal = is_vocal_word or instrument_is_vocal or tokens_is_vocal
-            if vocals_root and is_vocal:
-                try:
-                    p = move_if_needed(p, vocals_root)
-                    stat = p.stat()
-                except Exception:
-                    # noop on move failure — continue scanning original path
-                    pass
-            else:
-                # drums-specific sorting: detect drum one-shots, fills, cymbals, toms, hats, snares
-                try:
-                    drums_root = roots_paths[0] / DRUMS_SUBPATH if roots_paths else None
-                    is_drum_word = any(k in name_l for k in ("drum", "snare", "kick", "hat", "hihat", "hh", "tom", "fill", "fills", "cymbal", "crash", "ride", "shaker", "perc", "percussion", "one_shot", "one-shot"))
-                    instrument_is_drum = isinstance(instrument, str) and any(k in instrument.lower() for k in ("drum", "snare", "kick", "hat", "tom", "perc", "percussion"))
-                    tokens_is_drum = any(isinstance(t, str) and any(k in t.lower() for k in ("drum", "snare", "kick", "hat", "hihat", "tom", "fill", "cymbal", "crash", "ride", "shaker", "perc")) for t in tokens)
-                    is_drum = is_drum_word or instrument_is_drum or tokens_is_drum
-                    if drums_root and is_drum:
-                        # choose a sensible subfolder name
-                        subname = None
-                        if any(k in name_l for k in ("kick", "bd", "bassdrum")) or (isinstance(instrument, str) and "kick" in instrument.lower()):
-                            subname = "Kicks"
-                        elif any(k in name_l for k in ("snare", "sn")) or (isinstance(instrument, str) and "snare" in instrument.lower()):
-                            subname = "Snares"
-                        elif any(k in name_l for k in ("hat", "hihat", "hh")):
-                            subname = "Hats"
-                        elif any(k in name_l for k in ("tom",)):
-                            subname = "Toms"
-                        elif any(k in name_l for k in ("fill", "fills", "drumfill")):
-                            subname = "Fills"
-                        elif any(k in name_l for k in ("cymbal", "crash", "ride", "splash", "china")):
-                            subname = "Cymbals"
-                        elif any(k in name_l for k in ("shaker", "perc", "percussion", "conga", "bongo")):
-                            subname = "Percussion"
-                        else:
-                            subname = "One Shots"
-
-                        try:
-                            dest_root = drums_root / subname
-                            p = move_if_needed(p, dest_root)
-                            stat = p.stat()
-                        except Exception:
-                            pass
-                except Exception:
-                    pass
-                # fallback to loop/BPM-based moves
-                loops_root = roots_paths[0] / LOOPS_SUBPATH if roots_paths else None
-                is_loop_word = "loop" in name_l
-                has_bpm = parsed.get("bpm") is not None
-                if loops_root and (is_loop_word or has_bpm):
-                    # New OR rule:
-                    # - If the filename explicitly contains 'loop' (is_loop_word),
-                    #   move to Loops (unless it's a vocal).
-                    # - Otherwise if there is a BPM hint (has_bpm), only move to
-                    #   Loops when audio duration >= LOOP_MIN_SECONDS.
-                    try:
-                        if is_vocal:
-                            # vocals always take precedence
-                            pass
-                        else:
-                            if is_loop_word:
-                                # name indicates loop: move regardless of duration
-                                p = move_if_needed(p, loops_root)
-                                stat = p.stat()
-                            elif has_bpm:
-                                # bpm hint only: require duration threshold
-                                should_move_loop = True
-                                if extract_audio_metadata is not None:
-                                    try:
-                                        meta = extract_audio_metadata(str(p))
-                                        dur = None
-                                        if isinstance(meta, dict):
-                                            dur = meta.get('duration')
-                                        if dur is not None:
-                                            try:
-                                                should_move_loop = float(dur) >= float(LOOP_MIN_SECONDS)
-                                            except Exception:
-                                                should_move_loop = True
-                                        else:
-                                            # duration not available -> fallback to move
-                                            should_move_loop = True
-                                    except Exception:
-                                        # audio read failed -> fallback to move
-                                        should_move_loop = True
-                                if should_move_loop:
-                                    p = move_if_needed(p, loops_root)
-                                    stat = p.stat()
-                    except Exception:
-                        pass
-        except Exception:
-            pass
+    # cancellation is an in-process event; progress and cross-process cancel
+    # polling are rate-limited DB round trips
+    job = JobControl(conn, job_id, kind='scan')
+    canceled = False
+    if workers > 1:
+        items = _iter_sharded(roots_paths, exts, min_size, manifest if incremental else None, workers,
+                              loop_probs=loop_probs, analyze_audio=analyze_audio)
+    else:
+        items = _iter_serial(roots_paths, exts, min_size, manifest if incremental else None,
+                             loop_probs=loop_probs, analyze_audio=analyze_audio)
+    def index(item: ScanItem):
+        root, rec, status, parsed, target, _, fingerprint = item
+        p = rec.path
+        if incremental:
+            if status == UNCHANGED:
+                counts['unchanged'] += 1
+                seen.append(str(p))
+                return
+            counts[status] += 1
+
+        move = None
+        if target is not None and planner.plan(p, target) is not None:
+            move = planner.moves[-1]
+            # index the planned location; reverted if the move fails
+            p = move.dst
 
-        sample_id = make_id(p.resolve(), stat.st_size)
-        rel = str(p.resolve())
-        sample = {
-            "id": sample_id,
-            "full_path": str(p.resolve()),
-            "rel_path": rel,
-            "root_dir": str(roots_paths[0]) if roots_paths else "",
-            "filename": p.name,
-            "ext": p.suffix.lower(),
-            "size_bytes": stat.st_size,
-            "bpm_hint": parsed.get("bpm"),
-            "key_hint": parsed.get("key"),
-            "instrument_hint": parsed.get("instrument"),
-            "fuzzy_score": parsed.get("fuzzy_score"),
-            "parsed_tokens": json.dumps(parsed.get("tokens")),
-        }
+        # moves keep the file size, so the walker's record is still accurate
+        sample = make_sample(rec, root, parsed, path=p, fingerprint=fingerprint)
         batch.append(sample)
+        if move is not None:
+            batch_moves.append((sample, move))
         if len(batch) >= batch_size:
-            with conn:
-                for s in batch:
-                    upsert_sample(conn, s)
-            inserted += len(batch)
-            batch = []
-    # final batch
-    if batch:
+            flush()
+
+    try:
+        for item in items:
+            if job.cancelled():
+                canceled = True
+                break
+            rec = item.rec
+            scanned += 1
+            job.progress(scanned)
+            if item.status == SMALL:
+                skipped += 1
+                # still on disk: not to be pruned
+                seen.append(str(rec.path))
+                continue
+            if rec.nlink > 1 and item.fingerprint is not None:
+                # hard links are one file with one id, so only one link is
+                # indexed: an already indexed (unchanged) link if there is
+                # one, else the first path in sort order once the walk is done
+                sid = sample_id(rec.dev, rec.inode, item.fingerprint, rec.path.resolve())
+                prev = linked.get(sid)
+                if sid in linked:
+                    linked_skipped += 1
+                if item.status == UNCHANGED:
+                    linked[sid] = None
+                    index(item)
+                elif sid not in linked or (prev is not None and rec.path < prev.rec.path):
+                    linked[sid] = item
+                continue
+            index(item)
+        if not canceled:
+            for item in linked.values():
+                if item is not None:
+                    index(item)
+        # final batch
+        if batch or seen:
+            flush()
+        if pending is not None:
+            inserted += settle(pending)
+            pending = None
+    finally:
+        items.close()
+        executor.close()
+        job.progress(scanned, total=scanned)
+        job.close()
+    pruned = 0
+    # rows of file types this scan didn't look at are not candidates
+    scanned_exts = set(e.lower() for e in (exts or DEFAULT_EXTS))
+    if prune and not canceled:
+        # renamed rows already carry their new path, so only files that are
+        # really gone match; a root that is missing (e.g. unmounted drive) is
+        # left alone rather than emptied
         with conn:
-            for s in batch:
-                upsert_sample(conn, s)
-        inserted += len(batch)
-    # if undo_csv requested and moves were executed (not dry-run), write undo log
-    if undo_csv and moves and not dry_run:
+            for r in roots_paths:
+                if r.is_dir():
+                    pruned += dbmod.prune_unseen_samples(conn, str(r), tombstone=tombstones, exts=scanned_exts)
+    # if undo_csv requested and moves were executed, write undo log
+    if undo_csv and moves:
         try:
             with open(undo_csv, 'w', newline='') as fh:
                 w = csv.writer(fh)
@@ -301,11 +578,9 @@ def scan_roots(roots: List[str], db_path: Optional[str] = None, batch_size: int
     # if canceled, include that in the summary
     if canceled:
         return {"scanned": scanned, "inserted": inserted, "skipped": skipped, "canceled": True}
-    # include planned move count when dry_run
-    summary = {"scanned": scanned, "inserted": inserted, "skipped": skipped}
-    if dry_run:
-        summary['planned_moves'] = len(moves)
-        summary['planned_move_examples'] = moves[:50]
+    summary = {"scanned": scanned, "inserted": inserted, "skipped": skipped, "renamed": renamed, "pruned": pruned, "restored": restored, "linked": linked_skipped}
+    if incremental:
+        summary.update(counts)
     try:
         conn.close()
     except Exception:
@@ -318,7 +593,16 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("roots", nargs='+')
     parser.add_argument("--db", default=None)
-    parser.add_argument("--dry-run", action="store_true", help="Do not perform moves; just print planned moves")
+    parser.add_argument("--dry-run", action="store_true", help="Do not perform moves; print planned moves as JSON lines")
     parser.add_argument("--undo-csv", default=None, help="Path to write undo CSV of performed moves when not a dry-run")
+    parser.add_argument("--incremental", action="store_true", help="Skip files unchanged since the last scan")
+    parser.add_argument("--no-prune", action="store_true", help="Keep rows for files that are no longer on disk")
+    parser.add_argument("--workers", type=int, default=1, help="Worker processes for sharded scanning (1 = scan in this process)")
+    parser.add_argument("--analyze-audio", action="store_true", help="Decode part of files without a stored loop probability to route loops")
     args = parser.parse_args()
-    print(scan_roots(args.roots, db_path=args.db, dry_run=args.dry_run, undo_csv=args.undo_csv))
+    if args.dry_run:
+        for entry in iter_dry_run(args.roots, workers=args.workers, analyze_audio=args.analyze_audio):
+            print(json.dumps(entry))
+        raise SystemExit(0)
+    print(scan_roots(args.roots, db_path=args.db, undo_csv=args.undo_csv, incremental=args.incremental, workers=args.workers,
+                     prune=not args.no_prune, analyze_audio=args.analyze_audio))
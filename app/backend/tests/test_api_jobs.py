@@ -86,3 +86,24 @@ def test_scan_api_persistence_and_cancel(tmp_path):
     assert list_resp.status_code == 200
     rows = list_resp.json().get('rows', [])
     assert any(r.get('id') == job_id for r in rows)
+
+
+def test_scan_dryrun_streams_ndjson(tmp_path):
+    root = tmp_path / 'pack'
+    make_file(root / 'a' / 'Kick_01.wav')
+    make_file(root / 'b' / 'Kick_01.wav')
+    make_file(root / 'Pad_C.wav')
+    db_file = tmp_path / 'dry.db'
+
+    client = TestClient(app)
+    resp = client.post('/scan/dryrun', json={'roots': [str(root)], 'db_path': str(db_file)})
+    assert resp.status_code == 200
+    assert resp.headers['content-type'].startswith('application/x-ndjson')
+    lines = [json.loads(l) for l in resp.text.splitlines()]
+    moves, summary = lines[:-1], lines[-1]['summary']
+    assert summary == {'scanned': 3, 'skipped': 0, 'planned_moves': 2}
+    assert sorted(Path(m['dst']).name for m in moves) == ['Kick_01.wav', 'Kick_01_1.wav']
+    assert all(m['reasons'] == ['rule: drum (filename)', 'rule: Kicks (filename)'] for m in moves)
+    # nothing moved, no DB created
+    assert (root / 'a' / 'Kick_01.wav').exists()
+    assert not db_file.exists()
@@ -0,0 +1,54 @@
+import struct
+
+import numpy as np
+import pytest
+import soundfile as sf
+
+from app.backend.audio_probe import probe_duration, read_header
+
+
+@pytest.mark.parametrize('name,subtype', [
+    ('a.wav', 'PCM_16'), ('b.wav', 'FLOAT'), ('c.aiff', 'PCM_24'), ('d.flac', 'PCM_16'), ('e.ogg', 'VORBIS'),
+])
+def test_probe_matches_soundfile(tmp_path, name, subtype):
+    p = tmp_path / name
+    sf.write(str(p), np.zeros((33075, 2), dtype='float32'), 22050, subtype=subtype)
+    assert probe_duration(p) == pytest.approx(sf.info(str(p)).duration, abs=1e-3)
+
+
+def test_wav_data_chunk_after_large_chunk(tmp_path):
+    sr, frames = 8000, 12000
+    fmt = struct.pack('<HHIIHH', 1, 1, sr, sr * 2, 2, 16)
+    junk = b'\0' * 40001  # odd size exercises the pad byte
+    data = b'\0' * (frames * 2)
+    body = (b'WAVE' + b'fmt ' + struct.pack('<I', len(fmt)) + fmt
+            + b'JUNK' + struct.pack('<I', len(junk)) + junk + b'\0'
+            + b'data' + struct.pack('<I', len(data)) + data)
+    p = tmp_path / 'junk.wav'
+    p.write_bytes(b'RIFF' + struct.pack('<I', len(body)) + body)
+    assert probe_duration(p) == pytest.approx(1.5)
+    assert probe_duration(tmp_path / 'missing.wav') is None
+
+
+def _chunk(cid, body):
+    return cid + struct.pack('<I', len(body)) + body + b'\0' * (len(body) & 1)
+
+
+def write_tagged_wav(path, sr=44100, frames=20000, bpm=128.0, root=57, loop=(100, 19000), one_shot=False):
+    """16-bit mono WAV with trailing smpl and acid chunks, as ACID/samplers write them."""
+    smpl = struct.pack('<9I', 0, 0, 0, 60, 0, 0, 0, 1, 0) + struct.pack('<6I', 0, 0, loop[0], loop[1], 0, 0)
+    flags = 0x02 | (0x01 if one_shot else 0)
+    acid = struct.pack('<IHHfIHHf', flags, root, 0x8000, 0.0, 8, 4, 4, bpm)
+    body = (b'WAVE' + _chunk(b'fmt ', struct.pack('<HHIIHH', 1, 1, sr, sr * 2, 2, 16))
+            + _chunk(b'data', b'\0' * (frames * 2)) + _chunk(b'smpl', smpl) + _chunk(b'acid', acid))
+    path.write_bytes(b'RIFF' + struct.pack('<I', len(body)) + body)
+    return path
+
+
+def test_wav_acid_and_smpl_chunks(tmp_path):
+    h = read_header(write_tagged_wav(tmp_path / 'loop.wav'))
+    assert (h.format, h.sample_rate, h.channels, h.bit_depth, h.frames) == ('wav', 44100, 1, 16, 20000)
+    assert h.acid_bpm == 128.0 and h.acid_beats == 8 and not h.acid_one_shot
+    # the ACID root note wins over the smpl unity note (60)
+    assert h.root_note == 57 and h.root_key == 'A'
+    assert h.loops == ((100, 19000),)
@@ -0,0 +1,49 @@
+import random
+
+from app.backend.classifier import KeywordClassifier, SCANNER_RULES, compile_keyword_map
+from app.backend.tools.refine_sorting import KEYWORD_MAP, find_match
+from app.backend.tools.apply_core_keywords import TAXONOMY, build_keyword_map_from_rules, flatten_taxonomy
+
+
+def naive_categories(rules, text):
+    s = text.lower()
+    out = []
+    for label, kws in rules:
+        if any(k in s for k in kws) and label not in out:
+            out.append(label)
+    return out
+
+
+def naive_first(keyword_map, text):
+    s = text.lower()
+    for kws, rel in keyword_map:
+        if any(kw in s for kw in kws):
+            return rel
+    return None
+
+
+def random_names(n=500, seed=7):
+    rng = random.Random(seed)
+    parts = ['kick', 'hihat', 'vocal_loop', 'snare', 'sn', 'bd', 'open hat', 'closed', 'riser', 'fx', 'perc',
+             'loop', 'Pad', 'oh', 'ch', '808', 'x', 'a', '_', '-', ' ', '128bpm', 'Am', 'tomfill', 'china']
+    return [''.join(rng.choice(parts) for _ in range(rng.randint(1, 6))) + '.wav' for _ in range(n)]
+
+
+def test_overlapping_keywords_all_reported():
+    clf = KeywordClassifier([('hats', ['hat', 'hihat']), ('vocal', ['vocal_loop']), ('loop', ['loop']), ('snare', ['sn'])])
+    assert clf.categories('Vocal_Loop_HiHat_snare.wav') == ['hats', 'vocal', 'loop', 'snare']
+    assert clf.first('nothing.wav') is None
+
+
+def test_matches_naive_substring_rules():
+    clf = KeywordClassifier(SCANNER_RULES)
+    for name in random_names():
+        assert clf.categories(name) == naive_categories(SCANNER_RULES, name), name
+
+
+def test_keyword_map_first_match_order():
+    merged = build_keyword_map_from_rules(flatten_taxonomy(TAXONOMY)) + list(KEYWORD_MAP)
+    clf = compile_keyword_map(merged)
+    for name in random_names(seed=11):
+        assert clf.first(name) == naive_first(merged, name), name
+        assert find_match(name) == naive_first(KEYWORD_MAP, name), name
@@ -12,3 +12,57 @@ def test_init_db_creates_tables(tmp_path):
     row = cur.fetchone()
     assert row is not None
     conn.close()
+
+
+def test_upsert_samples_bulk_inserts_and_updates(tmp_path):
+    conn = db.get_conn(tmp_path / "bulk.db")
+    db.init_db(conn)
+    rows = [{'id': f'id{i}', 'full_path': f'/r/s{i}.wav', 'filename': f's{i}.wav', 'size_bytes': i} for i in range(50)]
+    with conn:
+        assert db.upsert_samples_bulk(conn, rows) == 50
+    rows[0]['size_bytes'] = 999
+    with conn:
+        db.upsert_samples_bulk(conn, rows[:1])
+    # the caller owns the transaction: a rollback undoes the upsert
+    db.upsert_samples_bulk(conn, [{'id': 'gone', 'full_path': '/r/gone.wav', 'filename': 'gone.wav'}])
+    conn.rollback()
+    cur = conn.cursor()
+    cur.execute("SELECT COUNT(*), MAX(size_bytes) FROM samples")
+    assert tuple(cur.fetchone()) == (50, 999)
+    conn.close()
+
+
+def test_data_migrations_run_once_and_init_db_runs_alongside_a_writer(tmp_path):
+    fn = tmp_path / "migrate.db"
+    conn = db.get_conn(fn)
+    db.init_db(conn)
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == len(db.DATA_MIGRATIONS)
+    # a database from before the hash re-tag gets it on its next init_db...
+    conn.execute("PRAGMA user_version = 0")
+    with conn:
+        conn.execute("INSERT INTO samples (id, full_path, filename, content_hash) VALUES ('a', '/r/a.wav', 'a.wav', 'abc')")
+    db.init_db(conn)
+    assert conn.execute("SELECT content_hash FROM samples").fetchone()[0] == 'sha256:abc'
+    # ...and a database that is up to date initialises while another
+    # connection holds the write lock
+    conn.execute("INSERT INTO samples (id, full_path, filename) VALUES ('b', '/r/b.wav', 'b.wav')")
+    other = sqlite3.connect(str(fn), timeout=0.1)
+    db.init_db(other)
+    other.close()
+    conn.rollback()
+    conn.close()
+
+
+def test_adopted_legacy_rows_keep_their_landmark_postings(tmp_path):
+    import numpy as np
+    from app.backend.landmarks import encode
+
+    conn = db.get_conn(tmp_path / "adopt.db")
+    db.init_db(conn)
+    blob = encode(np.array([7, 9], dtype=np.uint32), np.array([0, 3], dtype=np.uint16))
+    with conn:
+        conn.execute("INSERT INTO samples (id, full_path, filename, size_bytes, landmarks) VALUES ('legacy', '/r/a.wav', 'a.wav', 10, ?)", (blob,))
+        db.index_landmarks(conn, "id=?", [('legacy',)])
+        db.reconcile_samples(conn, [{'id': 'stable', 'full_path': '/r/a.wav', 'size_bytes': 10}])
+    assert [tuple(r) for r in conn.execute("SELECT hash, sample_id FROM landmark_index ORDER BY hash")] == [(7, 'stable'), (9, 'stable')]
+    conn.close()
@@ -0,0 +1,152 @@
+import hashlib
+
+import numpy as np
+import soundfile as sf
+
+from app.backend import dsp
+
+
+def test_single_decode_shared_by_extractors(tmp_path, monkeypatch):
+    sr = 22050
+    y = (0.2 * np.sin(2 * np.pi * 220 * np.arange(sr) / sr)).astype('float32')
+    p = tmp_path / 'tone.wav'
+    sf.write(str(p), np.stack([y, y], axis=1), sr)
+
+    decodes = []
+    real_read = dsp.sf.SoundFile.read
+    monkeypatch.setattr(dsp.sf.SoundFile, 'read', lambda *a, **k: decodes.append(1) or real_read(*a, **k))
+    seen = []
+    monkeypatch.setitem(dsp.EXTRACTORS, 'peak', lambda buf: seen.append(buf) or {'peak': float(np.abs(buf.y).max())})
+
+    meta = dsp.extract_audio_metadata(str(p), extractors=['peak'])
+    assert len(decodes) == 1
+    assert seen[0].y.dtype == np.float32 and seen[0].channels == 2
+    assert meta['duration'] == 1.0 and meta['sample_rate'] == sr and meta['channels'] == 2
+    assert meta['content_hash'] == 'sha256:' + hashlib.sha256(p.read_bytes()).hexdigest()
+    assert abs(meta['peak'] - 0.2) < 1e-3
+    assert meta['bpm'] is None and meta['key_detected'] is None
+
+
+def test_acid_tempo_replaces_tempo_estimate(tmp_path, monkeypatch):
+    from app.backend.tests.test_audio_probe import write_tagged_wav
+    p = write_tagged_wav(tmp_path / 'loop.wav', bpm=96.0)
+    decodes = []
+    monkeypatch.setattr(dsp.sf.SoundFile, 'read', lambda *a, **k: decodes.append(1))
+    monkeypatch.setitem(dsp.EXTRACTORS, 'tempo', lambda buf: {'bpm': 1.0})
+
+    meta = dsp.extract_audio_metadata(str(p), extractors=['tempo'])
+    # tempo was the only extractor asked for, so nothing had to be decoded
+    assert decodes == []
+    assert meta['bpm'] == 96.0 and meta['bit_depth'] == 16 and meta['root_note'] == 57
+    assert (meta['loop_start'], meta['loop_end']) == (100, 19000)
+    assert meta['content_hash'] == 'sha256:' + hashlib.sha256(p.read_bytes()).hexdigest()
+
+    one_shot = write_tagged_wav(tmp_path / 'hit.wav', one_shot=True)
+    monkeypatch.undo()
+    monkeypatch.setitem(dsp.EXTRACTORS, 'tempo', lambda buf: {'bpm': 1.0})
+    assert dsp.extract_audio_metadata(str(one_shot), extractors=['tempo'])['bpm'] == 1.0
+
+
+def test_long_file_decodes_only_the_analysis_window(tmp_path, monkeypatch):
+    sr = 44100
+    # 10 s of quiet stereo with a loud last second
+    y = np.full((sr * 10, 2), 0.05, dtype='float32')
+    y[-sr:] = 0.8
+    p = tmp_path / 'stem.wav'
+    sf.write(str(p), y, sr)
+    # force the streaming path a long file takes
+    monkeypatch.setattr(dsp, 'INMEMORY_MAX_BYTES', 0)
+    read = []
+    real_read = dsp.sf.SoundFile.read
+    monkeypatch.setattr(dsp.sf.SoundFile, 'read', lambda self, frames=-1, *a, **k: read.append(frames) or real_read(self, frames, *a, **k))
+    seen = []
+    monkeypatch.setitem(dsp.EXTRACTORS, 'peak', lambda buf: seen.append(buf) or {})
+
+    policy = dsp.AnalysisPolicy(target_sr=22050, max_seconds=2.0, segments=2)
+    meta = dsp.extract_audio_metadata(str(p), extractors=['peak', 'waveform'], policy=policy)
+    buf = seen[0]
+    # two one-second excerpts, then block reads for the waveform overview
+    assert read[:2] == [sr, sr] and max(read[2:]) <= 1 << 16
+    assert len(buf.y) == 2 * 22050 and buf.head == 22050 and buf.windowed
+    # the last excerpt ends at the end of the file
+    assert buf.y[-1] > 0.7 and buf.y[0] < 0.1
+    assert meta['duration'] == 10.0 and meta['sample_rate'] == sr
+    assert meta['analysis_policy'] == policy.tag == 'mono@22050:2s/2'
+    assert meta['content_hash'] == 'sha256:' + hashlib.sha256(p.read_bytes()).hexdigest()
+    # the overview still spans the whole file
+    from app.backend import waveform
+    wf = waveform.decode(meta['waveform'])
+    assert wf.duration == 10.0 and wf.levels[0][-1, 1] == 127 and wf.levels[0][0, 1] < 20
+
+
+def test_parallel_runner_writes_all_results(tmp_path):
+    from app.backend import dsp_runner
+    from app.backend.scanner import scan_roots
+
+    root = tmp_path / 'pack'
+    root.mkdir()
+    sr = 22050
+    for i in range(5):
+        y = (0.1 * np.sin(2 * np.pi * (200 + 50 * i) * np.arange(sr // 2) / sr)).astype('float32')
+        sf.write(str(root / f'Pad_{i}.wav'), y, sr)
+    db_file = tmp_path / 'dsp.db'
+    scan_roots([str(root)], db_path=str(db_file))
+
+    n = dsp_runner.run_once(db_path=str(db_file), workers=2, chunk_size=2, write_batch=3)
+    assert n == 5
+    import sqlite3
+    conn = sqlite3.connect(str(db_file))
+    rows = conn.execute("SELECT duration, sample_rate, content_hash, analysis_policy FROM samples").fetchall()
+    waveforms = conn.execute("SELECT COUNT(*) FROM waveforms").fetchone()[0]
+    conn.close()
+    assert len(rows) == 5 and all(r[0] == 0.5 and r[1] == sr and r[2] for r in rows)
+    assert {r[3] for r in rows} == {dsp.DEFAULT_POLICY.tag}
+    assert waveforms == 5
+
+
+def test_analysis_cache_skips_decoding_copies(tmp_path, monkeypatch):
+    import shutil
+    import sqlite3
+    from app.backend import dsp_runner
+    from app.backend.scanner import scan_roots
+
+    root = tmp_path / 'pack'
+    root.mkdir()
+    sr = 22050
+    y = (0.3 * np.sin(2 * np.pi * 330 * np.arange(sr) / sr)).astype('float32')
+    sf.write(str(root / 'Pad_Original.wav'), y, sr)
+    db_file = str(tmp_path / 'cache.db')
+    scan_roots([str(root)], db_path=db_file)
+    assert dsp_runner.run_once(db_path=db_file) == 1
+
+    calls = []
+    real_decode = dsp._decode
+    monkeypatch.setattr(dsp, '_decode', lambda *a: calls.append('decode') or real_decode(*a))
+    real_key = dsp.EXTRACTORS['key']
+    monkeypatch.setitem(dsp.EXTRACTORS, 'key', lambda buf: calls.append('key') or real_key(buf))
+
+    # a copy under another name costs a hash, not an analysis
+    original = next(root.rglob('Pad_Original.wav'))
+    shutil.copy(original, original.with_name('Pad_Copy.wav'))
+    scan_roots([str(root)], db_path=db_file)
+    assert dsp_runner.run_once(db_path=db_file) == 1
+    assert calls == []
+
+    # bumping one extractor's version recomputes only that extractor
+    monkeypatch.setitem(dsp.EXTRACTOR_VERSIONS, 'key', dsp.EXTRACTOR_VERSIONS['key'] + 1)
+    # the rescan may have routed the analysed original by its loop probability
+    original = next(root.rglob('Pad_Original.wav'))
+    shutil.copy(original, original.with_name('Pad_Third.wav'))
+    scan_roots([str(root)], db_path=db_file)
+    assert dsp_runner.run_once(db_path=db_file) == 1
+    assert calls == ['decode', 'key']
+
+    conn = sqlite3.connect(db_file)
+    rows = conn.execute("SELECT bpm, key_detected, key_confidence, landmarks, content_hash FROM samples").fetchall()
+    waveforms = conn.execute("SELECT COUNT(*) FROM waveforms").fetchone()[0]
+    assert len(rows) == 3 and len(set(rows)) == 1 and rows[0][3] is not None
+    assert waveforms == 3
+    # the superseded key result is the only stale entry
+    from app.backend.db import prune_analysis_cache
+    assert prune_analysis_cache(conn, [dsp.analyzer_key(n) for n in ['format', *dsp.EXTRACTORS]]) == 1
+    conn.close()
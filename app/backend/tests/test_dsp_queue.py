@@ -0,0 +1,165 @@
+import os
+
+import numpy as np
+import soundfile as sf
+from fastapi.testclient import TestClient
+
+from app.backend import dsp_queue, dsp_runner
+from app.backend.db import delete_samples_by_path, get_conn, init_db, update_samples_metadata_bulk
+from app.backend.main import app
+from app.backend.scanner import scan_roots
+
+SR = 22050
+
+
+def add_samples(conn, names, added_at="datetime('now', '-7 days')"):
+    with conn:
+        conn.executemany(f"INSERT INTO samples (id, full_path, filename, added_at) VALUES (?, ?, ?, {added_at})",
+                         ((n, f'/library/{n}.wav', f'{n}.wav') for n in names))
+
+
+def test_claims_follow_priority_leases_and_backoff(tmp_path):
+    conn = get_conn(tmp_path / 'q.db')
+    init_db(conn)
+    add_samples(conn, ['old1', 'old2', 'old3'])
+    add_samples(conn, ['new1'], added_at="datetime('now')")
+    with conn:
+        conn.execute("INSERT INTO samples (id, full_path, filename) VALUES ('packed', '/packs/a/b.wav', 'b.wav')")
+        conn.execute("UPDATE samples SET added_at = datetime('now', '-7 days') WHERE id = 'packed'")
+    now = 1000.0
+    assert dsp_queue.enqueue_unprocessed(conn, now=now) == 5
+    assert dsp_queue.enqueue_unprocessed(conn, now=now + 1) == 0
+    dsp_queue.prioritize(conn, dsp_queue.PRIORITY_VIEWED, ['old3'], now=now)
+    dsp_queue.prioritize(conn, dsp_queue.PRIORITY_ROOT, root='/packs', now=now)
+    # rows only move up
+    dsp_queue.prioritize(conn, dsp_queue.PRIORITY_BACKLOG, ['old3'], now=now)
+
+    first = dsp_queue.claim(conn, 'a', 3, now=now)
+    assert [sid for sid, _ in first] == ['old3', 'packed', 'new1']
+    assert first[1][1] == '/packs/a/b.wav'
+    # leased rows are not handed out twice
+    assert [sid for sid, _ in dsp_queue.claim(conn, 'b', 5, now=now)] == ['old1', 'old2']
+    assert dsp_queue.claim(conn, 'c', 5, now=now) == []
+    assert dsp_queue.stats(conn, now=now) == {'ready': 0, 'leased': 5, 'retrying': 0, 'quarantined': 0}
+
+    # results take a row off the queue; a cancelled runner hands its rows back
+    update_samples_metadata_bulk(conn, [('old3', {'content_hash': 'sha256:x'})])
+    assert dsp_queue.release(conn, 'b') == 2
+    assert [sid for sid, _ in dsp_queue.claim(conn, 'c', 5, now=now)] == ['old1', 'old2']
+
+    # failures back off, doubling, until MAX_ATTEMPTS quarantines the file
+    t = now
+    for attempt in range(1, dsp_queue.MAX_ATTEMPTS + 1):
+        quarantined = dsp_queue.fail(conn, [('old1', 'boom')], now=t)
+        if attempt < dsp_queue.MAX_ATTEMPTS:
+            assert quarantined == 0
+            wait = dsp_queue.RETRY_BASE_SECONDS * 2 ** (attempt - 1)
+            assert dsp_queue.claim(conn, 'c', 5, now=t + wait - 1) == []
+            t += wait
+            assert [sid for sid, _ in dsp_queue.claim(conn, 'c', 1, now=t)] == ['old1']
+    assert quarantined == 1
+    assert [r['sample_id'] for r in dsp_queue.list_quarantined(conn)] == ['old1']
+    assert dsp_queue.list_quarantined(conn)[0]['last_error'] == 'boom'
+
+    # an expired lease (runner died) makes the row claimable again
+    assert 'packed' in [sid for sid, _ in dsp_queue.claim(conn, 'd', 5, now=now + dsp_queue.LEASE_SECONDS + 1)]
+    assert 'old1' not in [sid for sid, _ in dsp_queue.claim(conn, 'd', 5, now=t + 10 ** 6)]
+    assert dsp_queue.release_quarantined(conn) == 1
+
+    # rows go with their sample
+    with conn:
+        delete_samples_by_path(conn, ['/library/new1.wav'])
+    assert conn.execute("SELECT COUNT(*) FROM dsp_queue WHERE sample_id = 'new1'").fetchone()[0] == 0
+    conn.close()
+
+
+def test_viewed_samples_are_analysed_first_and_bad_files_retry(tmp_path, monkeypatch):
+    root = tmp_path / 'pack'
+    root.mkdir()
+    t = np.arange(SR // 2) / SR
+    for i in range(4):
+        sf.write(str(root / f'Tone_{i}.wav'), (0.3 * np.sin(2 * np.pi * (220 + 50 * i) * t)).astype('float32'), SR)
+    sf.write(str(root / 'Broken.wav'), np.zeros(SR // 2, 'float32'), SR)
+    db_file = str(tmp_path / 'q.db')
+    scan_roots([str(root)], db_path=db_file)
+
+    client = TestClient(app)
+    ids = {r['filename']: r['id'] for r in client.get('/samples', params={'db_path': db_file, 'limit': 10}).json()['rows']}
+    assert client.get(f"/samples/{ids['Tone_3.wav']}", params={'db_path': db_file}).status_code == 200
+
+    real_extract = dsp_runner.dsp.extract_audio_metadata
+
+    def extract(path, **kw):
+        if path.endswith('Broken.wav'):
+            raise RuntimeError('decoder error')
+        return real_extract(path, **kw)
+    monkeypatch.setattr(dsp_runner.dsp, 'extract_audio_metadata', extract)
+
+    assert dsp_runner.run_once(db_path=db_file, limit=1) == 1
+    conn = get_conn(db_file)
+    done = [r[0] for r in conn.execute("SELECT filename FROM samples WHERE content_hash IS NOT NULL")]
+    assert done == ['Tone_3.wav']
+
+    assert dsp_runner.run_once(db_path=db_file) == 3
+    row = conn.execute("SELECT attempts, last_error, ready_at FROM dsp_queue WHERE sample_id = ?", (ids['Broken.wav'],)).fetchone()
+    assert row['attempts'] == 1 and row['last_error'] == 'decoder error' and row['ready_at'] > 0
+    # backing off: the next run has nothing to do
+    assert dsp_runner.run_once(db_path=db_file) == 0
+    assert client.get('/dsp/queue', params={'db_path': db_file}).json()['retrying'] == 1
+    conn.close()
+
+
+def test_missing_and_corrupt_files_back_off_then_quarantine(tmp_path):
+    root = tmp_path / 'pack'
+    root.mkdir()
+    sf.write(str(root / 'Gone.wav'), np.zeros(SR // 2, 'float32'), SR)
+    (root / 'Corrupt.wav').write_bytes(b'RIFF\x00\x00\x00\x00WAVEjunk' * 64)
+    db_file = str(tmp_path / 'q.db')
+    scan_roots([str(root)], db_path=db_file)
+    (root / 'Gone.wav').unlink()
+    conn = get_conn(db_file)
+
+    for attempt in range(1, dsp_queue.MAX_ATTEMPTS + 1):
+        assert dsp_runner.run_once(db_path=db_file) == 0
+        rows = conn.execute("SELECT s.filename, q.attempts, q.quarantined, q.ready_at, q.last_error FROM dsp_queue q "
+                            "JOIN samples s ON s.id = q.sample_id ORDER BY s.filename").fetchall()
+        assert [(r[0], r[1]) for r in rows] == [('Corrupt.wav', attempt), ('Gone.wav', attempt)]
+        assert [r[4] for r in rows] == ["can't decode audio", "can't read file"]
+        if attempt < dsp_queue.MAX_ATTEMPTS:
+            # backing off: neither is picked up again until its retry is due
+            assert all(r[2] == 0 and r[3] > 0 for r in rows)
+            assert dsp_runner.run_once(db_path=db_file) == 0
+            assert conn.execute("SELECT MAX(attempts) FROM dsp_queue").fetchone()[0] == attempt
+            with conn:
+                conn.execute("UPDATE dsp_queue SET ready_at = 0")
+    assert all(r[2] == 1 for r in rows)
+    assert conn.execute("SELECT COUNT(*) FROM samples WHERE content_hash IS NOT NULL").fetchone()[0] == 0
+    assert dsp_queue.stats(conn)['quarantined'] == 2
+    conn.close()
+
+
+def crash_on_poison(rows, *args):
+    if any('Poison' in path for _, path in rows):
+        os._exit(1)
+    return dsp_runner.analyze_chunk(rows, *args)
+
+
+def test_worker_crash_fails_its_chunk_and_the_pool_recovers(tmp_path, monkeypatch):
+    root = tmp_path / 'pack'
+    root.mkdir()
+    y = (0.3 * np.sin(2 * np.pi * 330 * np.arange(SR // 4) / SR)).astype('float32')
+    for name in ('A_Tone', 'B_Tone', 'Poison', 'C_Tone'):
+        sf.write(str(root / f'{name}.wav'), y, SR)
+    db_file = str(tmp_path / 'q.db')
+    scan_roots([str(root)], db_path=db_file)
+    monkeypatch.setattr(dsp_runner, 'analyze_chunk', crash_on_poison)
+
+    n = dsp_runner.run_once(db_path=db_file, workers=2, chunk_size=1)
+    conn = get_conn(db_file)
+    poison = conn.execute("SELECT q.attempts, q.last_error FROM dsp_queue q JOIN samples s ON s.id = q.sample_id "
+                          "WHERE s.filename = 'Poison.wav'").fetchone()
+    assert poison['attempts'] == 1 and 'died' in poison['last_error']
+    # the chunks in flight alongside it were re-run one file at a time
+    assert n == 3
+    assert conn.execute("SELECT COUNT(*) FROM dsp_queue").fetchone()[0] == 1
+    conn.close()
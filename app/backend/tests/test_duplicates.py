@@ -0,0 +1,145 @@
+import os
+import sqlite3
+
+import numpy as np
+import soundfile as sf
+from fastapi.testclient import TestClient
+
+from app.backend.duplicates import apply_duplicates, undo_duplicates
+from app.backend.db import get_conn, init_db
+from app.backend.hashing import hash_file
+from app.backend.main import app
+from app.backend.scanner import scan_roots
+
+
+def make_library(tmp_path):
+    """Three copies of one pad, two of another, one unique file; hashed as
+    the DSP pass would."""
+    root = tmp_path / 'pack'
+    a, b = os.urandom(6000), os.urandom(5000)
+    for d, name, data in [('x', 'Pad_A.wav', a), ('y', 'Pad_A.wav', a), ('z', 'Pad_A_copy.wav', a),
+                          ('x', 'Pad_B.wav', b), ('y', 'Pad_B.wav', b), ('x', 'Pad_C.wav', os.urandom(5000))]:
+        (root / d).mkdir(parents=True, exist_ok=True)
+        (root / d / name).write_bytes(data)
+    db_file = tmp_path / 'dupes.db'
+    scan_roots([str(root)], db_path=str(db_file))
+    conn = sqlite3.connect(str(db_file))
+    rows = conn.execute("SELECT id, full_path FROM samples").fetchall()
+    conn.executemany("UPDATE samples SET content_hash=? WHERE id=?", [(hash_file(p), i) for i, p in rows])
+    conn.commit()
+    conn.close()
+    return root, db_file
+
+
+def test_duplicates_api_pages_groups(tmp_path):
+    _, db_file = make_library(tmp_path)
+    client = TestClient(app)
+    first = client.get('/duplicates', params={'db_path': str(db_file), 'limit': 1}).json()
+    assert [g['count'] for g in first['groups']] == [3]
+    assert first['groups'][0]['wasted_bytes'] == 12000
+    second = client.get('/duplicates', params={'db_path': str(db_file), 'limit': 1, 'cursor': first['next_cursor']}).json()
+    assert [g['count'] for g in second['groups']] == [2]
+    third = client.get('/duplicates', params={'db_path': str(db_file), 'limit': 1, 'cursor': second['next_cursor']}).json()
+    assert third['groups'] == [] and third['next_cursor'] is None
+
+    bad = client.get('/duplicates', params={'db_path': str(db_file), 'cursor': 'not-a-cursor'})
+    assert bad.status_code == 400 and bad.json() == {'error': 'bad cursor'}
+
+
+def test_hardlink_then_rescan_and_undo(tmp_path):
+    root, db_file = make_library(tmp_path)
+    undo = tmp_path / 'undo.csv'
+    conn = get_conn(db_file)
+    res = apply_duplicates(conn, 'hardlink', str(undo), keep='shortest')
+    conn.close()
+    assert res['done'] == 3 and res['skipped'] == 0 and res['freed_bytes'] == 17000
+    inodes = {os.stat(p).st_ino for p in root.rglob('Pad_A*.wav')}
+    assert len(inodes) == 1
+
+    # the links stay one row across scans
+    res = scan_roots([str(root)], db_path=str(db_file), incremental=True)
+    assert res['linked'] == 3 and res['renamed'] == 0
+    res = scan_roots([str(root)], db_path=str(db_file), incremental=True)
+    assert res['linked'] == 3 and res['renamed'] == 0 and res['pruned'] == 0
+    conn = sqlite3.connect(str(db_file))
+    assert conn.execute("SELECT COUNT(*) FROM samples").fetchone()[0] == 3
+    conn.close()
+
+    assert undo_duplicates(str(undo)) == {'restored': 3, 'failed': 0}
+    inodes = {os.stat(p).st_ino for p in root.rglob('Pad_A*.wav')}
+    assert len(inodes) == 3
+
+
+def test_delete_moves_to_trash_and_undo(tmp_path):
+    root, db_file = make_library(tmp_path)
+    trash = tmp_path / 'trash'
+    undo = tmp_path / 'undo.csv'
+    before = sorted(p.relative_to(root) for p in root.rglob('*.wav'))
+    conn = get_conn(db_file)
+    res = apply_duplicates(conn, 'delete', str(undo), trash_dir=str(trash))
+    left = conn.execute("SELECT COUNT(*) FROM samples").fetchone()[0]
+    conn.close()
+    assert res['done'] == 3 and left == 3
+    assert len(list(root.rglob('*.wav'))) == 3 and len(list(trash.iterdir())) == 3
+
+    assert undo_duplicates(str(undo))['restored'] == 3
+    assert sorted(p.relative_to(root) for p in root.rglob('*.wav')) == before
+    assert list(trash.iterdir()) == []
+
+
+def synth(seed, sr=44100, dur=3.0):
+    """Decaying tones at random pitches and onsets over a little noise."""
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(sr * dur)) / sr
+    y = 0.01 * rng.standard_normal(len(t))
+    for _ in range(12):
+        f, start, length = rng.uniform(200, 3000), rng.uniform(0, dur - 0.4), rng.uniform(0.1, 0.4)
+        y += ((t >= start) & (t < start + length)) * np.exp(-(t - start) * 8) * np.sin(2 * np.pi * f * t)
+    return (0.3 * y).astype('float32')
+
+
+def test_near_duplicates_survive_reexport(tmp_path):
+    import librosa
+    from app.backend import dsp_runner
+
+    root = tmp_path / 'pack'
+    root.mkdir()
+    y = synth(1)
+    sf.write(str(root / 'Pad_Orig.wav'), y, 44100, subtype='PCM_24')
+    # resampled, 16-bit and with the first 130 ms trimmed
+    y2 = librosa.resample(y, orig_sr=44100, target_sr=22050)[int(0.13 * 22050):]
+    sf.write(str(root / 'Pad_Export.wav'), y2, 22050, subtype='PCM_16')
+    sf.write(str(root / 'Pad_Other.wav'), synth(2), 44100)
+    db_file = tmp_path / 'near.db'
+    scan_roots([str(root)], db_path=str(db_file))
+    assert dsp_runner.run_once(db_path=str(db_file)) == 3
+
+    conn = sqlite3.connect(str(db_file))
+    ids = dict(conn.execute("SELECT filename, id FROM samples"))
+    client = TestClient(app)
+    res = client.get(f"/samples/{ids['Pad_Orig.wav']}/near-duplicates", params={'db_path': str(db_file)}).json()
+    assert res['fingerprinted'] and [m['id'] for m in res['matches']] == [ids['Pad_Export.wav']]
+    assert client.get('/samples/nope/near-duplicates', params={'db_path': str(db_file)}).status_code == 404
+    assert 'landmarks' not in client.get(f"/samples/{ids['Pad_Orig.wav']}", params={'db_path': str(db_file)}).json()
+
+    # postings are keyed by sample id: a database indexed by rowid (which
+    # VACUUM may renumber) is re-keyed once by init_db
+    with conn:
+        conn.execute("DROP TABLE landmark_index")
+        conn.execute("CREATE TABLE landmark_index (hash INTEGER, sample_rowid INTEGER, t INTEGER, "
+                     "PRIMARY KEY (hash, sample_rowid, t)) WITHOUT ROWID")
+    conn.execute("PRAGMA user_version = 1")
+    init_conn = get_conn(db_file)
+    init_db(init_conn)
+    init_conn.close()
+    conn.execute("VACUUM")
+    res = client.get(f"/samples/{ids['Pad_Export.wav']}/near-duplicates", params={'db_path': str(db_file)}).json()
+    assert [m['id'] for m in res['matches']] == [ids['Pad_Orig.wav']]
+
+    # pruning a sample takes its postings out of the index
+    n_index = conn.execute("SELECT COUNT(*) FROM landmark_index").fetchone()[0]
+    export_blob = conn.execute("SELECT length(landmarks) / 6 FROM samples WHERE id=?", (ids['Pad_Export.wav'],)).fetchone()[0]
+    next(root.rglob('Pad_Export.wav')).unlink()
+    scan_roots([str(root)], db_path=str(db_file))
+    assert conn.execute("SELECT COUNT(*) FROM landmark_index").fetchone()[0] == n_index - export_blob
+    conn.close()
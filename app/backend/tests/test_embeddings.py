@@ -0,0 +1,76 @@
+import numpy as np
+import soundfile as sf
+from fastapi.testclient import TestClient
+
+from app.backend import embeddings
+from app.backend.db import delete_samples_by_path, get_conn, init_db
+from app.backend.dsp_runner import run_once
+from app.backend.main import app
+from app.backend.scanner import scan_roots
+
+SR = 22050
+
+
+def kick(seed):
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(SR * 0.4)) / SR
+    f0 = rng.uniform(130, 170)
+    phase = 2 * np.pi * np.cumsum(50 + (f0 - 50) * np.exp(-t * 30)) / SR
+    return (0.9 * np.sin(phase) * np.exp(-t * rng.uniform(7, 10))).astype('float32')
+
+
+def hat(seed):
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(SR * 0.4)) / SR
+    noise = np.diff(rng.standard_normal(len(t) + 1))
+    return (0.3 * noise * np.exp(-t * rng.uniform(25, 40))).astype('float32')
+
+
+def build(tmp_path):
+    root = tmp_path / 'pack'
+    root.mkdir()
+    for i in range(3):
+        sf.write(str(root / f'Kick_{i}.wav'), kick(i), SR)
+        sf.write(str(root / f'Hat_{i}.wav'), hat(10 + i), SR)
+    db_file = str(tmp_path / 'emb.db')
+    scan_roots([str(root)], db_path=db_file)
+    assert run_once(db_path=db_file) == 6
+    return db_file
+
+
+def test_similar_endpoint_ranks_by_timbre(tmp_path):
+    db_file = build(tmp_path)
+    client = TestClient(app)
+    rows = client.get('/samples', params={'db_path': db_file, 'limit': 10}).json()['rows']
+    ids = {r['filename']: r['id'] for r in rows}
+
+    for quantize in (False, True):
+        r = client.get(f"/samples/{ids['Kick_0.wav']}/similar", params={'db_path': db_file, 'k': 5, 'quantize': quantize})
+        body = r.json()
+        assert body['embedded'] is True and len(body['matches']) == 5
+        names = [m['filename'] for m in body['matches']]
+        assert set(names[:2]) == {'Kick_1.wav', 'Kick_2.wav'}
+        assert body['matches'][0]['score'] >= body['matches'][-1]['score']
+
+    assert client.get('/samples/nope/similar', params={'db_path': db_file}).status_code == 404
+
+
+def test_deleted_rows_are_skipped_and_compacted(tmp_path):
+    db_file = build(tmp_path)
+    conn = get_conn(db_file)
+    init_db(conn)
+    path = embeddings.store_path(conn)
+    assert path.stat().st_size == 6 * embeddings.ROW_BYTES
+    kicks = dict(conn.execute("SELECT filename, id FROM samples WHERE filename LIKE 'Kick%'").fetchall())
+    gone = conn.execute("SELECT full_path FROM samples WHERE filename='Kick_1.wav'").fetchone()[0]
+    with conn:
+        delete_samples_by_path(conn, [gone])
+
+    names = [m['filename'] for m in embeddings.find_similar(conn, kicks['Kick_0.wav'], k=5)]
+    assert 'Kick_1.wav' not in names and names[0] == 'Kick_2.wav' and len(names) == 4
+
+    assert embeddings.compact(conn) == 5
+    assert path.stat().st_size == 5 * embeddings.ROW_BYTES
+    assert sorted(r[0] for r in conn.execute("SELECT row FROM embeddings")) == list(range(5))
+    assert [m['filename'] for m in embeddings.find_similar(conn, kicks['Kick_0.wav'], k=5)] == names
+    conn.close()
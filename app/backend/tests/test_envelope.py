@@ -0,0 +1,96 @@
+import numpy as np
+import soundfile as sf
+
+from app.backend import envelope
+from app.backend.autotag import generate_autotags_from_parsed
+from app.backend.scanner import LOOPS_SUBPATH, scan_roots
+
+SR = 22050
+
+
+def kick(dur=0.4):
+    t = np.arange(int(SR * dur)) / SR
+    phase = 2 * np.pi * np.cumsum(50 + 100 * np.exp(-t * 30)) / SR
+    return (0.9 * np.sin(phase) * np.exp(-t * 8)).astype('float32')
+
+
+def hat(seed, dur=0.1):
+    t = np.arange(int(SR * dur)) / SR
+    return (0.3 * np.diff(np.random.default_rng(seed).standard_normal(len(t) + 1)) * np.exp(-t * 40)).astype('float32')
+
+
+def drum_loop(bpm=120, bars=2):
+    beat = 60 / bpm
+    y = np.zeros(int(SR * beat * 4 * bars), 'float32')
+    for i in range(4 * bars):
+        for at, x in ((i * beat, kick()), ((i + 0.5) * beat, hat(i))):
+            start = int(at * SR)
+            n = min(len(x), len(y) - start)
+            y[start:start + n] += x[:n]
+    return y
+
+
+def decaying_hit(dur=2.5):
+    t = np.arange(int(SR * dur)) / SR
+    return (0.4 * np.random.default_rng(0).standard_normal(len(t)) * np.exp(-t * 2.5)).astype('float32')
+
+
+def test_envelope_features_separate_loops_from_one_shots():
+    loop = envelope.analyze(drum_loop(), SR)
+    assert loop.onsets >= 8 and loop.periodicity > 0.8 and loop.tail_db > -15
+    assert loop.loop_probability > 0.9
+
+    shot = envelope.analyze(kick(), SR)
+    assert shot.attack < 0.02 and shot.decay < 0.4 and shot.periodicity == 0.0
+    assert shot.loop_probability < 0.1
+    assert envelope.analyze(decaying_hit(), SR).loop_probability < 0.3
+    assert envelope.analyze(np.zeros(SR, 'float32'), SR).onsets == 0
+
+    # a windowed buffer (two excerpts of a long loop) keeps its features
+    y = np.tile(drum_loop(), 8)
+    excerpt = np.concatenate([y[:SR * 6], y[-SR * 2:]])
+    windowed = envelope.analyze(excerpt, SR, duration=len(y) / SR, head=SR * 6)
+    assert windowed.duration == len(y) / SR and windowed.loop_probability > 0.9
+
+
+def test_scan_routes_by_stored_envelope_and_autotag_uses_it(tmp_path, monkeypatch):
+    from app.backend import scanner
+    from app.backend.dsp_runner import run_once
+    root = tmp_path / 'pack'
+    root.mkdir()
+    # no naming hint at all, but a loop
+    sf.write(str(root / 'Groove_A.wav'), drum_loop(), SR)
+    # a BPM token and over LOOP_MIN_SECONDS long, but a single hit
+    sf.write(str(root / 'Perc_Shaker_128bpm.wav'), decaying_hit(), SR)
+    db_file = str(tmp_path / 'env.db')
+
+    # scans read headers only: the first one routes by name and duration
+    decodes = []
+    real_analyze = scanner.analyze_envelope
+    monkeypatch.setattr(scanner, 'analyze_envelope', lambda *a, **k: decodes.append(1) or real_analyze(*a, **k))
+    scan_roots([str(root)], db_path=db_file)
+    assert decodes == []
+    assert (root / LOOPS_SUBPATH / 'Perc_Shaker_128bpm.wav').exists()
+    assert (root / 'Groove_A.wav').exists()
+
+    # once the DSP pass stored loop probabilities, a rescan routes by them
+    assert run_once(db_path=db_file) == 2
+    scan_roots([str(root)], db_path=db_file)
+    assert decodes == []
+    assert (root / LOOPS_SUBPATH / 'Groove_A.wav').exists()
+
+    # scan-time analysis is opt-in
+    other = tmp_path / 'other'
+    other.mkdir()
+    sf.write(str(other / 'Groove_B.wav'), drum_loop(), SR)
+    sf.write(str(other / 'Hit_100bpm.wav'), decaying_hit(), SR)
+    scan_roots([str(other)], db_path=db_file, analyze_audio=True)
+    assert len(decodes) == 2
+    assert (other / LOOPS_SUBPATH / 'Groove_B.wav').exists()
+    assert not (other / LOOPS_SUBPATH / 'Hit_100bpm.wav').exists()
+
+    parsed = {'original': 'Groove_A.wav', 'tokens': ['Groove', 'A']}
+    tags = dict(generate_autotags_from_parsed(parsed, {'loop_probability': 0.95}))
+    assert tags['loop'] > 0.8 and 'one_shot' not in tags
+    tags = dict(generate_autotags_from_parsed(parsed, {'loop_probability': 0.05}))
+    assert tags['one_shot'] > 0.8 and 'loop' not in tags
@@ -0,0 +1,40 @@
+import hashlib
+import os
+
+from app.backend.db import get_conn, get_fingerprint_collisions
+from app.backend.hashing import HASH_BUFFER, find_duplicates, hash_file, split_content_hash
+from app.backend.scanner import scan_roots
+
+
+def test_hash_file_is_tagged_and_streams(tmp_path):
+    p = tmp_path / 'big.bin'
+    data = os.urandom(HASH_BUFFER * 2 + 123)
+    p.write_bytes(data)
+    assert hash_file(p) == 'sha256:' + hashlib.sha256(data).hexdigest()
+    assert hash_file(p, 'blake2b') == 'blake2b:' + hashlib.blake2b(data, digest_size=32).hexdigest()
+    assert split_content_hash('ab12') == ('sha256', 'ab12')
+    assert hash_file(tmp_path / 'missing.bin') is None
+
+
+def test_two_stage_dedupe_hashes_only_collisions(tmp_path):
+    root = tmp_path / 'pack'
+    root.mkdir()
+    head, tail = os.urandom(8192), os.urandom(8192)
+    # a and b are identical; c shares size, head and tail with them (same
+    # fingerprint) but differs in the middle; d is unique
+    (root / 'Kick_a.wav').write_bytes(head + b'\0' * 20000 + tail)
+    (root / 'Kick_b.wav').write_bytes(head + b'\0' * 20000 + tail)
+    (root / 'Kick_c.wav').write_bytes(head + b'\1' * 20000 + tail)
+    (root / 'Snare_d.wav').write_bytes(os.urandom(30000))
+    db_file = tmp_path / 'dedupe.db'
+    scan_roots([str(root)], db_path=str(db_file), min_size=1)
+
+    conn = get_conn(db_file)
+    rows = get_fingerprint_collisions(conn)
+    ids = {r['filename']: r['id'] for r in conn.execute("SELECT id, filename FROM samples")}
+    conn.close()
+    assert len(rows) == 3
+
+    groups, hashed = find_duplicates((r[0], r[1], r[2], r[3], r[4]) for r in rows)
+    assert hashed == 3
+    assert [sorted(g) for g in groups.values()] == [sorted([ids['Kick_a.wav'], ids['Kick_b.wav']])]
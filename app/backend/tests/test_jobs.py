@@ -74,3 +74,32 @@ def test_job_persistence_and_cancel(tmp_path):
     result = json.loads(result_json)
     # scan should have stopped early due to cancel
     assert result.get('scanned', 0) < total
+
+
+def test_job_control_rate_limits_progress_and_sees_db_cancel(tmp_path):
+    from app.backend.jobs import JobControl
+
+    db_file = tmp_path / 'ctl.db'
+    conn = backend_db.get_conn(str(db_file))
+    backend_db.init_db(conn)
+    job_id = str(uuid.uuid4())
+    backend_db.create_job(conn, job_id, '/x', str(db_file), 10, 1)
+
+    job = JobControl(conn, job_id, kind='scan', flush_interval=3600)
+    for i in range(1, 1001):
+        job.progress(i)
+    # nothing flushed yet: the interval has not elapsed
+    assert backend_db.get_job(conn, job_id)['scanned'] == 0
+
+    # a cancel written by another process only shows up in the DB row
+    other = sqlite3.connect(str(db_file))
+    other.execute("UPDATE scan_jobs SET cancel_requested=1 WHERE id=?", (job_id,))
+    other.commit()
+    other.close()
+    assert not job.cancelled()
+    job.flush()
+    assert job.cancelled()
+    row = backend_db.get_job(conn, job_id)
+    assert row['scanned'] == 1000 and row['throughput'] is not None
+    job.close()
+    conn.close()
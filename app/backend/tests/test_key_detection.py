@@ -29,3 +29,41 @@ def test_key_detection_on_synthetic_a(tmp_path):
     kd = meta.get('key_detected')
     # We expect at least to detect tonic A in either maj or min
     assert kd is not None and ('A' in kd)
+
+
+def test_batch_scores_match_single_vectors_and_report_confidence():
+    from app.backend import keydetect
+
+    rng = np.random.default_rng(0)
+    # chroma close to the D minor profile, one flat vector, random noise
+    d_minor = np.roll(keydetect.MINOR_TEMPLATE, 2) + rng.random(12) * 0.5
+    batch = np.stack([d_minor, np.ones(12), rng.random(12)])
+    ests = keydetect.estimate(batch)
+    assert ests[0].key == 'D:min' and ests[0].confidence > 0.9 and ests[0].margin > 0
+    assert ests[1] == keydetect.KeyEstimate(None, None, None)
+    assert [e.key for e in ests] == [keydetect.estimate(c)[0].key for c in batch]
+    top = keydetect.top_keys(d_minor, k=3)[0]
+    assert top[0][0] == 'D:min' and len(top) == 3 and top[0][1] >= top[1][1] >= top[2][1]
+    assert round(top[0][1] - top[1][1], 4) == ests[0].margin
+
+
+def test_rekey_from_stored_chroma(tmp_path):
+    pytest.importorskip('librosa')
+    from app.backend import dsp, keydetect
+    from app.backend.db import get_conn, init_db, update_sample_metadata, upsert_sample
+
+    y, sr = synth_harmonic_tone(freq=440.0, sr=22050, duration=1.0)
+    p = tmp_path / 'tone_a.wav'
+    sf.write(str(p), y, sr, subtype='PCM_16')
+    meta = dsp.extract_audio_metadata(str(p), extractors=['key'])
+    assert meta['key_confidence'] > 0 and len(meta['chroma']) == 48
+
+    conn = get_conn(str(tmp_path / 'keys.db'))
+    init_db(conn)
+    upsert_sample(conn, {'id': 'a', 'full_path': str(p), 'filename': p.name})
+    update_sample_metadata(conn, 'a', meta)
+    conn.execute("UPDATE samples SET key_detected=NULL, key_confidence=NULL")
+    assert keydetect.rekey(conn, batch=1) == 1
+    row = conn.execute("SELECT key_detected, key_confidence, key_margin FROM samples").fetchone()
+    assert tuple(row) == (meta['key_detected'], meta['key_confidence'], meta['key_margin'])
+    conn.close()
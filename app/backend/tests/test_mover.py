@@ -0,0 +1,54 @@
+import csv
+import sqlite3
+from pathlib import Path
+
+from app.backend.mover import MovePlanner, execute_moves
+from app.backend.scanner import scan_roots, LOOPS_SUBPATH, DRUMS_SUBPATH
+
+
+def make_file(path: Path, size: int = 1024):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(b'0' * size)
+
+
+def test_planner_resolves_collisions_in_memory(tmp_path):
+    target = tmp_path / 'dest'
+    make_file(target / 'a.wav')
+    make_file(target / 'a_1.wav')
+    srcs = [tmp_path / 'x' / 'a.wav', tmp_path / 'y' / 'A.wav', tmp_path / 'z' / 'b.wav']
+    for s in srcs:
+        make_file(s)
+
+    planner = MovePlanner()
+    dsts = [planner.plan(s, target) for s in srcs]
+    assert [d.name for d in dsts] == ['a_2.wav', 'A_3.wav', 'b.wav']
+    assert planner.plan(target / 'a.wav', target) is None
+
+    done, failed = execute_moves(planner.moves)
+    assert not failed and len(done) == 3
+    assert all(d.exists() for d in dsts) and not any(s.exists() for s in srcs)
+
+
+def test_scan_moves_and_undo_log(tmp_path):
+    root = tmp_path / 'pack'
+    make_file(root / 'a' / 'Kick_01.wav')
+    make_file(root / 'b' / 'Kick_01.wav')
+    make_file(root / 'c' / 'Perc_loop.wav')
+    db_file = tmp_path / 'moves.db'
+    undo = tmp_path / 'undo.csv'
+
+    res = scan_roots([str(root)], db_path=str(db_file), batch_size=1, undo_csv=str(undo))
+    assert res['inserted'] == 3
+
+    kicks = sorted(p.name for p in (root / DRUMS_SUBPATH / 'Kicks').iterdir())
+    assert kicks == ['Kick_01.wav', 'Kick_01_1.wav']
+    assert (root / LOOPS_SUBPATH / 'Perc_loop.wav').exists()
+
+    conn = sqlite3.connect(str(db_file))
+    paths = {r[0] for r in conn.execute("SELECT full_path FROM samples")}
+    conn.close()
+    assert all(Path(p).exists() for p in paths)
+
+    with open(undo, newline='') as fh:
+        assert len(list(csv.DictReader(fh))) == 3
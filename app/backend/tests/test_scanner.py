@@ -28,3 +28,140 @@ def test_scan_inserts_rows(tmp_path):
     count = cur.fetchone()[0]
     assert count >= 2
     conn.close()
+
+
+def test_incremental_rescan_counts(tmp_path):
+    root = tmp_path / 'pack'
+    for i in range(5):
+        make_file(root / f'sample_{i}.wav')
+    db_file = tmp_path / 'inc.db'
+
+    first = scan_roots([str(root)], db_path=str(db_file), incremental=True)
+    assert first['new'] == 5 and first['unchanged'] == 0
+
+    again = scan_roots([str(root)], db_path=str(db_file), incremental=True)
+    assert again['unchanged'] == 5
+    assert again['inserted'] == 0
+
+    make_file(root / 'sample_0.wav', size=2048)
+    make_file(root / 'sample_new.wav')
+    (root / 'sample_1.wav').unlink()
+    res = scan_roots([str(root)], db_path=str(db_file), incremental=True)
+    assert (res['new'], res['changed'], res['unchanged'], res['pruned']) == (1, 1, 3, 1)
+
+    conn = sqlite3.connect(str(db_file))
+    rows = dict(conn.execute("SELECT filename, size_bytes FROM samples").fetchall())
+    conn.close()
+    assert len(rows) == 5
+    assert rows['sample_0.wav'] == 2048
+    assert 'sample_1.wav' not in rows
+
+
+def test_sharded_scan_attributes_each_root(tmp_path):
+    roots = [tmp_path / 'driveA', tmp_path / 'driveB']
+    make_file(roots[0] / 'Kick_01.wav')
+    make_file(roots[0] / 'pack1' / 'Vox_Chop.wav')
+    make_file(roots[1] / 'pack2' / 'deep' / 'Snare_02.wav')
+    make_file(roots[1] / 'tiny.wav', size=10)
+    db_file = tmp_path / 'shards.db'
+
+    res = scan_roots([str(r) for r in roots], db_path=str(db_file), workers=2)
+    assert res['scanned'] == 4 and res['skipped'] == 1 and res['inserted'] == 3
+    # moves stay inside the file's own root
+    assert (roots[0] / '01 Drums' / 'Kicks' / 'Kick_01.wav').exists()
+    assert (roots[0] / '05 Vocals' / 'Vox_Chop.wav').exists()
+    assert (roots[1] / '01 Drums' / 'Snares' / 'Snare_02.wav').exists()
+
+    conn = sqlite3.connect(str(db_file))
+    rows = dict(conn.execute("SELECT filename, root_dir FROM samples"))
+    conn.close()
+    assert rows == {
+        'Kick_01.wav': str(roots[0].resolve()),
+        'Vox_Chop.wav': str(roots[0].resolve()),
+        'Snare_02.wav': str(roots[1].resolve()),
+    }
+
+    res = scan_roots([str(r) for r in roots], db_path=str(db_file), workers=2, incremental=True)
+    assert res['unchanged'] == 3 and res['new'] == 0 and res['pruned'] == 0
+
+
+def test_identity_survives_rename_and_keeps_dsp(tmp_path):
+    root = tmp_path / 'pack'
+    src = root / 'a' / 'Pad_Warm.wav'
+    make_file(src, size=9000)
+    db_file = tmp_path / 'ident.db'
+    scan_roots([str(root)], db_path=str(db_file))
+
+    conn = sqlite3.connect(str(db_file))
+    (sid,) = conn.execute("SELECT id FROM samples").fetchone()
+    conn.execute("UPDATE samples SET bpm=120, content_hash='sha256:abc' WHERE id=?", (sid,))
+    conn.execute("INSERT INTO autotags (sample_id, tag, confidence) VALUES (?, 'melodic', 0.5)", (sid,))
+    conn.commit()
+
+    dst = root / 'b' / 'Pad_Warm_renamed.wav'
+    dst.parent.mkdir()
+    src.rename(dst)
+    res = scan_roots([str(root)], db_path=str(db_file), incremental=True)
+    assert res['renamed'] == 1 and res['pruned'] == 0
+    row = conn.execute("SELECT id, full_path, bpm, content_hash FROM samples").fetchall()
+    assert row == [(sid, str(dst.resolve()), 120.0, 'sha256:abc')]
+    assert conn.execute("SELECT sample_id FROM autotags").fetchall() == [(sid,)]
+
+    # rewriting the file with different content gives it a new identity
+    make_file(dst, size=5000)
+    scan_roots([str(root)], db_path=str(db_file), incremental=True)
+    rows = conn.execute("SELECT id, bpm FROM samples").fetchall()
+    conn.close()
+    assert len(rows) == 1 and rows[0][0] != sid and rows[0][1] is None
+
+
+def test_narrowed_rescan_does_not_prune_files_still_on_disk(tmp_path):
+    root = tmp_path / 'pack'
+    make_file(root / 'Pad_A.wav', size=4000)
+    make_file(root / 'Pad_B.flac', size=4000)
+    make_file(root / 'Pad_C.wav', size=1000)
+    db_file = tmp_path / 'narrow.db'
+    assert scan_roots([str(root)], db_path=str(db_file))['inserted'] == 3
+
+    # other file types and files under min_size were skipped, not removed
+    res = scan_roots([str(root)], db_path=str(db_file), exts=['.wav'], min_size=2000)
+    assert res['pruned'] == 0 and res['skipped'] == 1
+    conn = sqlite3.connect(str(db_file))
+    assert conn.execute("SELECT COUNT(*) FROM samples").fetchone()[0] == 3
+
+    # files of the scanned types that are gone still are
+    (root / 'Pad_A.wav').unlink()
+    (root / 'Pad_B.flac').unlink()
+    assert scan_roots([str(root)], db_path=str(db_file), exts=['.wav'])['pruned'] == 1
+    assert [r[0] for r in conn.execute("SELECT filename FROM samples ORDER BY filename")] == ['Pad_B.flac', 'Pad_C.wav']
+    conn.close()
+
+
+def test_prune_tombstones_restore_dsp(tmp_path):
+    import shutil
+    root = tmp_path / 'pack'
+    f = root / 'Pad_Soft.wav'
+    make_file(f, size=6000)
+    make_file(root / 'Pad_Keep.wav', size=7000)
+    db_file = tmp_path / 'prune.db'
+    scan_roots([str(root)], db_path=str(db_file))
+    conn = sqlite3.connect(str(db_file))
+    conn.execute("UPDATE samples SET bpm=90, duration=1.5, content_hash='sha256:h1' WHERE filename='Pad_Soft.wav'")
+    conn.commit()
+
+    # file leaves the library: its row is pruned and tombstoned
+    backup = tmp_path / 'backup.wav'
+    shutil.copy(f, backup)
+    f.unlink()
+    res = scan_roots([str(root)], db_path=str(db_file))
+    assert res['pruned'] == 1
+    assert conn.execute("SELECT COUNT(*) FROM samples").fetchone()[0] == 1
+    assert conn.execute("SELECT content_hash FROM sample_tombstones").fetchall() == [('sha256:h1',)]
+
+    # a copy comes back (new inode, so a new id): DSP results are restored
+    shutil.copy(backup, f)
+    res = scan_roots([str(root)], db_path=str(db_file))
+    assert res['restored'] == 1 and res['pruned'] == 0
+    row = conn.execute("SELECT bpm, duration, content_hash FROM samples WHERE filename='Pad_Soft.wav'").fetchone()
+    conn.close()
+    assert row == (90.0, 1.5, 'sha256:h1')
@@ -0,0 +1,33 @@
+import os
+from pathlib import Path
+
+from app.backend.walker import walk_files
+from app.backend.scanner import iter_files
+
+
+def make_file(path: Path, size: int = 1024):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(b'0' * size)
+
+
+def test_walk_files_matches_rglob(tmp_path):
+    root = tmp_path / 'pack'
+    for i in range(30):
+        make_file(root / f'd{i % 4}' / f'sub{i % 3}' / f's_{i}.wav', size=100 + i)
+    make_file(root / 'notes.txt')
+    make_file(root / 'top.WAV')
+
+    expected = sorted(p for p in root.rglob('*') if p.is_file() and p.suffix.lower() == '.wav')
+    for workers in (1, 4):
+        recs = list(walk_files([root], exts={'.wav'}, max_workers=workers))
+        assert sorted(r.path for r in recs) == expected
+        for r in recs:
+            st = os.stat(r.path)
+            assert (r.size, r.mtime_ns, r.inode) == (st.st_size, st.st_mtime_ns, st.st_ino)
+
+    assert sorted(iter_files([root])) == expected
+
+
+def test_walk_files_missing_root(tmp_path):
+    assert list(walk_files([tmp_path / 'nope'])) == []
@@ -0,0 +1,81 @@
+import sqlite3
+import time
+from pathlib import Path
+
+import pytest
+
+from app.backend.db import get_conn, init_db
+from app.backend.watcher import DELETE, DELETE_DIR, UPSERT, DebouncedQueue, FsEvent, LibraryWatcher, inotify_available
+
+
+def make_file(path: Path, size: int = 1024):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(b'0' * size)
+
+
+def indexed(db_file: Path):
+    conn = sqlite3.connect(str(db_file))
+    try:
+        return {Path(r[0]).name for r in conn.execute("SELECT full_path FROM samples")}
+    except sqlite3.OperationalError:
+        return set()
+    finally:
+        conn.close()
+
+
+def wait_for(pred, timeout=5.0):
+    end = time.monotonic() + timeout
+    while time.monotonic() < end:
+        if pred():
+            return True
+        time.sleep(0.05)
+    return pred()
+
+
+def test_queue_coalesces_bursts():
+    q = DebouncedQueue(debounce=10, max_latency=10)
+    q.put([FsEvent(UPSERT, f'/r/a/{i}.wav') for i in range(100)])
+    q.put([FsEvent(UPSERT, '/r/b.wav'), FsEvent(DELETE, '/r/b.wav')])
+    q.put([FsEvent(DELETE_DIR, '/r/a')])
+    assert not q.due()
+    assert q.drain() == [FsEvent(DELETE, '/r/b.wav'), FsEvent(DELETE_DIR, '/r/a')]
+
+
+@pytest.mark.parametrize('backend', ['inotify', 'poll'])
+def test_watcher_indexes_changes(tmp_path, backend):
+    if backend == 'inotify' and not inotify_available():
+        pytest.skip('inotify not available')
+    root = tmp_path / 'pack'
+    root.mkdir()
+    db_file = tmp_path / 'watch.db'
+    w = LibraryWatcher([str(root)], db_path=str(db_file), backend=backend, poll_interval=0.2).start()
+    try:
+        time.sleep(0.3)
+        for i in range(20):
+            make_file(root / 'unzipped' / f'hit_{i}.wav')
+        make_file(root / 'top.wav')
+        assert wait_for(lambda: len(indexed(db_file)) == 21)
+
+        (root / 'top.wav').rename(root / 'renamed.wav')
+        assert wait_for(lambda: 'renamed.wav' in indexed(db_file) and 'top.wav' not in indexed(db_file))
+    finally:
+        w.stop()
+
+
+def test_files_are_credited_to_the_root_containing_them(tmp_path):
+    # the second root's path is shorter than the first's
+    long_root = (tmp_path / 'a_drive_with_a_long_name').resolve()
+    short_root = (tmp_path / 'rb').resolve()
+    make_file(long_root / 'snare.wav')
+    make_file(short_root / 'kick.wav')
+    make_file(short_root / 'sub' / 'hat.wav')
+    db_file = tmp_path / 'watch.db'
+    w = LibraryWatcher([str(long_root), str(short_root)], db_path=str(db_file))
+    conn = get_conn(db_file)
+    init_db(conn)
+    w.apply(conn, [FsEvent(UPSERT, str(long_root / 'snare.wav')), FsEvent(UPSERT, str(short_root / 'kick.wav')),
+                   FsEvent(UPSERT, str(short_root / 'sub' / 'hat.wav')), FsEvent(UPSERT, str(tmp_path / 'elsewhere.wav'))])
+    roots = {r[0]: r[1] for r in conn.execute("SELECT filename, root_dir FROM samples")}
+    assert roots == {'snare.wav': str(long_root), 'kick.wav': str(short_root), 'hat.wav': str(short_root)}
+    conn.close()
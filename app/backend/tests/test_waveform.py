@@ -0,0 +1,47 @@
+import numpy as np
+import soundfile as sf
+from fastapi.testclient import TestClient
+
+from app.backend import waveform
+from app.backend.main import app
+from app.backend.scanner import scan_roots
+
+
+def test_pyramid_levels_and_roundtrip():
+    sr = 22050
+    y = 0.5 * np.sin(2 * np.pi * 3 * np.arange(sr * 2) / (sr * 2)).astype('float32')
+    wf = waveform.decode(waveform.encode(waveform.compute(y, 2.0)))
+    assert [len(p) for p in wf.levels] == list(waveform.LEVELS)
+    assert abs(wf.scale - 0.5) < 1e-3 and wf.duration == 2.0
+    coarse = wf.level_for(100)
+    assert coarse.shape == (128, 2) and coarse.dtype == np.int8
+    assert coarse.max() == 127 and coarse.min() == -127
+    assert (coarse[:, 0] <= coarse[:, 1]).all()
+    # a short file gets as many columns as it has samples
+    assert [len(p) for p in waveform.compute(np.ones(10, 'float32')).levels] == [10, 2]
+
+
+def test_waveform_endpoint_caches_and_computes_on_demand(tmp_path):
+    root = tmp_path / 'pack'
+    root.mkdir()
+    sr = 22050
+    sf.write(str(root / 'Pad_Wave.wav'), (0.25 * np.sin(2 * np.pi * 220 * np.arange(sr) / sr)).astype('float32'), sr)
+    db_file = tmp_path / 'wave.db'
+    scan_roots([str(root)], db_path=str(db_file))
+    client = TestClient(app)
+    sid = client.get('/samples', params={'db_path': str(db_file)}).json()['rows'][0]['id']
+    url = f'/samples/{sid}/waveform'
+
+    # no DSP pass yet: computed from the file and stored
+    r = client.get(url, params={'db_path': str(db_file)})
+    assert r.status_code == 200 and 'max-age' in r.headers['cache-control']
+    body = r.json()
+    assert body['width'] == 128 and len(body['peaks']) == 256
+    assert abs(body['scale'] - 0.25) < 1e-3 and body['duration'] == 1.0
+    assert len(r.content) < 2048
+
+    again = client.get(url, params={'db_path': str(db_file)}, headers={'If-None-Match': r.headers['etag']})
+    assert again.status_code == 304
+    raw = client.get(url, params={'db_path': str(db_file), 'width': 512, 'format': 'bin'})
+    assert raw.headers['content-type'] == 'application/octet-stream' and len(raw.content) == 1024
+    assert client.get('/samples/nope/waveform', params={'db_path': str(db_file)}).status_code == 404
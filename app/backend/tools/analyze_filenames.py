@@ -11,7 +11,7 @@ import argparse
 from collections import Counter, defaultdict
 from pathlib import Path
 
-from app.backend.tools.refine_sorting import KEYWORD_MAP, find_match
+from app.backend.tools.refine_sorting import KEYWORD_MAP, find_match, keyword_classifier
 
 
 TOKEN_RE = re.compile(r"[A-Za-z0-9#\+\-]{2,}")
@@ -69,9 +69,10 @@ def analyze(root: Path, out_csv: Path, top_n: int = 200):
     unmatched = []
     file_tokens = {}
 
+    classifier = keyword_classifier()
     for p in all_files:
         fn = p.name
-        m = find_match(fn)
+        m = find_match(fn, classifier)
         toks = tokenize(fn)
         file_tokens[fn] = toks
         if m:
@@ -14,6 +14,7 @@ import shutil
 import os
 from typing import Dict, List
 
+from app.backend.classifier import compile_keyword_map
 from app.backend.tools.refine_sorting import KEYWORD_MAP as EXISTING_KEYWORD_MAP, refine
 
 # User-provided taxonomy (trimmed to keys/arrays provided)
@@ -257,19 +258,16 @@ def run(root: Path, apply: bool = False):
             # collect moves by invoking refine with move, but we need an undo log
             undo_log = Path('sandbox/undo_moves.csv')
             moved_entries = []
-            # naive approach: walk and move matching files according to new KEYWORD_MAP
+            classifier = compile_keyword_map(rs_mod.KEYWORD_MAP)
+            # walk and move matching files according to new KEYWORD_MAP
             for dirpath, dirnames, filenames in os.walk(root):
                 for fn in filenames:
                     src = Path(dirpath) / fn
                     # find matching target
                     target = None
-                    for kws, folder in rs_mod.KEYWORD_MAP:
-                        for kw in kws:
-                            if kw in fn.lower():
-                                target = Path(folder) / fn
-                                break
-                        if target:
-                            break
+                    folder = classifier.first(fn)
+                    if folder:
+                        target = Path(folder) / fn
                     if target:
                         dest_dir = Path(root) / target.parent
                         dest_dir.mkdir(parents=True, exist_ok=True)
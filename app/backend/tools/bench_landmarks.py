@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""Benchmark: near-duplicate lookup latency against a large landmark index.
+
+Builds a temporary DB with --samples synthetic fingerprints of MAX_LANDMARKS
+hashes each. Peak bins are drawn from a skewed distribution (most energy in
+the low bins, as in real audio) so hot hashes have long posting lists. Every
+--dup-every-th sample is a noisy copy of another, giving lookups something
+to find. Reports p50/p95/max of find_near_duplicates over --queries samples.
+
+Usage:
+  PYTHONPATH=. python app/backend/tools/bench_landmarks.py [--samples 500000] [--queries 200]
+"""
+import argparse
+import shutil
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+from app.backend.db import get_conn, init_db
+from app.backend.duplicates import find_near_duplicates
+from app.backend.landmarks import MAX_LANDMARKS, encode
+
+CHUNK = 10_000
+
+
+def fake_fingerprint(rng):
+    f1 = np.minimum(rng.gamma(2.0, 30.0, MAX_LANDMARKS), 255).astype(np.uint32)
+    f2 = np.minimum(f1 + rng.integers(-60, 60, MAX_LANDMARKS).clip(-f1.astype(int), None), 255).astype(np.uint32)
+    dt = rng.integers(0, 32, MAX_LANDMARKS, dtype=np.uint32)
+    times = np.sort(rng.integers(0, 400, MAX_LANDMARKS)).astype(np.uint16)
+    return (f1 << 13) | (f2 << 5) | dt, times
+
+
+def build(conn, n: int, dup_every: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    prev = None
+    for start in range(0, n, CHUNK):
+        samples, postings = [], []
+        for i in range(start, min(n, start + CHUNK)):
+            if prev is not None and i % dup_every == 0:
+                # a re-export: most landmarks kept, shifted in time
+                keep = rng.random(MAX_LANDMARKS) < 0.4
+                hashes, times = prev[0][keep], (prev[1][keep] + 7).astype(np.uint16)
+            else:
+                hashes, times = fake_fingerprint(rng)
+            prev = (hashes, times)
+            samples.append((f'{i:064x}', f'/library/{i}.wav', f'{i}.wav', encode(hashes, times)))
+            postings.extend((int(h), f'{i:064x}', int(t)) for h, t in zip(hashes, times))
+        with conn:
+            conn.executemany("INSERT INTO samples (id, full_path, filename, landmarks) VALUES (?, ?, ?, ?)", samples)
+            conn.executemany("INSERT OR IGNORE INTO landmark_index (hash, sample_id, t) VALUES (?, ?, ?)", postings)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--samples', type=int, default=500_000)
+    ap.add_argument('--queries', type=int, default=200)
+    ap.add_argument('--dup-every', type=int, default=50)
+    args = ap.parse_args()
+    tmp = Path(tempfile.mkdtemp(prefix='kass-bench-landmarks-'))
+    try:
+        conn = get_conn(tmp / 'bench.db')
+        init_db(conn)
+        t0 = time.perf_counter()
+        build(conn, args.samples, args.dup_every)
+        postings = conn.execute("SELECT COUNT(*) FROM landmark_index").fetchone()[0]
+        print(f'built {args.samples} samples / {postings} postings in {time.perf_counter() - t0:.0f}s')
+        rng = np.random.default_rng(1)
+        ids = [f'{i:064x}' for i in rng.integers(0, args.samples, args.queries)]
+        timings, found = [], 0
+        for sid in ids:
+            t0 = time.perf_counter()
+            found += bool(find_near_duplicates(conn, sid))
+            timings.append((time.perf_counter() - t0) * 1000)
+        timings.sort()
+        print(f'lookup ms: p50 {timings[len(timings) // 2]:.1f}  p95 {timings[int(len(timings) * 0.95)]:.1f}  '
+              f'max {timings[-1]:.1f}  ({found}/{len(ids)} with matches)')
+        conn.close()
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
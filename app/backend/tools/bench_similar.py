@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""Benchmark: similar-sample search latency over a large timbre store.
+
+Builds a temporary DB and vector store of --samples synthetic embeddings
+(a few hundred timbre clusters plus noise), then reports p50/p95/max of
+find_similar(k=20) over --queries samples, for float32 and int8. The first
+query per mode, which builds the in-process index, is timed separately.
+
+Usage:
+  PYTHONPATH=. python app/backend/tools/bench_similar.py [--samples 500000] [--queries 200]
+"""
+import argparse
+import shutil
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+from app.backend import embeddings
+from app.backend.db import get_conn, init_db
+
+CHUNK = 50_000
+
+
+def build(conn, n: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    centres = rng.standard_normal((300, embeddings.EMBED_DIM)) * 5
+    for start in range(0, n, CHUNK):
+        stop = min(n, start + CHUNK)
+        vecs = centres[rng.integers(0, len(centres), stop - start)] + rng.standard_normal((stop - start, embeddings.EMBED_DIM))
+        ids = [f'{i:064x}' for i in range(start, stop)]
+        with conn:
+            conn.executemany("INSERT INTO samples (id, full_path, filename) VALUES (?, ?, ?)",
+                             ((sid, f'/library/{i}.wav', f'{i}.wav') for i, sid in zip(range(start, stop), ids)))
+            embeddings.put_embeddings(conn, zip(ids, (v.astype(embeddings.DTYPE).tobytes() for v in vecs)))
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--samples', type=int, default=500_000)
+    ap.add_argument('--queries', type=int, default=200)
+    args = ap.parse_args()
+    tmp = Path(tempfile.mkdtemp(prefix='kass-bench-similar-'))
+    try:
+        conn = get_conn(tmp / 'bench.db')
+        init_db(conn)
+        t0 = time.perf_counter()
+        build(conn, args.samples)
+        print(f'built {args.samples} vectors in {time.perf_counter() - t0:.0f}s')
+        rng = np.random.default_rng(1)
+        ids = [f'{i:064x}' for i in rng.integers(0, args.samples, args.queries)]
+        for quantize in (False, True):
+            t0 = time.perf_counter()
+            embeddings.find_similar(conn, ids[0], quantize=quantize)
+            warm = time.perf_counter() - t0
+            timings = []
+            for sid in ids:
+                t0 = time.perf_counter()
+                embeddings.find_similar(conn, sid, quantize=quantize)
+                timings.append((time.perf_counter() - t0) * 1000)
+            timings.sort()
+            print(f"{'int8' if quantize else 'float32'}: index build {warm:.1f}s, query ms: "
+                  f'p50 {timings[len(timings) // 2]:.1f}  p95 {timings[int(len(timings) * 0.95)]:.1f}  max {timings[-1]:.1f}')
+        conn.close()
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""Micro-benchmark: per-row sample upserts vs upsert_samples_bulk.
+
+"legacy" is the original upsert_sample body (named-param dict rebuilt and a
+separate execute per row); "per-row" is the current upsert_sample.
+
+Each batch size is measured on a fresh temporary DB, inserting and then
+re-upserting (update path) the same rows.
+
+Usage:
+  PYTHONPATH=. python app/backend/tools/bench_upsert.py [--sizes 100,1000,10000]
+"""
+import argparse
+import json
+import shutil
+import tempfile
+import time
+from pathlib import Path
+
+from app.backend.db import SAMPLE_COLUMNS, get_conn, init_db, upsert_sample, upsert_samples_bulk
+
+LEGACY_SQL = (
+    f"INSERT INTO samples ({', '.join(SAMPLE_COLUMNS)}) VALUES ({', '.join(':' + c for c in SAMPLE_COLUMNS)}) "
+    "ON CONFLICT(id) DO UPDATE SET "
+    + ', '.join(f"{c}=excluded.{c}" for c in SAMPLE_COLUMNS if c != 'id')
+    + ", updated_at=CURRENT_TIMESTAMP"
+)
+
+
+def make_samples(n: int):
+    out = []
+    for i in range(n):
+        name = f'Kick_{i:06d}_128bpm.wav'
+        full = f'/library/pack_{i // 1000:03d}/{name}'
+        out.append({
+            'id': f'{i:064x}',
+            'full_path': full,
+            'rel_path': full,
+            'root_dir': '/library',
+            'filename': name,
+            'ext': '.wav',
+            'size_bytes': 1024 + i,
+            'bpm_hint': 128,
+            'key_hint': None,
+            'instrument_hint': 'kick',
+            'fuzzy_score': 100.0,
+            'parsed_tokens': json.dumps(['kick', f'{i:06d}', '128bpm']),
+            'mtime_ns': 1_700_000_000_000_000_000 + i,
+            'inode': 10_000 + i,
+        })
+    return out
+
+
+def legacy(conn, samples):
+    with conn:
+        for s in samples:
+            params = {c: s.get(c) for c in SAMPLE_COLUMNS}
+            conn.execute(LEGACY_SQL, params)
+
+
+def per_row(conn, samples):
+    with conn:
+        for s in samples:
+            upsert_sample(conn, s)
+
+
+def bulk(conn, samples):
+    with conn:
+        upsert_samples_bulk(conn, samples)
+
+
+def measure(fn, samples, tmpdir: Path, label: str, repeat: int = 3):
+    best = None
+    for i in range(repeat):
+        conn = get_conn(tmpdir / f'{label}_{len(samples)}_{i}.db')
+        init_db(conn)
+        try:
+            t0 = time.perf_counter()
+            fn(conn, samples)  # insert
+            fn(conn, samples)  # conflict/update
+            dt = time.perf_counter() - t0
+        finally:
+            conn.close()
+        best = dt if best is None else min(best, dt)
+    return (2 * len(samples)) / best if best else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark sample upsert paths')
+    parser.add_argument('--sizes', default='100,500,1000,5000,10000')
+    args = parser.parse_args()
+    sizes = [int(x) for x in args.sizes.split(',') if x.strip()]
+
+    tmpdir = Path(tempfile.mkdtemp(prefix='kass-bench-upsert-'))
+    try:
+        print(f"{'batch':>8} {'legacy rows/s':>14} {'per-row rows/s':>15} {'bulk rows/s':>12} {'vs legacy':>10}")
+        for n in sizes:
+            samples = make_samples(n)
+            old = measure(legacy, samples, tmpdir, 'legacy')
+            row = measure(per_row, samples, tmpdir, 'row')
+            fast = measure(bulk, samples, tmpdir, 'bulk')
+            print(f'{n:>8} {old:>14,.0f} {row:>15,.0f} {fast:>12,.0f} {fast / old if old else 0:>9.2f}x')
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
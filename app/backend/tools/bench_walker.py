@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""Benchmark the scandir walker against the old rglob + is_dir + stat loop.
+
+Without --root a synthetic tree is generated in a temp dir.
+
+Usage:
+  PYTHONPATH=. python app/backend/tools/bench_walker.py [--root /path/to/samples] [--files 20000] [--workers 8]
+"""
+import argparse
+import shutil
+import tempfile
+import time
+from pathlib import Path
+
+from app.backend.scanner import DEFAULT_EXTS
+from app.backend.walker import walk_files
+
+
+def legacy_walk(root: Path):
+    """The pre-walker scan loop: rglob, is_dir per entry, then stat per file."""
+    out = []
+    for p in root.rglob("*"):
+        if p.is_dir():
+            continue
+        if p.suffix.lower() not in DEFAULT_EXTS:
+            continue
+        st = p.stat()
+        out.append((p, st.st_size, st.st_mtime_ns, st.st_ino))
+    return out
+
+
+def make_tree(base: Path, n_files: int, per_dir: int = 50):
+    for i in range(n_files):
+        d = base / f'pack_{i // (per_dir * 20):03d}' / f'dir_{i // per_dir:05d}'
+        if i % per_dir == 0:
+            d.mkdir(parents=True, exist_ok=True)
+        (d / f'sample_{i:06d}.wav').write_bytes(b'0' * 1024)
+
+
+def bench(label: str, fn, repeat: int = 3):
+    best = None
+    count = 0
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        count = len(fn())
+        dt = time.perf_counter() - t0
+        best = dt if best is None else min(best, dt)
+    print(f'{label:<24} {count:>8} files  {best:8.3f}s  {count / best if best else 0:>12,.0f} files/s')
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark directory walkers')
+    parser.add_argument('--root', default=None, help='existing folder to walk (read-only)')
+    parser.add_argument('--files', type=int, default=20000, help='synthetic file count when --root is not given')
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    tmp = None
+    if args.root:
+        root = Path(args.root)
+    else:
+        tmp = Path(tempfile.mkdtemp(prefix='kass-bench-walk-'))
+        root = tmp
+        print(f'Generating {args.files} files under {root} ...')
+        make_tree(root, args.files)
+    try:
+        before = bench('rglob + stat (before)', lambda: legacy_walk(root), args.repeat)
+        bench('scandir, 1 thread', lambda: list(walk_files([root], exts=DEFAULT_EXTS, max_workers=1)), args.repeat)
+        after = bench(f'scandir, {args.workers} threads', lambda: list(walk_files([root], exts=DEFAULT_EXTS, max_workers=args.workers)), args.repeat)
+        print(f'speedup: {before / after:.2f}x')
+    finally:
+        if tmp:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -9,6 +9,8 @@ from pathlib import Path
 import shutil
 import os
 
+from app.backend.classifier import compile_keyword_map
+
 
 KEYWORD_MAP = [
     # FX subcategories (path relative to root)
@@ -46,24 +48,39 @@ KEYWORD_MAP = [
 ]
 
 
-def find_match(filename: str):
-    s = filename.lower()
-    for keywords, rel in KEYWORD_MAP:
-        for kw in keywords:
-            if kw in s:
-                return rel
-    return None
+# (snapshot of KEYWORD_MAP, classifier compiled from it)
+_compiled = (None, None)
+
+
+def keyword_classifier():
+    """The classifier for KEYWORD_MAP, compiled once and again only when
+    KEYWORD_MAP was replaced or edited."""
+    global _compiled
+    key = tuple((tuple(words), folder) for words, folder in KEYWORD_MAP)
+    if _compiled[0] != key:
+        _compiled = (key, compile_keyword_map(KEYWORD_MAP))
+    return _compiled[1]
+
+
+def find_match(filename: str, classifier=None):
+    """Return the folder of the first KEYWORD_MAP entry matching filename.
+    Pass a classifier when matching many names against another map."""
+    if classifier is None:
+        classifier = keyword_classifier()
+    return classifier.first(filename)
 
 
 def refine(root: Path, dry_run: bool = False):
     moved = 0
     total = 0
+    # looked up here rather than at import so callers may swap KEYWORD_MAP first
+    classifier = keyword_classifier()
     for dirpath, dirnames, filenames in os.walk(root):
         # avoid traversing into newly created target dirs by skipping top-level dirs
         for fn in filenames:
             total += 1
             src = Path(dirpath) / fn
-            rel_match = find_match(fn)
+            rel_match = find_match(fn, classifier)
             if not rel_match:
                 continue
             dest_dir = root / rel_match
@@ -0,0 +1,92 @@
+"""Parallel os.scandir based directory walker.
+
+Each directory is listed with a single scandir call on a worker thread and the
+stat info returned by the DirEntry is reused, so callers get size/mtime/inode/
+device for every file without touching the filesystem again.
+"""
+from __future__ import annotations
+
+import os
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from pathlib import Path
+from typing import Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+DEFAULT_WALK_WORKERS = 8
+
+
+class FileRecord(NamedTuple):
+    path: Path
+    size: int
+    mtime_ns: int
+    inode: int
+    dev: int = 0
+    nlink: int = 1
+
+
+def _scan_dir(dirpath: str, exts: Optional[set]) -> Tuple[List[FileRecord], List[str]]:
+    """List one directory. Returns (file records, subdirectory paths)."""
+    files: List[FileRecord] = []
+    subdirs: List[str] = []
+    try:
+        it = os.scandir(dirpath)
+    except OSError:
+        return files, subdirs
+    with it:
+        for entry in it:
+            try:
+                # d_type from readdir answers this without a stat on most filesystems
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.path)
+                    continue
+                if exts is not None and os.path.splitext(entry.name)[1].lower() not in exts:
+                    continue
+                st = entry.stat()
+            except OSError:
+                continue
+            if not entry.is_file():
+                continue
+            files.append(FileRecord(Path(entry.path), st.st_size, st.st_mtime_ns, st.st_ino, st.st_dev, st.st_nlink))
+    return files, subdirs
+
+
+def walk_files(roots: Iterable[Path | str], exts: Optional[Iterable[str]] = None, max_workers: int = DEFAULT_WALK_WORKERS, recursive: bool = True) -> Iterator[FileRecord]:
+    """Yield a FileRecord for every file below `roots`.
+
+    Subdirectories are fanned out across a bounded thread pool; records are
+    yielded as soon as their directory listing completes, so ordering is not
+    deterministic. `exts` filters on lower-cased suffix (including the dot).
+    With recursive=False only files directly inside each root are yielded.
+    """
+    exts_set = set(e.lower() for e in exts) if exts is not None else None
+    pending: deque = deque()
+    for root in roots:
+        root = str(root)
+        if os.path.isdir(root):
+            pending.append(root)
+    if not pending:
+        return
+    if max_workers <= 1 or not recursive:
+        while pending:
+            files, subdirs = _scan_dir(pending.popleft(), exts_set)
+            if recursive:
+                pending.extend(subdirs)
+            yield from files
+        return
+
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='kass-walk') as pool:
+        in_flight = set()
+        try:
+            while pending or in_flight:
+                # keep at most 2x workers listings queued so memory stays bounded
+                while pending and len(in_flight) < max_workers * 2:
+                    in_flight.add(pool.submit(_scan_dir, pending.popleft(), exts_set))
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    files, subdirs = fut.result()
+                    pending.extend(subdirs)
+                    yield from files
+        finally:
+            # consumer stopped early (e.g. cancelled scan): drop queued listings
+            for fut in in_flight:
+                fut.cancel()
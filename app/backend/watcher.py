@@ -0,0 +1,377 @@
+"""Live filesystem watcher for continuous incremental indexing.
+
+Watches scan roots and keeps the samples table in sync without full rescans:
+
+- InotifySource: Linux inotify through ctypes (no extra dependency).
+- PollingSource: periodic walk + (size, mtime_ns, inode) snapshot diff, used
+  when inotify isn't available (macOS, network shares) or on queue overflow.
+
+Events from either source go through a DebouncedQueue that coalesces bursts
+per path (a pack unzip creating thousands of files becomes a few batches) and
+flushes when the tree has been quiet for `debounce` seconds or the oldest
+pending event is `max_latency` old, so indexing latency stays under a second.
+Each flush is applied in one DB transaction. The watcher only indexes; it
+never moves files (classification moves stay with scan_roots).
+
+Usage:
+    python -m app.backend.watcher /path/to/samples --db app/backend/kass.db
+"""
+from __future__ import annotations
+
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import struct
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Iterable, List, NamedTuple, Optional
+
+from . import db as dbmod
+from .db import get_conn, init_db, upsert_samples_bulk
+from .scanner import DEFAULT_EXTS, make_sample
+from .walker import FileRecord, walk_files
+
+log = logging.getLogger(__name__)
+
+# FsEvent.kind values
+UPSERT = 'upsert'        # file created, modified or moved into place
+DELETE = 'delete'        # file deleted or moved away
+DELETE_DIR = 'delete_dir'  # directory deleted or moved away: drop every row below it
+RESCAN = 'rescan'        # directory appeared (or events were lost): index its files
+
+
+class FsEvent(NamedTuple):
+    kind: str
+    path: str
+
+
+# inotify constants (linux/inotify.h)
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+_EVENT_HEADER = struct.Struct('iIII')
+
+
+def _load_libc():
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+        return libc
+    except (OSError, AttributeError):
+        return None
+
+
+def inotify_available() -> bool:
+    return _load_libc() is not None
+
+
+class InotifySource:
+    def __init__(self, roots: Iterable[Path]):
+        self._libc = _load_libc()
+        if self._libc is None:
+            raise OSError('inotify is not available on this platform')
+        self._fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self._wd_paths: Dict[int, str] = {}
+        self._roots = [str(r) for r in roots]
+        for r in self._roots:
+            self._watch_tree(r)
+
+    def _watch_tree(self, top: str):
+        stack = [top]
+        while stack:
+            d = stack.pop()
+            wd = self._libc.inotify_add_watch(self._fd, os.fsencode(d), WATCH_MASK)
+            if wd < 0:
+                log.warning('inotify_add_watch failed for %s (errno %s)', d, ctypes.get_errno())
+                continue
+            self._wd_paths[wd] = d
+            try:
+                with os.scandir(d) as it:
+                    stack.extend(e.path for e in it if e.is_dir(follow_symlinks=False))
+            except OSError:
+                pass
+
+    def _unwatch_tree(self, top: str):
+        prefix = top.rstrip('/') + '/'
+        for wd, p in list(self._wd_paths.items()):
+            if p == top or p.startswith(prefix):
+                self._libc.inotify_rm_watch(self._fd, wd)
+                self._wd_paths.pop(wd, None)
+
+    def read(self, timeout: float) -> List[FsEvent]:
+        r, _, _ = select.select([self._fd], [], [], timeout)
+        if not r:
+            return []
+        try:
+            buf = os.read(self._fd, 256 * 1024)
+        except BlockingIOError:
+            return []
+        events: List[FsEvent] = []
+        off = 0
+        while off + _EVENT_HEADER.size <= len(buf):
+            wd, mask, _cookie, length = _EVENT_HEADER.unpack_from(buf, off)
+            raw = buf[off + _EVENT_HEADER.size: off + _EVENT_HEADER.size + length]
+            off += _EVENT_HEADER.size + length
+            if mask & IN_Q_OVERFLOW:
+                # kernel dropped events: fall back to re-indexing the roots
+                log.warning('inotify queue overflow; rescanning roots')
+                events.extend(FsEvent(RESCAN, r) for r in self._roots)
+                continue
+            if mask & IN_IGNORED:
+                self._wd_paths.pop(wd, None)
+                continue
+            base = self._wd_paths.get(wd)
+            if base is None:
+                continue
+            name = os.fsdecode(raw.split(b'\0', 1)[0])
+            path = os.path.join(base, name) if name else base
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    self._watch_tree(path)
+                    # files may have landed before the watch existed
+                    events.append(FsEvent(RESCAN, path))
+                elif mask & (IN_MOVED_FROM | IN_DELETE):
+                    self._unwatch_tree(path)
+                    events.append(FsEvent(DELETE_DIR, path))
+            elif mask & IN_DELETE_SELF:
+                if base in self._roots:
+                    events.append(FsEvent(DELETE_DIR, base))
+            elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+                events.append(FsEvent(UPSERT, path))
+            elif mask & (IN_MOVED_FROM | IN_DELETE):
+                events.append(FsEvent(DELETE, path))
+        return events
+
+    def close(self):
+        try:
+            os.close(self._fd)
+        except OSError:
+            pass
+
+
+class PollingSource:
+    """Snapshot-diff fallback. One walk per interval, reusing walker stat info."""
+
+    def __init__(self, roots: Iterable[Path], exts: Iterable[str], interval: float = 2.0):
+        self._roots = [Path(r) for r in roots]
+        self._exts = set(exts)
+        self._interval = interval
+        self._snapshot = self._take()
+        self._next = time.monotonic() + interval
+
+    def _take(self) -> Dict[str, tuple]:
+        return {str(r.path): (r.size, r.mtime_ns, r.inode) for r in walk_files(self._roots, exts=self._exts)}
+
+    def read(self, timeout: float) -> List[FsEvent]:
+        wait = self._next - time.monotonic()
+        if wait > 0:
+            time.sleep(min(wait, timeout))
+            if time.monotonic() < self._next:
+                return []
+        self._next = time.monotonic() + self._interval
+        snap = self._take()
+        old = self._snapshot
+        self._snapshot = snap
+        events = [FsEvent(UPSERT, p) for p, st in snap.items() if old.get(p) != st]
+        events.extend(FsEvent(DELETE, p) for p in old if p not in snap)
+        return events
+
+    def close(self):
+        pass
+
+
+class DebouncedQueue:
+    """Coalesces events per path; the latest event for a path wins."""
+
+    def __init__(self, debounce: float = 0.2, max_latency: float = 0.8, max_batch: int = 5000):
+        self.debounce = debounce
+        self.max_latency = max_latency
+        self.max_batch = max_batch
+        self._pending: Dict[str, str] = {}
+        self._first = 0.0
+        self._last = 0.0
+
+    def __len__(self):
+        return len(self._pending)
+
+    def put(self, events: Iterable[FsEvent]):
+        now = time.monotonic()
+        for ev in events:
+            if not self._pending:
+                self._first = now
+            if ev.kind == DELETE_DIR:
+                # anything queued below a vanished directory is moot
+                prefix = ev.path.rstrip('/') + '/'
+                for p in [p for p in self._pending if p.startswith(prefix)]:
+                    del self._pending[p]
+            self._pending.pop(ev.path, None)  # re-insert so ordering follows the latest event
+            self._pending[ev.path] = ev.kind
+            self._last = now
+
+    def due(self) -> bool:
+        if not self._pending:
+            return False
+        now = time.monotonic()
+        return (now - self._last >= self.debounce
+                or now - self._first >= self.max_latency
+                or len(self._pending) >= self.max_batch)
+
+    def drain(self) -> List[FsEvent]:
+        out = [FsEvent(kind, path) for path, kind in self._pending.items()]
+        self._pending = {}
+        return out
+
+
+class LibraryWatcher:
+    def __init__(self, roots: List[str], db_path: Optional[str] = None, exts: Optional[Iterable[str]] = None, min_size: int = 512,
+                 debounce: float = 0.2, max_latency: float = 0.8, backend: str = 'auto', poll_interval: float = 2.0):
+        self.roots = [Path(r).resolve() for r in roots]
+        self.db_path = db_path
+        self.exts = set(e.lower() for e in (exts or DEFAULT_EXTS))
+        self.min_size = min_size
+        self.queue = DebouncedQueue(debounce=debounce, max_latency=max_latency)
+        self.backend = backend
+        self.poll_interval = poll_interval
+        self.stats = {'upserted': 0, 'deleted': 0, 'batches': 0}
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _root_for(self, path: str) -> Optional[Path]:
+        """The innermost watched root containing `path` (None if outside all)."""
+        best = None
+        for r in self.roots:
+            rs = str(r)
+            if (path == rs or path.startswith(rs.rstrip('/') + '/')) and (best is None or len(rs) > len(str(best))):
+                best = r
+        return best
+
+    def _record(self, path: str) -> Optional[FileRecord]:
+        if os.path.splitext(path)[1].lower() not in self.exts:
+            return None
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        if not os.path.isfile(path) or st.st_size < self.min_size:
+            return None
+        return FileRecord(Path(path), st.st_size, st.st_mtime_ns, st.st_ino, st.st_dev, st.st_nlink)
+
+    def apply(self, conn, events: List[FsEvent]):
+        """Apply one coalesced batch in a single transaction."""
+        samples: List[dict] = []
+        deletes: List[str] = []
+        dir_deletes: List[str] = []
+        for ev in events:
+            if ev.kind == DELETE_DIR:
+                dir_deletes.append(ev.path)
+            elif ev.kind == RESCAN:
+                for rec in walk_files([ev.path], exts=self.exts):
+                    root = self._root_for(str(rec.path))
+                    if rec.size >= self.min_size and root is not None:
+                        samples.append(make_sample(rec, root))
+            elif ev.kind == DELETE:
+                deletes.append(ev.path)
+            else:
+                rec = self._record(ev.path)
+                root = self._root_for(ev.path)
+                if rec is None or root is None:
+                    # gone again (or filtered) by the time the batch ran
+                    deletes.append(ev.path)
+                else:
+                    samples.append(make_sample(rec, root))
+        with conn:
+            # upserts first: a move arrives as a delete of the old path plus an
+            # upsert of the new one, and the upsert re-points the existing row
+            # (same id) so the delete below no longer matches it
+            if samples:
+                dbmod.reconcile_samples(conn, samples)
+                upsert_samples_bulk(conn, samples)
+                dbmod.restore_from_tombstones(conn, samples)
+            for d in dir_deletes:
+                dbmod.delete_samples_under(conn, d, tombstone=True)
+            if deletes:
+                dbmod.delete_samples_by_path(conn, deletes, tombstone=True)
+        self.stats['upserted'] += len(samples)
+        self.stats['deleted'] += len(deletes)
+        self.stats['batches'] += 1
+        log.info('watcher batch: %d upserted, %d deleted, %d dirs dropped', len(samples), len(deletes), len(dir_deletes))
+
+    def _open_source(self):
+        if self.backend in ('auto', 'inotify'):
+            try:
+                return InotifySource(self.roots)
+            except OSError:
+                if self.backend == 'inotify':
+                    raise
+                log.info('inotify unavailable; falling back to polling every %.1fs', self.poll_interval)
+        return PollingSource(self.roots, self.exts, interval=self.poll_interval)
+
+    def run(self):
+        """Block until stop() is called."""
+        conn = get_conn(self.db_path) if self.db_path else get_conn()
+        init_db(conn)
+        source = self._open_source()
+        try:
+            while not self._stop.is_set():
+                self.queue.put(source.read(timeout=0.05 if len(self.queue) else 0.5))
+                if self.queue.due():
+                    self.apply(conn, self.queue.drain())
+            if len(self.queue):
+                self.apply(conn, self.queue.drain())
+        finally:
+            source.close()
+            conn.close()
+
+    def start(self) -> 'LibraryWatcher':
+        self._thread = threading.Thread(target=self.run, name='kass-watcher', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout: Optional[float] = 5.0):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Watch sample roots and keep the index up to date')
+    parser.add_argument('roots', nargs='+')
+    parser.add_argument('--db', default=None)
+    parser.add_argument('--min-size', type=int, default=512)
+    parser.add_argument('--poll', action='store_true', help='Force the polling backend')
+    parser.add_argument('--poll-interval', type=float, default=2.0)
+    parser.add_argument('--log-level', default='INFO')
+    args = parser.parse_args()
+    logging.basicConfig(level=getattr(logging, args.log_level.upper(), logging.INFO), format='%(asctime)s %(levelname)s %(message)s')
+    w = LibraryWatcher(args.roots, db_path=args.db, min_size=args.min_size, backend='poll' if args.poll else 'auto', poll_interval=args.poll_interval)
+    try:
+        w.run()
+    except KeyboardInterrupt:
+        pass
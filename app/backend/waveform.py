@@ -0,0 +1,128 @@
+"""Precomputed waveform peaks.
+
+A waveform is a min/max pyramid: the finest level holds up to LEVELS[0]
+(min, max) columns, each coarser level merges groups of LEVEL_STEP columns
+of the one before it. Values are normalised to the sample's absolute peak
+and stored as int8, so the 128-column level a list row draws is 256 bytes.
+
+Blob layout (little endian): scale (float32, the absolute peak),
+duration (float32), level count (uint8), width per level (uint16 each),
+then the int8 min/max pairs of every level, finest first.
+"""
+from __future__ import annotations
+
+import struct
+from typing import Iterable, List, NamedTuple, Optional
+
+import numpy as np
+
+# columns of the finest level; coarser levels divide by LEVEL_STEP
+LEVELS = (2048, 512, 128)
+LEVEL_STEP = 4
+
+_HEADER = struct.Struct('<ffB')
+
+
+class Waveform(NamedTuple):
+    scale: float
+    duration: Optional[float]
+    # (width, 2) int8 min/max arrays, finest first
+    levels: List[np.ndarray]
+
+    def level_for(self, width: int) -> np.ndarray:
+        """The coarsest level with at least `width` columns (else the finest)."""
+        for peaks in reversed(self.levels):
+            if len(peaks) >= width:
+                return peaks
+        return self.levels[0]
+
+
+def _pyramid(mins: np.ndarray, maxs: np.ndarray, duration: Optional[float]) -> Waveform:
+    """Quantise finest-level column extremes and reduce them level by level."""
+    if len(mins) == 0:
+        return Waveform(0.0, duration, [np.zeros((0, 2), np.int8)])
+    scale = float(max(abs(mins.min()), abs(maxs.max())))
+    levels = []
+    for _ in LEVELS:
+        q = np.stack([mins, maxs], axis=1) / (scale or 1.0)
+        levels.append(np.round(q * 127).astype(np.int8))
+        n = len(mins) // LEVEL_STEP
+        if n == 0:
+            break
+        mins = mins[:n * LEVEL_STEP].reshape(n, LEVEL_STEP).min(axis=1)
+        maxs = maxs[:n * LEVEL_STEP].reshape(n, LEVEL_STEP).max(axis=1)
+    return Waveform(scale, duration, levels)
+
+
+def compute(y: np.ndarray, duration: Optional[float] = None) -> Waveform:
+    """Build the pyramid from mono samples with reshapes, not Python loops."""
+    y = np.asarray(y, dtype=np.float32)
+    width = min(LEVELS[0], len(y))
+    if width == 0:
+        return _pyramid(y, y, duration)
+    block = -(-len(y) // width)
+    # edge padding repeats the last sample, so it can't add a new extreme
+    cols = np.pad(y, (0, block * width - len(y)), mode='edge').reshape(width, block)
+    return _pyramid(cols.min(axis=1), cols.max(axis=1), duration)
+
+
+def compute_blocks(blocks: Iterable[np.ndarray], frames: int, duration: Optional[float] = None) -> Waveform:
+    """Same columns as compute() over a file of `frames` mono samples that
+    arrives in blocks, so a long file never has to be in memory at once."""
+    width = min(LEVELS[0], frames)
+    block = -(-frames // width) if width else 1
+    mins = np.full(width, np.inf, np.float32)
+    maxs = np.full(width, -np.inf, np.float32)
+    pos, last = 0, 0.0
+    for chunk in blocks:
+        n = min(len(chunk), frames - pos)
+        if n <= 0:
+            break
+        chunk = chunk[:n]
+        # chunk offsets where a new column starts (plus the chunk start)
+        starts = np.unique(np.r_[0, np.arange(-pos % block, n, block)])
+        cols = (pos + starts) // block
+        np.minimum.at(mins, cols, np.minimum.reduceat(chunk, starts))
+        np.maximum.at(maxs, cols, np.maximum.reduceat(chunk, starts))
+        pos += n
+        last = chunk[-1]
+    # columns past the end hold the last sample, like compute()'s edge padding
+    unseen = ~np.isfinite(mins)
+    mins[unseen] = maxs[unseen] = last
+    return _pyramid(mins, maxs, duration)
+
+
+def compute_file(path) -> Optional[Waveform]:
+    """Waveform of a whole file, streamed in blocks when libsndfile can read
+    it. None if the file can't be decoded."""
+    import soundfile as sf
+    try:
+        with sf.SoundFile(str(path)) as f:
+            blocks = (b.mean(axis=1) for b in f.blocks(blocksize=1 << 16, dtype='float32', always_2d=True))
+            return compute_blocks(blocks, f.frames, f.frames / float(f.samplerate))
+    except Exception:
+        pass
+    try:
+        import librosa
+        y, sr = librosa.load(str(path), sr=None, mono=True)
+        return compute(y, len(y) / float(sr))
+    except Exception:
+        return None
+
+
+def encode(wf: Waveform) -> bytes:
+    widths = [len(p) for p in wf.levels]
+    head = _HEADER.pack(wf.scale, wf.duration or 0.0, len(widths)) + struct.pack(f'<{len(widths)}H', *widths)
+    return head + b''.join(p.tobytes() for p in wf.levels)
+
+
+def decode(blob: bytes) -> Waveform:
+    scale, duration, n = _HEADER.unpack_from(blob)
+    off = _HEADER.size
+    widths = struct.unpack_from(f'<{n}H', blob, off)
+    off += 2 * n
+    levels = []
+    for w in widths:
+        levels.append(np.frombuffer(blob, np.int8, 2 * w, off).reshape(w, 2))
+        off += 2 * w
+    return Waveform(scale, duration or None, levels)
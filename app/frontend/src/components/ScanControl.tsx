@@ -60,13 +60,45 @@ export default function ScanControl() {
         headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify({ roots: rootsArr, db_path: dbPath || undefined, batch_size: batchSize, min_size: minSize }),
       })
-      const j = await resp.json()
-      // `scan_roots` returns planned_move_examples when dry_run=True
-      if (j && j.planned_move_examples) {
-        setPlannedMoves(j.planned_move_examples.map((t: any) => ({ src: t[0], dst: t[1] })))
+      // NDJSON stream: one planned move per line, then a {summary} line.
+      // New moves are appended at most every MOVES_FLUSH_MS so a large dry
+      // run doesn't re-render (or copy the list) on every network chunk.
+      type Move = {src:string;dst:string;reasons?:string[]}
+      const MOVES_FLUSH_MS = 200
+      let pending: Move[] = []
+      let lastFlush = 0
+      const flushMoves = () => {
+        if (!pending.length) return
+        const chunk = pending
+        pending = []
+        lastFlush = Date.now()
+        setPlannedMoves(prev => prev.concat(chunk))
       }
+      let summary: any = null
+      const handleLine = (line: string) => {
+        if (!line.trim()) return
+        const entry = JSON.parse(line)
+        if (entry.summary || entry.error) summary = entry.summary || entry
+        else pending.push(entry)
+      }
+      const reader = resp.body!.getReader()
+      const decoder = new TextDecoder()
+      let buf = ''
+      setPlannedMoves([])
+      setJob({ id: 'dryrun', status: 'running' })
+      for (;;) {
+        const { done, value } = await reader.read()
+        if (done) break
+        buf += decoder.decode(value, { stream: true })
+        const lines = buf.split('\n')
+        buf = lines.pop() || ''
+        lines.forEach(handleLine)
+        if (Date.now() - lastFlush >= MOVES_FLUSH_MS) flushMoves()
+      }
+      handleLine(buf)
+      flushMoves()
       // also show summary in job area
-      setJob({ id: 'dryrun', status: 'done', result: j })
+      setJob({ id: 'dryrun', status: 'done', result: summary })
     } catch (e) {
       console.warn('dryrun failed', e)
     }